@@ -3,6 +3,7 @@
 # IoT connection to adafruitio to access data on adafruitio
 # ===================================================================================================================
 
+import os
 import time
 import busio
 import analogio
@@ -27,6 +28,8 @@ from adafruit_espatcontrol import adafruit_espatcontrol_wifimanager
 import adafruit_minimqtt.adafruit_minimqtt as MQTT
 from adafruit_io.adafruit_io import IO_MQTT
 from secrets import secrets
+from lag_buffer import CO2LagBuffer
+from sd_logger import SDLogger
 
 # release display from previous screen use
 displayio.release_displays()
@@ -133,6 +136,8 @@ filename = "{:04}-{:02}-{:02},{:02}-{:02}-{:02}".format(
 # mount sd card
 vfs = storage.VfsFat(sd)
 storage.mount(vfs, "/sd")
+# the log stays open, rows are written in batches of 10 or every 2 minutes
+sd_log = SDLogger(open, f"/sd/{filename}.csv", max_rows=10, max_age=120, sync=os.sync)
 
 # screen settings
 # oled reset pin
@@ -209,7 +214,9 @@ dict_err = {"lux_err": 0, "amb_err": 0,
             "sys_err": 0, "temp_err": 0, 
             "humid_err": 0, "press_err": 0}
 
-ambient_CO2_list = []
+# ambient CO2 readings are compared 15 readings later, once the air has passed through the system
+ambient_CO2_lag = CO2LagBuffer(15)
+actual_ambient = 0.0
 
 def lux_measuring():
     # turn LED on
@@ -234,9 +241,9 @@ def pressure_measuring():
 
 def CO2_measuring():
     try:
-        global CO2_ambient
+        global CO2_ambient, actual_ambient
         CO2_ambient = scd_ambient.CO2
-        ambient_CO2_list.append(CO2_ambient)
+        actual_ambient = ambient_CO2_lag.push(CO2_ambient)
     except:
         dict_err["amb_err"] =+1
         pass
@@ -248,16 +255,7 @@ def CO2_measuring():
         pass
     try:
         global CO2_biofilm
-        CO2_biofilm = float(CO2_system) - float(CO2_ambient)
-    except:
-        pass
-    try:
-        if len(ambient_CO2_list) == 16 :
-            actual_ambient = ambient_CO2_list[0]
-            CO2_biofilm = float(CO2_system) - float(actual_ambient)
-            ambient_CO2_list.pop(0)
-        else:
-            pass
+        CO2_biofilm = float(CO2_system) - float(actual_ambient)
     except:
         pass
 
@@ -321,7 +319,7 @@ def screen_update():
 def write_sd():
     # write readings to sd card
     try:
-        file.write(
+        sd_log.append(
             "{}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}\n".format(
                 Time_stamp, elapsed_time, luminosity1, luminosity2, CO2_ambient, CO2_system, CO2_biofilm, Temp, Humid, pressure, dict_err
             )
@@ -361,8 +359,8 @@ def adafruit_upload():
 start_time = 0.0
 initial_time = time.monotonic()
 
-while True:
-    with open(f"/sd/{filename}.csv", "a") as file:
+try:
+    while True:
         try:
             if (time.monotonic() - start_time) > measurement_interval:
                 # get readings from sensors 
@@ -383,7 +381,11 @@ while True:
                 start_time = time.monotonic()
                 # set intervals at which readings should be taken
                 # check lag in logging
+            # flush rows that have waited too long
+            sd_log.poll()
         except:
+                sd_log.flush()
                 continue
-    file.close()
+finally:
+    sd_log.close()
 
@@ -4,92 +4,539 @@
 # Refactored for OOP
 # ===================================================================================================================
 
+import json
 import time
-import busio
-import analogio
-import board
-import storage
-import displayio
-import terminalio
-from adafruit_display_text import label
-import adafruit_displayio_ssd1306
-import sdcardio
-import adafruit_veml7700
-import digitalio
-import adafruit_scd30
-import adafruit_datetime
-from adafruit_display_shapes.circle import Circle
-from adafruit_ds3231 import DS3231
-from adafruit_dps310 import DPS310
-import adafruit_requests as requests
-import adafruit_espatcontrol.adafruit_espatcontrol_socket as socket
-from adafruit_espatcontrol import adafruit_espatcontrol
-from adafruit_espatcontrol import adafruit_espatcontrol_wifimanager
-import adafruit_minimqtt.adafruit_minimqtt as MQTT
-from adafruit_io.adafruit_io import IO_MQTT
-from secrets import secrets
+from array import array
+from pico_backend import PicoBackend
+from lag_buffer import CO2LagBuffer
+from scheduler import Rotation, Scheduler
+from sd_logger import SDLogger
+from binlog import ERROR_KEYS, BinaryLogger, rtc_epoch
+from chunklog import INDEX_EXTENSION, ChunkWriter
+from backfill import Backfill
+from outbox import Outbox, iso_timestamp
+from throttle import PublishGovernor, TokenBucket
+from display_renderer import BusTimer, DisplayRenderer
+from sparkline import HistoryView, Sparkline
+from acquisition import FAILED, AcquisitionEngine, Source
+from chambers import ChamberConfig, mux_chambers
+from sample_record import CHANNEL_SOURCES, CHANNELS, ROW_MAX, ConsoleReport, RowFormatter, SampleRecord
+from memprobe import MemoryProbe
+from profiler import Profiler
+from dsp import ChannelFilters, Ema, GasCompensation, HampelFilter, Kalman, Pipeline, TumblingWindow
+from adaptive import AdaptiveRate, LagClock, SignalActivity
+from light import LightMeter
+from co2 import CO2Sensor
+from rollup import Rollup
+from startup import NetworkLink, PeripheralUnavailable, StartupReport, SystemRTC, available
+from resilience import CheckpointStore, FileSlots, NvmSlots, Supervisor
 
 # Define constants 
 Reading_interval = 30
-I2C_SDA_PIN = board.GP5
-I2C_SCL_PIN = board.GP4
-I2C_SDA_PIN_2 = board.GP27
-I2C_SCL_PIN_2 = board.GP26
-LED_PIN = board.GP2
-LED_PIN_2 = board.GP7
-WIFI_RX_PIN = board.GP17
-WIFI_TX_PIN = board.GP16
-OLED_RESET_PIN = board.GP20
-SD_CS_PIN = board.GP15
-SD_SCK_PIN = board.GP10
-SD_MOSI_PIN = board.GP11
-SD_MISO_PIN = board.GP12
-Display_width = 128
-Display_height = 64
-Display_border = 0
-displayio.release_displays()
+# Readings it takes ambient air to reach the system sensor, raise it for longer transit times or faster sampling
+CO2_lag_depth = 15
+# Subtract the running mean of the lag window instead of the single lagged ambient reading
+CO2_smoothed_baseline = False
+# Filter the CO2 and lux channels before they are shown and uploaded, see dsp.py. The SD card logs the raw readings.
+Signal_processing = True
+# Hampel outlier rejection: window in readings and threshold in scaled MADs
+Filter_window = 7
+Filter_threshold = 3.5
+# Kalman filter of each SCD30: drift between readings and measurement noise, both in ppm squared
+CO2_kalman = (0.5, 9.0)
+# Time constant of the lux smoothing in seconds
+Lux_time_constant = 60
+# Correct the CO2 readings to 1013.25 hPa with the DPS310's pressure, and to 25 C with its temperature. The SCD30
+# already compensates its own temperature, so only turn the latter on if the DPS310 sits in the gas path.
+# The pressure correction is skipped while SCD30_pressure_compensation hands the pressure to the sensors instead.
+CO2_pressure_compensation = True
+CO2_temperature_compensation = False
+# The SCD30s measure continuously, see co2.py. Their measurement interval follows the sampling interval so that
+# CO2_measurements_per_sample measurements are taken per sample (within 2-1800 s) rather than one every 2 s.
+CO2_measurements_per_sample = 2
+# Give the SCD30s the DPS310's pressure so they compensate their readings themselves. It is only rewritten when it
+# moves by SCD30_pressure_step hPa, each write restarts the measurement.
+SCD30_pressure_compensation = True
+SCD30_pressure_step = 2.0
+# SCD30s running automatic self-calibration, "ambient" and/or "system". It assumes the sensor sees fresh air for an
+# hour every day, so never the system sensor: its gas always carries the biofilm's CO2.
+SCD30_self_calibration = ()
+# SCD30 whose humidity is logged: "system" for the gas path, "ambient" for the room as Code_with_MQTT.py logged it
+Humidity_sensor = "system"
+# Seconds of filtered readings summarised as mean/min/max in the periodic stats
+Signal_window = 600
+# Let the biofilm CO2 and the lux through the biofilm set the sampling interval, see adaptive.py. It starts at
+# Reading_interval and stays between Adaptive_floor and Adaptive_ceiling seconds; CO2_lag_depth then counts
+# Reading_interval steps of time rather than samples.
+Adaptive_sampling = False
+Adaptive_floor = 5
+Adaptive_ceiling = 300
+# (slope per minute, spread) at which a signal counts as active: biofilm CO2 in ppm, lux in lux
+Adaptive_co2_limits = (6.0, 10.0)
+Adaptive_lux_limits = (30.0, 25.0)
+# Calm samples in a row before the interval is lengthened
+Adaptive_calm_samples = 5
+# Lux is measured with the LED lit for a single integration and the dark reading before it subtracted, see light.py.
+# Auto-ranging picks the VEML7700 gain and integration time per sample, otherwise Light_gain/Light_integration_time
+# (also the starting point when auto-ranging) are kept.
+Light_auto_range = True
+Light_gain = "ALS_GAIN_1_8"
+Light_integration_time = "ALS_100MS"
+# Counts the lit reading should reach when auto-ranging, 1000 resolves 0.1 %
+Light_min_counts = 1000
+# Samples a dark reading is reused for while the setting doesn't change
+Light_dark_every = 1
+# Longest a sample waits for the sensors' data-ready flags, the SCD30s have a measurement waiting and a lux reading at
+# the longest integration takes 2 x 0.88 s.
+# Sensors that aren't ready by then keep their previous reading and are reported stale.
+Acquisition_timeout = 2.5
+Acquisition_poll_interval = 0.01
+# Periods of the other scheduler tasks in seconds, sampling runs every Reading_interval
+Display_interval = 1
+# Highest rate the SSD1306 frame is pushed over the shared I2C bus
+Display_max_fps = 2
+# Data shown by each number label and its decimals
+Display_fields = (
+    ("lux_start", 0), ("lux_end", 0), ("ambient_co2", 0),
+    ("system_co2", 0), ("biofilm_co2", 2), ("temperature", 2),
+)
+# Pages the display turns through, each shown for Display_page_seconds: "numbers" are the labels above, "graph" a
+# sparkline of each Display_graph_fields entry, one column per sample (see sparkline.py)
+Display_pages = ("numbers", "graph")
+Display_page_seconds = 10
+# Caption, data key and decimals of the caption's range for each sparkline
+Display_graph_fields = (("CO2", "biofilm_co2", 2), ("Lux", "lux_end", 0))
+# Longest a display run spends drawing sparkline columns, the rest is drawn on its next run
+Display_graph_budget = 0.02
+SD_flush_interval = 5
+MQTT_interval = 1
+MQTT_loop_timeout = 0.1
+Error_report_interval = 300
+# SD rows are buffered and written once either limit is reached or the oldest row is SD_flush_age seconds old
+SD_flush_rows = 10
+SD_flush_bytes = 2048
+SD_flush_age = 120
+# Write each run as chunk files with a time index next to them (<log>.0000.csv, ... and <log>.idx), see
+# chunklog.py. A new chunk starts once one would pass SD_chunk_bytes or a new SD_chunk_seconds period of RTC time
+# begins, so the default gives a file per calendar day. False keeps the single <log>.csv per boot.
+SD_chunked = True
+SD_chunk_bytes = 1048576
+SD_chunk_seconds = 86400
+# Buckets in seconds of the count/min/mean/max summaries of every channel kept next to the log as
+# <log>-rollup-<seconds>.bin, see rollup.py. Long-range plots read these on the host (analysis.read_rollup) instead
+# of the whole run; () turns them off.
+SD_rollup_periods = (60, 3600, 86400)
+# Adafruit IO group the readings are published to, and its feed keys for biofilm CO2, lux start and lux end
+AIO_group = "biofilm"
+# MQTT broker the readings go to: Adafruit IO, or a gateway on the local network (python -m gateway). Messages go to
+# <prefix>/groups/<AIO_group>, the prefix is the MQTT username: None keeps the AIO username Adafruit IO requires.
+# A gateway files readings by the prefix, so give each device its own there, e.g. "lab2-pico1". None keeps the
+# library's default port.
+MQTT_broker = "io.adafruit.com"
+MQTT_port = None
+MQTT_topic_prefix = None
+AIO_group_feeds = ("co2", "lux-start", "lux-end")
+# Readings held in memory while Adafruit IO is unreachable, older ones are spilled to the SD card
+Outbox_capacity = 32
+# Replay what Adafruit IO missed (outbox overflow, reboots) from the SD log with the original timestamps, see
+# backfill.py. Needs SD_chunked; the outbox then drops its overflow instead of spilling it, the log has it anyway.
+# While replaying, live uploads give up AIO_backfill_share of their rate budget to it. With Signal_processing the
+# replayed rows, raw on the card, are filtered like live ones: lux through the same stages, biofilm CO2 through the
+# CO2 outlier and Kalman stages applied to the logged difference, primed on AIO_backfill_warmup seconds of rows
+# before each gap. Replayed biofilm CO2 is therefore close to, not identical with, what live uploads would have sent.
+AIO_backfill = True
+AIO_backfill_share = 0.5
+AIO_backfill_warmup = 600
+# Adafruit IO data points per minute for the account (30 on the free tier) and the share uploads may use.
+# Readings are averaged over windows sized to fit the budget, so Reading_interval can be lowered freely.
+AIO_rate_limit = 30
+AIO_rate_share = 0.8
+# Also publish the per-window minimum and maximum as <feed>-min and <feed>-max
+AIO_publish_extremes = False
+# Adafruit IO feed the stage profile is published to every Error_report_interval, None to keep it local.
+# It is also printed then and appended to <log>-profile.csv on the SD card.
+Diagnostics_feed = None
+# Print the bytes each sample allocated and the time an explicit gc.collect() after it takes
+Debug_memory = False
+# "csv" for text rows, "binary" for 48 byte binlog records, decoded on the host with binlog_export.py
+SD_log_format = "csv"
+# Reactors driven by this controller, see chambers.py. More than one runs them as a Biofilm_Fleet, e.g. four
+# chambers behind a TCA9548A on the first bus, with LED_pins listing a pair of pins for each:
+#   Chambers = mux_chambers(4)
+#   LED_pins = ("GP2", "GP7", "GP3", "GP6", "GP8", "GP9", "GP13", "GP14")
+Chambers = (ChamberConfig(),)
+# LED pins by index, ChamberConfig.leds picks a chamber's two and mux_chambers(n) uses 0 to 2n - 1. An index without
+# a pin leaves that LED unavailable at bring-up.
+LED_pins = ("GP2", "GP7")
+# Chamber shown on the display
+Display_chamber = 0
+# How often the fleet checks which chambers are due for a sample
+Fleet_tick = 0.5
+# Hardware watchdog, see resilience.py: the board resets when it isn't fed for Watchdog_timeout seconds (8.3 at
+# most on the RP2040), which happens when a call blocks the event loop. A task running or awaiting for longer than
+# Watchdog_stall_factor times its deadline, or not released for that long past its period, checkpoints and reloads
+# the code instead. None turns the supervision off.
+Watchdog_timeout = 8
+Watchdog_feed_interval = 1
+Watchdog_stall_factor = 4
+# Longest WiFi join and Adafruit IO connect in seconds, one attempt each. The steps run inside the event loop, so
+# this is how long sampling, SD and display can be held up, and it has to fit within the watchdog timeout
+Network_step_timeout = 5
+# Restarts in a row (reloads and watchdog resets without Checkpoint_interval of running in between) after which the
+# board starts cold with the watchdog off, rather than keep resetting
+Watchdog_max_restarts = 3
+# Seconds between checkpoints of what a restart would lose: the lag window, error counters, log run and open rollup
+# buckets. "sd" keeps them on the card, "nvm" in microcontroller.nvm, which is flash: give it an interval of 15 min or
+# more. 0 turns checkpoints off.
+Checkpoint_interval = 60
+Checkpoint_store = "sd"
+# A board back within this many seconds (RTC) of its last checkpoint resumes from it instead of starting a new run
+Warm_restart_window = 600
+
+# Peripherals one controller has once, shared by all its chambers
+SHARED_ATTRIBUTES = ("startup", "network", "profiler", "i2c", "i2c2", "muxes", "dps310", "rtc", "sd_root", "sd_open",
+                     "display", "text_labels", "number_labels", "bus_timer", "display_renderer", "history_view",
+                     "upload_bucket", "supervisor", "checkpoints", "resumed")
 
 class Biofilm_Measure:
-    def __init__(self):
-        self.setup_i2c()
+    def __init__(self, backend=None, chamber: ChamberConfig = None, shared=None):
+        # backend supplies every peripheral, sim_backend.SimBackend runs the same loop on CPython.
+        # chamber picks the sensors, LEDs, feeds and log file; shared is another chamber of the same controller
+        # whose buses, RTC, SD card, network and display are reused.
+        if backend is None:
+            backend = shared.backend if shared is not None else PicoBackend(led_pins=LED_pins)
+        self.backend = backend
+        self.chamber = chamber if chamber is not None else ChamberConfig()
+        # Local peripherals come up first and a missing one is marked unavailable instead of stopping the boot.
+        # The network is only brought up by the MQTT task once sampling runs, see startup.py.
+        if shared is None:
+            self.startup = StartupReport(self.backend.monotonic)
+            self.profiler = Profiler()
+            self.setup_supervision()
+            self.setup_i2c()
+            self.setup_rtc()
+            self.setup_sd_card()
+            self.setup_checkpoints()
+            self.setup_display()
+            self.dps310 = self.startup.bring_up("dps310", lambda: self.backend.dps310(self.i2c))
+            self.setup_network()
+            self.setup_upload_bucket()
+        else:
+            for name in SHARED_ATTRIBUTES:
+                setattr(self, name, getattr(shared, name))
+        self.setup_stages()
         self.setup_sensors()
         self.setup_leds()
-        self.setup_wifi()
-        self.setup_adafruit_io()
-        self.setup_rtc()
+        self.setup_acquisition()
         self.setup_SD()
-        self.setup_display()
+        self.setup_outbox()
+        self.setup_backfill()
 
-        self.ambient_CO2_list = []
-        self.start_time = time.monotonic()
+        self.ambient_CO2_lag = CO2LagBuffer(CO2_lag_depth)
+        self.setup_adaptive_rate()
+        self.setup_signal_processing()
+        # the filtered ambient readings lag the filtered system ones the same way
+        self.filtered_CO2_lag = CO2LagBuffer(CO2_lag_depth) if self.filters is not None else None
+        self.start_time = self.backend.monotonic()
         self.error_dict = {
             "lux_start": 0, "lux_end": 0, "ambient_co2": 0, 
             "system_co2": 0, "temp": 0, "humidity": 0, "pressure": 0
         }
+        self.latest_data = None
+        self.display_dirty = False
+        self.pending_upload = None
+        # reused every cycle, collect_data hands out the same record each time. The SD card gets the raw readings
+        # in raw_record, the display and uploads the filtered ones in record; they're one record without filters.
+        self.record = SampleRecord()
+        self.raw_record = SampleRecord() if self.filters is not None else self.record
+        self.upload_values = array("f", [0.0, 0.0, 0.0])
+        self.row_formatter = RowFormatter(tuple(self.error_dict))
+        self.console = ConsoleReport()
+        self.console_header = f"Chamber: {self.chamber.name}\n".encode() if self.chamber.name else b""
+        self.memory_probe = MemoryProbe()
+        self.last_elapsed = 0.0
+        self.profile_written = False
+        self.restore_checkpoint()
+
+    def setup_stages(self):
+        # histograms of the cycle's stages, the sensor reads are added by the acquisition engine
+        self.stage_collect = self.profiler.stage("collect_data")
+        self.stage_display = self.profiler.stage("update_display")
+        self.stage_sd = self.profiler.stage("write_sd")
+        self.stage_upload = self.profiler.stage("adafruitio_upload")
+
+    def setup_signal_processing(self):
+        if not Signal_processing:
+            self.filters = self.compensation = None
+            return
+        clock = self.backend.monotonic
+        # the SCD30s correct for pressure themselves when they're given it, it mustn't be applied twice
+        self.compensation = GasCompensation(
+            pressure=CO2_pressure_compensation and not SCD30_pressure_compensation,
+            temperature=CO2_temperature_compensation)
+
+        def co2():
+            return Pipeline(self.compensation, HampelFilter(Filter_window, Filter_threshold), Kalman(*CO2_kalman),
+                            TumblingWindow(Signal_window, clock))
+
+        def lux():
+            return Pipeline(HampelFilter(Filter_window, Filter_threshold), Ema(Lux_time_constant, clock),
+                            TumblingWindow(Signal_window, clock))
+
+        self.filters = ChannelFilters({
+            "ambient_co2": co2(), "system_co2": co2(), "lux_start": lux(), "lux_end": lux(),
+            "biofilm_co2": Pipeline(TumblingWindow(Signal_window, clock)),
+        })
+
+    def filtered(self, sample, key: str) -> float:
+        # A failed reading stays 0.0 as before and isn't fed to the filters
+        value = sample[key]
+        if self.filters is None or sample.failed(key):
+            return value
+        return self.filters.apply(key, value, sample.is_fresh(key))
+
+    def setup_adaptive_rate(self):
+        # the scheduler task or rotation slot whose period is adjusted, set by setup_scheduler
+        self.sample_period = None
+        if not Adaptive_sampling:
+            self.adaptive_rate = self.lag_clock = None
+            return
+        self.adaptive_rate = AdaptiveRate(Reading_interval, Adaptive_floor, Adaptive_ceiling, {
+            "biofilm_co2": SignalActivity(*Adaptive_co2_limits),
+            "lux_end": SignalActivity(*Adaptive_lux_limits),
+        }, calm_samples=Adaptive_calm_samples)
+        self.lag_clock = LagClock(Reading_interval)
 
     def setup_i2c(self): 
-        self.i2c = busio.I2C(I2C_SDA_PIN, I2C_SCL_PIN)
-        self.i2c2 = busio.I2C(I2C_SDA_PIN_2, I2C_SCL_PIN_2)
+        buses = self.startup.bring_up("i2c", self.backend.setup_i2c)
+        self.i2c, self.i2c2 = buses if available(buses) else (buses, buses)
+        self.muxes = {}
+
+    def bus(self, spec: tuple):
+        # I2C bus for a (bus, mux channel) pair of the chamber config
+        index, channel = spec
+        i2c = (self.i2c, self.i2c2)[index]
+        if channel is None:
+            return i2c
+        if index not in self.muxes:
+            self.muxes[index] = self.startup.bring_up(f"mux{index}", lambda: self.backend.mux(i2c))
+        mux = self.muxes[index]
+        return mux[channel] if available(mux) else mux
 
     def setup_sensors(self):
-        self.dps310 = DPS310(self.i2c)
-        self.scd_ambient = adafruit_scd30.SCD30(self.i2c)
-        self.scd_system = adafruit_scd30.SCD30(self.i2c2)
-        self.veml7700_start = adafruit_veml7700.VEML7700(self.i2c)
-        self.veml7700_end  = adafruit_veml7700.VEML7700(self.i2c2)
+        # peripherals of a named chamber are reported as <name>/<peripheral>
+        prefix = f"{self.chamber.name}/" if self.chamber.name else ""
+        ambient_bus = self.bus(self.chamber.ambient)
+        system_bus = self.bus(self.chamber.system)
+        bring_up = self.startup.bring_up
+        self.scd_ambient = bring_up(prefix + "scd_ambient", lambda: self.backend.scd30(ambient_bus))
+        self.scd_system = bring_up(prefix + "scd_system", lambda: self.backend.scd30(system_bus))
+        self.veml7700_start = bring_up(prefix + "veml7700_start", lambda: self.backend.veml7700(ambient_bus))
+        self.veml7700_end = bring_up(prefix + "veml7700_end", lambda: self.backend.veml7700(system_bus))
+        self.co2_ambient = bring_up(prefix + "co2_ambient", lambda: self.co2_sensor(self.scd_ambient, "ambient"))
+        self.co2_system = bring_up(prefix + "co2_system", lambda: self.co2_sensor(self.scd_system, "system"))
+        self.co2_sensors = tuple(sensor for sensor in (self.co2_ambient, self.co2_system) if available(sensor))
+        # the SCD30 whose cached humidity is logged
+        self.co2_humidity = self.co2_system if Humidity_sensor == "system" else self.co2_ambient
+
+    def co2_sensor(self, scd30, role: str) -> CO2Sensor:
+        return CO2Sensor(scd30, Reading_interval, per_sample=CO2_measurements_per_sample,
+                         self_calibration=role in SCD30_self_calibration,
+                         pressure_compensation=SCD30_pressure_compensation, pressure_step=SCD30_pressure_step)
 
     def setup_leds(self):
-        self.led1 = digitalio.DigitalInOut(LED_PIN)
-        self.led1.direction = digitalio.Direction.OUTPUT
-        self.led2 = digitalio.DigitalInOut(LED_PIN_2)
-        self.led2.direction = digitalio.Direction.OUTPUT
-
-    def setup_wifi(self):
-        uart = busio.UART(WIFI_TX_PIN, WIFI_RX_PIN, receiver_buffer_size=2048)
-        self.esp = adafruit_espatcontrol.ESP_ATcontrol(uart, 115200, debug=False)
-        self.wifi = adafruit_espatcontrol_wifimanager.ESPAT_WiFiManager(self.esp, secrets)
-        print("WiFi connected")
-        
+        prefix = f"{self.chamber.name}/" if self.chamber.name else ""
+        self.led1 = self.startup.bring_up(prefix + "led1", lambda: self.backend.led(self.chamber.leds[0]))
+        self.led2 = self.startup.bring_up(prefix + "led2", lambda: self.backend.led(self.chamber.leds[1]))
+
+    def setup_light(self):
+        prefix = f"{self.chamber.name}/" if self.chamber.name else ""
+        self.light_start = self.startup.bring_up(
+            prefix + "light_start", lambda: self.light_meter(self.veml7700_start, self.led1))
+        self.light_end = self.startup.bring_up(
+            prefix + "light_end", lambda: self.light_meter(self.veml7700_end, self.led2))
+
+    def light_meter(self, sensor, led) -> LightMeter:
+        return LightMeter(sensor, led, clock=self.backend.monotonic, auto_range=Light_auto_range, gain=Light_gain,
+                          integration_time=Light_integration_time, min_counts=Light_min_counts,
+                          dark_every=Light_dark_every)
+
+    def light_source(self, name: str, bus: int, meter) -> Source:
+        if not available(meter):
+            return Source(name, bus, (name,), meter.fail)
+        return Source(name, bus, (name,), meter.read, ready=meter.ready, trigger=meter.trigger, cancel=meter.cancel)
+
+    def setup_acquisition(self):
+        # Sources alternate between the buses in the order they're polled, readings from one conversion are batched
+        i2c, i2c2 = 0, 1
+        self.setup_light()
+        self.acquisition = AcquisitionEngine([
+            self.light_source("lux_start", i2c, self.light_start),
+            self.light_source("lux_end", i2c2, self.light_end),
+            self.co2_source("scd_ambient", i2c, "ambient_co2", self.co2_ambient),
+            self.co2_source("scd_system", i2c2, "system_co2", self.co2_system),
+            Source("dps310", i2c, ("temperature", "pressure"), self.read_dps310,
+                   ready=lambda: self.dps310.temperature_ready and self.dps310.pressure_ready,
+                   error_keys=("temp", "pressure")),
+        ], timeout=Acquisition_timeout, poll_interval=Acquisition_poll_interval, clock=self.backend.monotonic,
+            on_error=self.on_acquisition_error, profiler=self.profiler)
+        # acquisitions the display task gives way to, a fleet adds every chamber's
+        self.display_acquisitions = (self.acquisition,)
+
+    def co2_source(self, name: str, bus: int, channel: str, sensor) -> Source:
+        # the humidity comes with the CO2 of the SCD30 it's taken from, out of the same measurement
+        channels = (channel, "humidity") if sensor is self.co2_humidity else (channel,)
+        if not available(sensor):
+            return Source(name, bus, channels, sensor.fail)
+        read = sensor.read_co2_humidity if len(channels) == 2 else sensor.read_co2
+        return Source(name, bus, channels, read, ready=sensor.ready)
+
+    # Source readers, each stores its values into the engine's preallocated array
+    def read_dps310(self, out):
+        out[0] = self.dps310.temperature
+        out[1] = self.dps310.pressure
+
+    def on_acquisition_error(self, source, error: Exception):
+        # a peripheral that never came up is counted quietly, it was reported at startup
+        if not isinstance(error, PeripheralUnavailable):
+            print(f"Error reading {source.name}: {error}")
+        for key in source.error_keys:
+            self.error_dict[key] += 1
+
+    def setup_network(self):
+        # No radio traffic here, the link comes up from mqtt_task one step at a time
+        self.network = NetworkLink(self.backend, ("CO2", "Lux-start", "Lux-end"), report=self.startup,
+                                   step_timeout=Network_step_timeout,
+                                   io_options={"broker": MQTT_broker, "port": MQTT_port,
+                                               "prefix": MQTT_topic_prefix},
+                                   clock=self.backend.monotonic)
+        self.network.feed = self.supervisor.feed
+
+    def setup_supervision(self):
+        # The watchdog is armed before anything can hang, bring-up steps feed it as they go
+        watchdog = None
+        if Watchdog_timeout:
+            watchdog = self.startup.bring_up("watchdog", lambda: self.backend.watchdog(Watchdog_timeout))
+            if not available(watchdog):
+                watchdog = None
+        self.supervisor = Supervisor(watchdog, stall_factor=Watchdog_stall_factor, clock=self.backend.monotonic)
+        self.startup.feed = self.supervisor.feed
+        self.restarts = 0
+        self.watchdog_resets = 0
+        self.restarting = False
+
+    def setup_checkpoints(self):
+        # Loads the checkpoint and decides whether this boot resumes from it
+        self.checkpoints = None
+        self.resumed = None
+        if not Checkpoint_interval:
+            return
+        if Checkpoint_store == "nvm":
+            slots = self.startup.bring_up("nvm", lambda: NvmSlots(self.backend.nvm()))
+            if not available(slots):
+                return
+        else:
+            slots = FileSlots(self.sd_open, f"{self.sd_root}/checkpoint")
+        self.checkpoints = CheckpointStore(slots)
+        state = self.checkpoints.load()
+        if state is None:
+            return
+        reset_reason = self.backend.reset_reason()
+        self.restarts = state["restarts"]
+        self.watchdog_resets = state["watchdog_resets"]
+        if reset_reason == "watchdog":
+            # the reset left no checkpoint of its own
+            self.restarts += 1
+            self.watchdog_resets += 1
+        age = rtc_epoch(self.rtc.datetime) - state["epoch"]
+        if self.restarts > Watchdog_max_restarts:
+            print(f"{self.restarts} restarts in a row, starting cold with the watchdog off")
+            self.supervisor.disarm()
+            self.supervisor.on_stall = None
+        elif self.rtc.lost_power or not 0 <= age <= Warm_restart_window:
+            print(f"Checkpoint is {age} s old, starting a new run")
+        else:
+            print(f"Resuming from the checkpoint of {age} s ago ({state['reason']}, reset: {reset_reason})")
+            self.resumed = state
+
+    def checkpoint_entry(self) -> dict:
+        # This chamber's part of the checkpoint resumed from, None on a cold start
+        if self.resumed is None:
+            return None
+        return self.resumed["chambers"].get(self.chamber.name or "")
+
+    def restore_checkpoint(self):
+        entry = self.checkpoint_entry()
+        if entry is None:
+            return
+        for key, count in entry["errors"].items():
+            if key in self.error_dict:
+                self.error_dict[key] = count
+        if SD_log_format == "binary":
+            # the binary log records error deltas, the counts already logged aren't logged again
+            self.sd_logger.last_errors = [self.error_dict[key] for key in ERROR_KEYS]
+        self.ambient_CO2_lag.restore(entry["lag"])
+        if self.filtered_CO2_lag is not None and "filtered_lag" in entry:
+            self.filtered_CO2_lag.restore(entry["filtered_lag"])
+        # the elapsed time carries on, counting the time the board was down
+        now = rtc_epoch(self.rtc.datetime)
+        self.start_time = self.backend.monotonic() - entry["elapsed"] - max(0, now - self.resumed["epoch"])
+        if self.rollup is not None and "rollup" in entry:
+            self.rollup.restore(entry["rollup"], now)
+        self.profile_written = True
+        print(f"Resumed run {self.filename}, lag window of {self.ambient_CO2_lag.count}, errors {self.error_dict}")
+
+    def checkpoint_state(self) -> dict:
+        # What a restart would lose of this chamber
+        state = {
+            "run": self.filename,
+            "elapsed": self.backend.monotonic() - self.start_time,
+            "errors": self.error_dict,
+            "lag": self.ambient_CO2_lag.values(),
+        }
+        if self.filtered_CO2_lag is not None:
+            state["filtered_lag"] = self.filtered_CO2_lag.values()
+        chunks = self.sd_logger.chunks
+        if chunks is not None:
+            state["chunk"] = [chunks.chunk, chunks.size, chunks.period, chunks.last_epoch]
+        if self.rollup is not None:
+            state["rollup"] = self.rollup.state()
+        return state
+
+    def save_checkpoint(self, reason: str, chambers: list = None, restart: bool = False) -> bool:
+        # Called on the controller's first chamber with all of them
+        if self.checkpoints is None:
+            return False
+        # restarts only count as in a row while the board hasn't run for a checkpoint interval in between
+        restarts = self.restarts if self.backend.monotonic() - self.startup.started < Checkpoint_interval else 0
+        state = {
+            "epoch": rtc_epoch(self.rtc.datetime),
+            "reason": reason,
+            "restarts": restarts + (1 if restart else 0),
+            "watchdog_resets": self.watchdog_resets,
+            "chambers": dict((chamber.chamber.name or "", chamber.checkpoint_state())
+                             for chamber in (chambers or [self])),
+        }
+        return self.checkpoints.save(state)
+
+    def shutdown(self, reason: str, chambers: list = None, restart: bool = False):
+        # Pending rows, rollups and the backfill mark go to the card, then the checkpoint
+        for chamber in chambers or [self]:
+            try:
+                chamber.close_sd()
+            except Exception as e:
+                print(f"Error closing the SD log: {e}")
+            if chamber.backfill is not None:
+                chamber.backfill.save(force=True)
+        self.save_checkpoint(reason, chambers, restart)
+
+    def restart(self, reason: str, chambers: list = None):
+        # Checkpoint and reload the code, the board comes back up without a power cycle
+        print(f"Restarting: {reason}")
+        self.restarting = True
+        self.shutdown(reason, chambers, restart=True)
+        self.backend.restart()
+
     def connected(client):
         print("Connected to Adafruit IO! ")
 
@@ -103,64 +550,157 @@ class Biofilm_Measure:
         # Method called whenever feeds has a new value
         print("New message on topic {0}: {1} ".format(topic, message))
 
-    def setup_adafruit_io(self):
-        MQTT.set_socket(socket, self.esp)
-        mqtt_client = MQTT.MQTT(
-            broker = "io.adafruit.com",
-            username = secrets["aio_username"], 
-            password = secrets["aio_key"]
-        )
-        self.io = IO_MQTT(mqtt_client)
-        self.io.connect()
-        for feed_id in ["CO2", "Lux-start", "Lux-end"]:
-            self.io.subscribe(feed_id)
+    def setup_upload_bucket(self):
+        # one budget per Adafruit IO account, shared by every chamber
+        feeds = PublishGovernor.feed_keys(AIO_group_feeds, AIO_publish_extremes)
+        self.upload_bucket = TokenBucket(
+            AIO_rate_limit * AIO_rate_share / 60, burst=2 * len(feeds), clock=self.backend.monotonic)
+
+    def setup_outbox(self):
+        group_feeds = self.chamber.feeds or AIO_group_feeds
+        feeds = PublishGovernor.feed_keys(group_feeds, AIO_publish_extremes)
+        # io and wifi are filled in by the network link once it's up
+        spill_path = None if self.backfill_enabled() else f"{self.sd_root}/{self.filename}-outbox.csv"
+        self.outbox = Outbox(
+            None, feeds, group=self.chamber.group or AIO_group, capacity=Outbox_capacity,
+            spill_path=spill_path, open_file=self.sd_open, bucket=self.upload_bucket, clock=self.backend.monotonic)
+        self.network.attach(self.outbox)
+        self.governor = PublishGovernor(
+            self.outbox, self.upload_bucket, len(group_feeds), extremes=AIO_publish_extremes,
+            clock=self.backend.monotonic)
+
+    def backfill_enabled(self) -> bool:
+        return AIO_backfill and self.sd_logger.chunks is not None and bool(self.sd_root)
+
+    def setup_backfill(self):
+        self.backfill = None
+        if not self.backfill_enabled():
+            return
+        suffix = f"-{self.chamber.name}" if self.chamber.name else ""
+        chunks = self.sd_logger.chunks
+        self.backfill = Backfill(
+            self.outbox, self.governor, self.sd_runs, lambda: chunks.last_epoch,
+            f"{self.sd_root}/upload-mark{suffix}.txt", ("biofilm_co2", "lux_start", "lux_end"),
+            open_file=self.sd_open, share=AIO_backfill_share,
+            filters=self.replay_filters if Signal_processing else None, warmup=AIO_backfill_warmup,
+            clock=self.backend.monotonic)
+        self.outbox.on_publish = self.backfill.published
+
+    def replay_filters(self, clock) -> dict:
+        # Filters for backfilled rows. The logged biofilm CO2 is the raw difference: compensation scales both
+        # readings alike and belongs to the live channels, so only the outlier and smoothing stages apply.
+        def lux():
+            return Pipeline(HampelFilter(Filter_window, Filter_threshold), Ema(Lux_time_constant, clock))
+
+        return {"biofilm_co2": Pipeline(HampelFilter(Filter_window, Filter_threshold), Kalman(*CO2_kalman)),
+                "lux_start": lux(), "lux_end": lux()}
+
+    def sd_runs(self) -> list:
+        # This chamber's chunked logs, oldest first: names start with the 19 character start time
+        suffix = f"-{self.chamber.name}" if self.chamber.name else ""
+        runs = []
+        for name in self.backend.listdir(self.sd_root):
+            if name.endswith(INDEX_EXTENSION) and name[19:-len(INDEX_EXTENSION)] == suffix:
+                runs.append(f"{self.sd_root}/{name[:-len(INDEX_EXTENSION)]}")
+        runs.sort()
+        return runs
 
     def setup_rtc(self):
-        self.rtc = DS3231(self.i2c)
+        self.rtc = self.startup.bring_up("ds3231", lambda: self.backend.ds3231(self.i2c), fallback=SystemRTC())
         if self.rtc.lost_power:
             self.rtc.datetime = time.struct_time((2000, 4, 25, 12, 0, 0, 0, -1, -1))
             print("RTC lost power")
 
+    def setup_sd_card(self):
+        # Without a card rows still go through the logger, whose flushes then fail and are counted
+        card = self.startup.bring_up("sd", self.backend.mount_sd)
+        if available(card):
+            self.sd_root, self.sd_open = card, self.backend.open
+        else:
+            self.sd_root, self.sd_open = "", card.fail
+
     def setup_SD(self):
-        spi  = busio.SPI(SD_SCK_PIN, MOSI=SD_MOSI_PIN, MISO=SD_MISO_PIN)
-        sd = sdcardio.SDCard(spi, SD_CS_PIN)
-        vfs = storage.VfsFat(sd)
-        storage.mount(vfs, "/sd")
         current_file_time = self.rtc.datetime
-        self.filename = "{:04}-{:02}-{:02},{:02}-{:02}-{:02}".format(
-            current_file_time.tm_year, current_file_time.tm_mon, current_file_time.tm_mday,
-            current_file_time.tm_hour, current_file_time.tm_min, current_file_time.tm_sec)
+        resumed = self.checkpoint_entry()
+        if resumed is not None:
+            # a warm restart carries on with the same run
+            self.filename = resumed["run"]
+        else:
+            self.filename = "{:04}-{:02}-{:02},{:02}-{:02}-{:02}".format(
+                current_file_time.tm_year, current_file_time.tm_mon, current_file_time.tm_mday,
+                current_file_time.tm_hour, current_file_time.tm_min, current_file_time.tm_sec)
+            if self.chamber.name:
+                self.filename += f"-{self.chamber.name}"
+        extension = ".bin" if SD_log_format == "binary" else ".csv"
+        base = f"{self.sd_root}/{self.filename}"
+        chunks = None
+        if SD_chunked:
+            chunks = ChunkWriter(self.sd_open, base, extension, chunk_bytes=SD_chunk_bytes,
+                                 chunk_seconds=SD_chunk_seconds)
+            if resumed is not None and "chunk" in resumed:
+                chunks.resume(*resumed["chunk"])
+        if SD_log_format == "binary":
+            self.sd_logger = BinaryLogger(
+                self.sd_open, base + extension, start_epoch=rtc_epoch(current_file_time),
+                max_rows=SD_flush_rows, max_bytes=SD_flush_bytes, max_age=SD_flush_age,
+                clock=self.backend.monotonic, sync=self.backend.sync, chunks=chunks)
+        else:
+            self.sd_logger = SDLogger(
+                self.sd_open, base + extension,
+                max_rows=SD_flush_rows, max_bytes=SD_flush_bytes, max_age=SD_flush_age,
+                clock=self.backend.monotonic, sync=self.backend.sync, chunks=chunks)
+        self.rollup = None
+        if SD_rollup_periods:
+            self.rollup = Rollup(self.sd_open, base, channels=len(CHANNELS), periods=SD_rollup_periods,
+                                 max_age=SD_flush_age, clock=self.backend.monotonic)
+            # sample channels behind each logged channel, a logged value is failed if any of them is
+            index = self.acquisition.sample.index
+            self.rollup_sources = tuple(tuple(index[source] for source in CHANNEL_SOURCES[name]) for name in CHANNELS)
+            self.rollup_failed = bytearray(len(CHANNELS))
 
     def setup_display(self):
-        displayio.release_displays()
-        display_bus = displayio.I2CDisplay(self.i2c, device_address=0x3C, reset=OLED_RESET_PIN)
-        self.display = adafruit_displayio_ssd1306.SSD1306(
-            display_bus, width=Display_width, height=Display_height)
-        self.setup_display_group()
-
-    def setup_display_group(self):
-        self.splash = displayio.Group()
-        self.display.show(self.splash)
-        self.setup_display_background()
-        self.setup_display_labels()
+        self.bus_timer = BusTimer()
+        self.display = self.startup.bring_up("ssd1306", self.build_display)
+        if not available(self.display):
+            # the display task isn't scheduled without one
+            self.text_labels, self.number_labels, self.display_renderer = [], [], None
+            self.history_view = None
 
-    def setup_display_background(self):
-        colour_bitmap = displayio.Bitmap(Display_width, Display_height, 1)
-        colour_palette  = displayio.Palette(1)
-        colour_palette[0] = 0xFFFFFF # White=0xFFFFFF
-        bg_sprite = displayio.TileGrid(colour_bitmap, pixel_shader=colour_palette, x=0, y=0)
-        self.splash.append(bg_sprite)
+    def build_display(self):
+        self.display = self.backend.display(self.i2c)
+        self.setup_display_labels()
+        self.display_renderer = DisplayRenderer(
+            self.display, self.number_labels, Display_fields, max_fps=Display_max_fps,
+            clock=self.backend.monotonic, bus_timer=self.bus_timer)
+        self.setup_history_view()
+        return self.display
 
-        inner_bitmap = displayio.Bitmap(Display_width - Display_border * 2, Display_height - Display_border * 2, 1)
-        inner_palette = displayio.Palette(1)
-        inner_palette[0] = 0x000000 #Black=0x000000
-        inner_sprite  = displayio.TileGrid(inner_bitmap, pixel_shader=inner_palette, x=Display_border, y=Display_border)
-        self.splash.append(inner_sprite)
+    def setup_history_view(self):
+        # The graph page's captions and sparklines, stacked in equal rows under each other
+        self.history_view = None
+        if "graph" not in Display_pages or not Display_graph_fields:
+            return
+        row_height = self.display.height // len(Display_graph_fields)
+        plots = []
+        graph = []
+        for i, (name, key, decimals) in enumerate(Display_graph_fields):
+            top = i * row_height
+            caption = self.create_label(name, 0, top + 4)
+            bitmap, grid = self.display.create_bitmap(self.display.width, row_height - 11, 0, top + 10)
+            plots.append(Sparkline(bitmap, grid, key, CHANNEL_SOURCES[key], caption=caption, name=name,
+                                   decimals=decimals))
+            graph.extend((caption, grid))
+        pages = tuple(graph if page == "graph" else self.text_labels + self.number_labels for page in Display_pages)
+        if "numbers" not in Display_pages:
+            for element in self.text_labels + self.number_labels:
+                element.hidden = True
+        self.history_view = HistoryView(self.display_renderer, tuple(plots), pages, page_seconds=Display_page_seconds,
+                                        budget=Display_graph_budget, clock=self.backend.monotonic)
 
     def setup_display_labels(self):
         self.text_labels = [
             self.create_label("Lux start:", 0, 4),
-            self.create_label("Luxend:", 0, 15),
+            self.create_label("Lux end:", 0, 15),
             self.create_label("Ambient CO2:", 0, 26),
             self.create_label("System CO2:", 0, 37),
             self.create_label("Biofilm CO2:", 0, 48),
@@ -173,171 +713,423 @@ class Biofilm_Measure:
             self.create_label("0", 80, 26),
             self.create_label("0", 75, 37),
             self.create_label("0", 75, 48),
-            self.create_label("0", 75, 48),
             self.create_label("0", 75, 59)
         ]
 
-    def create_label(self, text: str, x: int, y: int) -> label.Label:
-        lbl = label.Label(terminalio.FONT, text=text, color=0xFFFFFF, x=x, y=y)
-        self.splash.append(lbl)
-        return lbl
-    
-    def create_filename(self) -> str:
-        current_time = self.rtc.datetime
-        return "{:04}-{:02}-{:02},{:02}-{:02}-{:02}".format(
-            current_time.tm_year, current_time.tm_mon, current_time.tm_mday,
-            current_time.tm_hour, current_time.tm_min, current_time.tm_sec)
+    def create_label(self, text: str, x: int, y: int):
+        return self.display.create_label(text, x, y)
     
-    def measure_lux_start(self) -> tuple[float]:
-        self.led1.value = True
-        try:
-            return self.veml7700_start.lux
-        except Exception as e:
-            print(f"Error measuring start lux: {e}")
-            self.error_dict["lux_start"] += 1
-            return 0.0
+    def read_clock(self) -> float:
+        # Latches the RTC time for this sample into last_rtc_time and returns the elapsed time
+        self.last_elapsed = self.backend.monotonic() - self.start_time
+        self.last_rtc_time = self.rtc.datetime
+        return self.last_elapsed
 
-    def measure_lux_end(self) -> tuple[float]:
-        self.led2.value = True
-        try:
-            return self.veml7700_end.lux
-        except Exception as e:
-            print(f"Error measuring end lux: {e}")
-            self.error_dict["lux_end"] += 1
-            return 0.0
-        
-    
-    def measure_CO2(self) -> tuple[float, float, float]:
-        try:
-            ambient_CO2 = self.scd_ambient.CO2
-            self.ambient_CO2_list.append(ambient_CO2)
-            system_CO2 = self.scd_system.CO2
-            biofilm_CO2 = system_CO2  - ambient_CO2
-
-            if len(self.ambient_CO2_list) == 16:
-                actual_ambient = self.ambient_CO2_list.pop(0)
-                biofilm_CO2 = system_CO2 - actual_ambient
-            return ambient_CO2, system_CO2, biofilm_CO2
-        except Exception as e:
-            print(f"Error measuring CO2: {e}")
-            self.error_dict["ambient_CO2"] += 1
-            self.error_dict["system_CO2"] += 1
-            return 0.0, 0.0, 0.0
-        
-    def measure_temperature(self) -> float:
-        try:
-            return self.dps310.temperature
-        except Exception as e:
-            print(f"Error measuring temperature: {e}")
-            self.error_dict["temperature"] += 1
-            return 0.0
-        
-    def measure_humidity(self) -> float:
-        try:
-            return self.scd_system.relative_humidity
-        except Exception as e:
-            print(f"Error reading humidity: {e}")
-            self.error_dict["humidity"] += 1
-            return 0.0
-        
-    def measure_pressure(self) -> float:
-        try:
-            return self.dps310.pressure
-        except Exception as e:
-            print(f"Error measuring pressure: {e}")
-            self.error_dict["pressure"] += 1
-            return 0.0
-        
-    def get_timestamp(self) -> tuple[float, str]:
-        elapsed_time = time.monotonic() - self.start_time
-        current_time = self.rtc.datetime
-        timestamp = "{:04}-{:02}-{:02}, {:02}:{:02}:{:02}".format(
-            current_time.tm_year, current_time.tm_mon, current_time.tm_mday,
-            current_time.tm_hour, current_time.tm_min, current_time.tm_sec)
-        return elapsed_time, timestamp
-    
-    def print_data(self, data: dict[str, float], timestamp: str):
-        print(f"Time stamp: {timestamp}")
-        print(f"Lux start: {data['lux_start']:.2f}")
-        print(f"Lux end: {data['lux_end']:.2f}")
-        print(f"Ambient CO2: {data['ambient_co2']:.2f}")
-        print(f"System CO2: {data['system_co2']:.2f}")
-        print(f"Biofilm CO2: {data['biofilm_co2']:.2f}")
-        print(f"Temperature: {data['temperature']:.2f}")
-        print(f"Humidity: {data['humidity']:.2f}")
-        print(f"Pressure: {data['pressure']:.2f}")
+    def print_data(self, data: SampleRecord):
+        # formatted into a reusable buffer, stamped with the time latched by read_clock
+        self.console.write(self.console.format(self.last_rtc_time, data, self.console_header))
 
     def update_display(self, data: dict[str, float]):
-        self.number_labels[0].text = f"{data['lux_start']:.0f}"
-        self.number_labels[1].text = f"{data['lux_end']:.0f}"
-        self.number_labels[2].text = f"{data['ambient_co2']:.0f}"
-        self.number_labels[3].text = f"{data['system_co2']:.0f}"
-        self.number_labels[4].text = f"{data['biofilm_co2']:.2f}"
-        self.number_labels[5].text = f"{data['temperature']:.2f}"
-
-    def write_sd(self, data: dict[str, float], timestamp: str, elapsed_time: float):
+        if self.display_renderer is None:
+            return
+        started = self.profiler.begin()
+        self.display_renderer.render(data)
+        if self.history_view is not None:
+            self.history_view.push(data, self.acquisition.sample)
+            self.history_view.update()
+        self.display_renderer.refresh()
+        self.profiler.end(self.stage_display, started)
+
+    def write_sd(self, data: SampleRecord, elapsed_time: float):
+        # Rows are formatted straight into the logger's buffer, stamped with the time latched by read_clock
+        started = self.profiler.begin()
         try:
-            with open(f"/sd/{self.filename}.csv", "a") as file:
-                data_string = f"{timestamp},{elapsed_time:.2f},{data['lux_start']:.2f},{data['lux_end']:.2f},{data['ambient_co2']:.2f},{data['system_co2']:.2f},{data['biofilm_co2']:.2f},{data['temperature']:.2f},{data['humidity']:.2f},{data['pressure']:.2f},{self.error_dict}\n"
-                file.write(data_string)
+            epoch = rtc_epoch(self.last_rtc_time)
+            if SD_log_format == "binary":
+                self.sd_logger.log(epoch, elapsed_time, data, self.error_dict)
+            else:
+                logger = self.sd_logger
+                if logger.reserve(ROW_MAX):
+                    end = self.row_formatter.write_row(
+                        logger.buffer, logger.length, self.last_rtc_time, elapsed_time, data, self.error_dict)
+                    logger.commit(end - logger.length, epoch)
+            if self.rollup is not None:
+                self.rollup.add(epoch, data.values, self.failed_channels())
         except Exception as e:
+            self.stage_sd.errors += 1
             print(f"Error writing to sd card: {e}")
+        self.profiler.end(self.stage_sd, started)
+
+    def failed_channels(self) -> bytearray:
+        # Which logged channels of the last sample hold a failed reading
+        state = self.acquisition.sample.state
+        failed = self.rollup_failed
+        for i in range(len(failed)):
+            failed[i] = 0
+            for slot in self.rollup_sources[i]:
+                if state[slot] == FAILED:
+                    failed[i] = 1
+        return failed
+
+    def close_sd(self):
+        # Shutdown: pending rows and rollups go to the card
+        self.sd_logger.close()
+        if self.rollup is not None:
+            self.rollup.close()
     
     def adafruitio_upload(self, data: dict[str, float]):
+        # Fold the reading into the current upload window and publish whatever the rate budget and the
+        # outbox's backoff allow, never blocks on a reconnect
+        started = self.profiler.begin()
+        values = self.upload_values
+        values[0] = data['biofilm_co2']
+        values[1] = data['lux_start']
+        values[2] = data['lux_end']
+        self.governor.offer(values, rtc_epoch(self.last_rtc_time))
+        errors = self.outbox.publish_errors
+        self.outbox.service()
+        self.stage_upload.errors += self.outbox.publish_errors - errors
+        self.profiler.end(self.stage_upload, started)
+
+    def setup_scheduler(self) -> Scheduler:
+        self.scheduler = Scheduler(self.backend.monotonic)
+        self.sample_period = self.scheduler.add("sample", Reading_interval, self.sample_task, deadline=5)
+        if self.display_renderer is not None:
+            self.scheduler.add("display", Display_interval, self.display_task, deadline=0.5)
+        self.scheduler.add("sd", SD_flush_interval, self.sd_task, deadline=2)
+        self.scheduler.add("mqtt", MQTT_interval, self.mqtt_task, deadline=5)
+        self.scheduler.add("errors", Error_report_interval, self.error_task, deadline=1)
+        self.setup_supervised_tasks(self.scheduler, self.checkpoint_task, self.on_stall)
+        return self.scheduler
+
+    def setup_supervised_tasks(self, scheduler: Scheduler, checkpoint_task, on_stall):
+        # The watchdog task goes last so it sees every other task, a stall is only handed on while restarts are
+        # allowed
+        if self.checkpoints is not None:
+            scheduler.add("checkpoint", Checkpoint_interval, checkpoint_task, deadline=2)
+        if Watchdog_timeout:
+            scheduler.add("watchdog", Watchdog_feed_interval, self.supervisor.service, deadline=0.5)
+            self.supervisor.watch(scheduler)
+            if self.restarts <= Watchdog_max_restarts:
+                self.supervisor.on_stall = on_stall
+
+    def checkpoint_task(self):
+        self.save_checkpoint("periodic")
+
+    def on_stall(self, reason: str):
+        self.restart("stall: " + reason)
+
+    async def sample_task(self):
+        # Waiting for data-ready yields to the display and MQTT tasks
+        if Debug_memory:
+            self.memory_probe.start()
+        # includes the wait for data-ready, which is when the other tasks run
+        started = self.profiler.begin()
+        sample = await self.acquisition.acquire_async()
+        self.bus_timer.add("sensors", sample.bus_time)
+        data = self.process_sample(sample)
+        self.profiler.end(self.stage_collect, started)
+        self.adapt_interval(sample, data)
+        elapsed_time = self.read_clock()
+        self.print_data(self.raw_record)
+        self.latest_data = data
+        self.display_dirty = True
+        self.write_sd(self.raw_record, elapsed_time)
+        self.pending_upload = data
+        self.startup.first_sample()
+        if Debug_memory:
+            self.memory_probe.stop()
+            print(self.memory_probe.summary())
+
+    def adapt_interval(self, sample, data: SampleRecord):
+        rate = self.adaptive_rate
+        if rate is None:
+            return
+        # only new readings count, a stale one would look perfectly flat
+        if sample.is_fresh("system_co2") and not sample.failed("ambient_co2"):
+            rate.observe("biofilm_co2", data["biofilm_co2"], sample.started)
+        if sample.is_fresh("lux_end"):
+            rate.observe("lux_end", data["lux_end"], sample.started)
+        interval = rate.adjust()
+        if self.sample_period is not None:
+            self.sample_period.period = interval
+        for sensor in self.co2_sensors:
+            sensor.plan(interval)
+
+    def display_task(self):
+        if self.display_waits():
+            # a frame pushed now would hold up the sample's data-ready polls on the shared bus
+            self.display_renderer.held += 1
+            return
+        started = self.profiler.begin()
+        if self.display_dirty:
+            self.display_dirty = False
+            self.display_renderer.render(self.latest_data)
+            if self.history_view is not None:
+                self.history_view.push(self.latest_data, self.acquisition.sample)
+        if self.history_view is not None:
+            self.history_view.update()
+        # a refresh held back by the frame rate cap goes out on a later run
+        self.display_renderer.refresh()
+        self.profiler.end(self.stage_display, started)
+
+    def display_waits(self) -> bool:
+        # True while a sample of any chamber sharing the display's bus waits on its sensors
+        for acquisition in self.display_acquisitions:
+            if acquisition.remaining:
+                return True
+        return False
+
+    def sd_task(self):
+        self.sd_logger.poll()
+        if self.rollup is not None:
+            self.rollup.poll()
+
+    def mqtt_task(self):
+        self.service_network()
+        self.service_upload()
+        self.service_backfill()
+        self.loop_mqtt()
+
+    def service_network(self):
+        # The network waits for the first sample so a slow access point can't hold up local logging
+        if self.startup.first_sample_at is not None:
+            self.network.service()
+
+    def service_upload(self):
+        data, self.pending_upload = self.pending_upload, None
+        if data is not None:
+            self.adafruitio_upload(data)
+        else:
+            self.outbox.service()
+
+    def service_backfill(self):
+        # after the live readings, which always go first
+        if self.backfill is not None:
+            self.backfill.service()
+
+    def loop_mqtt(self):
+        if self.network.up and self.outbox.connected:
+            # keeps the broker connection alive between readings
+            try:
+                self.network.io.loop(MQTT_loop_timeout)
+            except Exception as e:
+                self.outbox.fail(e)
+
+    def error_task(self):
+        self.print_stats()
+        self.print_controller_stats()
+        print(self.scheduler.report())
+        self.report_profile()
+
+    def print_controller_stats(self):
+        # peripherals shared by every chamber of the controller
+        print(f"Startup: {self.startup.stats()}, network: {self.network.stats()}")
+        if self.display_renderer is not None:
+            print(f"Display: {self.display_renderer.stats()}")
+        if self.history_view is not None:
+            print(f"History view: {self.history_view.stats()}")
+        print(f"I2C: {self.bus_timer.stats()}")
+        print(f"Watchdog: {self.supervisor.stats()}, restarts: {self.restarts}, "
+              f"watchdog resets: {self.watchdog_resets}")
+        if self.checkpoints is not None:
+            print(f"Checkpoints: {self.checkpoints.stats()}")
+
+    def report_profile(self):
+        # Stage profile to the console, the SD summary file and, if configured, the diagnostics feed
+        print(self.profiler.report())
+        created_at = iso_timestamp(rtc_epoch(self.rtc.datetime))
         try:
-            self.io.publish("CO2", data['biofilm_co2'])
-            self.io.publish("Lux-start", data['lux_start'])
-            self.io.publish("Lux-end", data['lux_end'])
+            with self.sd_open(f"{self.sd_root}/{self.filename}-profile.csv", "a") as file:
+                file.write(self.profiler.summary_rows(created_at, header=not self.profile_written))
+            self.profile_written = True
         except Exception as e:
-            print(f"Falied Adafruitio upload")
+            print(f"Error writing profile summary: {e}")
+        if Diagnostics_feed and self.network.up and self.outbox.connected:
+            # the diagnostics share the readings' rate budget, one data point per message
+            if not self.upload_bucket.take(1):
+                return
             try:
-                self.wifi.reset()
-                self.io.reconnect()
-                self.io.publish("CO2", data['biofilm_co2'])
-                self.io.publish("Lux-start", data['lux_start'])
-                self.io.publish("Lux-end", data['lux_end'])
-                print(f"Publish retry successful")
+                self.network.io.publish(Diagnostics_feed, json.dumps(self.profiler.diagnostics()))
             except Exception as e:
-                print(f"Failed retry")
+                self.outbox.fail(e)
 
+    def print_stats(self):
+        if self.chamber.name:
+            print(f"Chamber {self.chamber.name}")
+        print(f"Errors: {self.error_dict}")
+        print(f"SD: {self.sd_logger.stats()}")
+        if self.sd_logger.chunks is not None:
+            print(f"SD chunks: {self.sd_logger.chunks.stats()}")
+        if self.rollup is not None:
+            print(f"Rollups: {self.rollup.stats()}")
+        print(f"Outbox: {self.outbox.stats()}")
+        print(f"Upload governor: {self.governor.stats()}")
+        if self.backfill is not None:
+            print(f"Backfill: {self.backfill.stats()}")
+        print(f"Acquisition: {self.acquisition.stats()}")
+        for name in ("light_start", "light_end", "co2_ambient", "co2_system"):
+            meter = getattr(self, name)
+            if available(meter):
+                print(f"{name}: {meter.stats()}")
+        if self.filters is not None:
+            print(f"Signals: {self.filters.stats()}")
+        if self.adaptive_rate is not None:
+            print(f"Adaptive rate: {self.adaptive_rate.stats()}")
+        if Debug_memory:
+            print(f"Memory: {self.memory_probe.stats()}")
+
+    def on_task_error(self, task, error: Exception):
+        # a failing task forces out whatever rows are still buffered
+        self.sd_logger.flush()
 
     def main_loop(self):
-        previous_reading_time = time.monotonic()
-        while True:
-            try:
-                current_time  = time.monotonic()
-                if (current_time - previous_reading_time) >= Reading_interval:
-                    data = self.collect_data()    
-                    elapsed_time, timestamp = self.get_timestamp()
-                    self.print_data(data, timestamp)
-                    self.update_display(data)
-                    self.write_sd(data, timestamp, elapsed_time)
-                    self.adafruitio_upload(data)
-
-                    previous_reading_time = current_time
-                    self.io.loop(0.1)
+        self.setup_scheduler()
+        self.scheduler.on_error = self.on_task_error
+        try:
+            self.scheduler.start()
+        except Exception as e:
+            # the scheduler survives task errors, this is the loop itself failing
+            print(f"Main loop failed: {e}")
+            self.restart(f"crash: {e}")
+        finally:
+            if not self.restarting:
+                self.shutdown("shutdown")
 
-            except Exception as e:
-                print(e)
-                continue
-
-    def collect_data(self) -> dict[str, float]:
-        lux_start, lux_end = self.measure_lux_start(), self.measure_lux_end()
-        ambient_co2, system_co2, biofilm_co2 = self.measure_CO2()
-        temperature  = self.measure_temperature()
-        humidity = self.measure_humidity()
-        pressure = self.measure_pressure()
-
-        return {
-                'lux_start': lux_start,
-                'lux_end': lux_end,
-                'ambient_co2': ambient_co2,
-                'system_co2': system_co2,
-                'biofilm_co2': biofilm_co2,
-                'temperature': temperature,
-                'humidity': humidity,
-                'pressure': pressure        
-        }
-    
-biofilm_monitor = Biofilm_Measure()
-biofilm_monitor.main_loop()
+    def collect_data(self) -> SampleRecord:
+        started = self.profiler.begin()
+        data = self.process_sample(self.acquisition.acquire())
+        self.profiler.end(self.stage_collect, started)
+        return data
+
+    def process_sample(self, sample) -> SampleRecord:
+        # Fills self.raw_record and self.record in place, they are overwritten by the next sample. Returns the
+        # filtered record, the raw one is what write_sd logs.
+        if sample.is_fresh("pressure"):
+            if self.compensation is not None:
+                self.compensation.update(sample["temperature"], sample["pressure"])
+            for sensor in self.co2_sensors:
+                sensor.compensate(sample["pressure"])
+        raw, record = self.raw_record, self.record
+        if self.filters is not None:
+            ambient_co2, system_co2 = self.filtered(sample, "ambient_co2"), self.filtered(sample, "system_co2")
+        if sample.failed("ambient_co2") or sample.failed("system_co2"):
+            for data in (raw, record):
+                data["ambient_co2"], data["system_co2"], data["biofilm_co2"] = 0.0, 0.0, 0.0
+        else:
+            # the lag counts SCD30 measurements, so a stale ambient reading isn't pushed twice
+            pushes = 0
+            if sample.is_fresh("ambient_co2"):
+                if self.lag_clock is None:
+                    pushes = 1
+                else:
+                    # one push per Reading_interval of time, whatever the adaptive interval is
+                    pushes = min(self.lag_clock.pushes(sample.started), self.ambient_CO2_lag.size)
+            self.lag_biofilm(raw, self.ambient_CO2_lag, sample["ambient_co2"], sample["system_co2"], pushes)
+            if self.filters is not None:
+                self.lag_biofilm(record, self.filtered_CO2_lag, ambient_co2, system_co2, pushes)
+                self.filters.apply("biofilm_co2", record["biofilm_co2"], sample.is_fresh("system_co2"))
+        raw["lux_start"] = sample["lux_start"]
+        raw["lux_end"] = sample["lux_end"]
+        for data in (raw, record):
+            data["temperature"] = sample["temperature"]
+            data["humidity"] = sample["humidity"]
+            data["pressure"] = sample["pressure"]
+        if self.filters is not None:
+            record["lux_start"] = self.filtered(sample, "lux_start")
+            record["lux_end"] = self.filtered(sample, "lux_end")
+        return record
+
+    def lag_biofilm(self, data: SampleRecord, lag: CO2LagBuffer, ambient_co2: float, system_co2: float, pushes: int):
+        for _ in range(pushes):
+            lag.push(ambient_co2)
+        actual_ambient = lag.mean if CO2_smoothed_baseline else lag.lagged
+        data["ambient_co2"] = ambient_co2
+        data["system_co2"] = system_co2
+        data["biofilm_co2"] = system_co2 - actual_ambient
+
+class Biofilm_Fleet:
+    # Several chambers on one controller. Their samples take turns in a Rotation so each stays on its deadline
+    # without two acquisitions overlapping on a shared bus; display, SD, MQTT and error tasks are shared.
+    def __init__(self, chambers: tuple = None, backend=None):
+        self.chambers = []
+        for config in (chambers if chambers is not None else Chambers):
+            shared = self.chambers[0] if self.chambers else None
+            self.chambers.append(Biofilm_Measure(backend, config, shared))
+        self.primary = self.chambers[0]
+        self.backend = self.primary.backend
+        # the chambers split the account's upload budget
+        for chamber in self.chambers:
+            chamber.governor.share = 1 / len(self.chambers)
+
+    def setup_scheduler(self) -> Scheduler:
+        clock = self.backend.monotonic
+        self.scheduler = Scheduler(clock)
+        self.rotation = Rotation(clock)
+        for i, chamber in enumerate(self.chambers):
+            chamber.scheduler = self.scheduler
+            chamber.sample_period = self.rotation.add(chamber.chamber.name or str(i), Reading_interval,
+                                                      chamber.sample_task, priority=chamber.chamber.priority)
+        self.rotation.stagger()
+        self.scheduler.add("sample", Fleet_tick, self.rotation.step, deadline=5)
+        display_chamber = self.chambers[Display_chamber]
+        display_chamber.display_acquisitions = tuple(chamber.acquisition for chamber in self.chambers)
+        if display_chamber.display_renderer is not None:
+            self.scheduler.add("display", Display_interval, display_chamber.display_task, deadline=0.5)
+        self.scheduler.add("sd", SD_flush_interval, self.sd_task, deadline=2)
+        self.scheduler.add("mqtt", MQTT_interval, self.mqtt_task, deadline=5)
+        self.scheduler.add("errors", Error_report_interval, self.error_task, deadline=1)
+        self.primary.setup_supervised_tasks(self.scheduler, self.checkpoint_task, self.on_stall)
+        return self.scheduler
+
+    def checkpoint_task(self):
+        self.primary.save_checkpoint("periodic", self.chambers)
+
+    def on_stall(self, reason: str):
+        self.primary.restart("stall: " + reason, self.chambers)
+
+    def sd_task(self):
+        for chamber in self.chambers:
+            chamber.sd_task()
+
+    def mqtt_task(self):
+        self.primary.service_network()
+        for chamber in self.chambers:
+            chamber.service_upload()
+        for chamber in self.chambers:
+            chamber.service_backfill()
+        # one broker connection for the whole controller
+        self.primary.loop_mqtt()
+
+    def error_task(self):
+        for chamber in self.chambers:
+            chamber.print_stats()
+        self.primary.print_controller_stats()
+        print(self.scheduler.report())
+        print(self.rotation.report())
+        self.primary.report_profile()
+
+    def on_task_error(self, task, error: Exception):
+        for chamber in self.chambers:
+            chamber.sd_logger.flush()
+
+    def main_loop(self):
+        self.setup_scheduler()
+        self.scheduler.on_error = self.on_task_error
+        self.rotation.on_error = self.on_task_error
+        try:
+            self.scheduler.start()
+        except Exception as e:
+            print(f"Main loop failed: {e}")
+            self.primary.restart(f"crash: {e}", self.chambers)
+        finally:
+            if not self.primary.restarting:
+                self.primary.shutdown("shutdown", self.chambers)
+
+
+if __name__ == "__main__":
+    if len(Chambers) > 1:
+        Biofilm_Fleet(Chambers).main_loop()
+    else:
+        biofilm_monitor = Biofilm_Measure(chamber=Chambers[0])
+        biofilm_monitor.main_loop()
@@ -0,0 +1,228 @@
+# Data-ready acquisition across both I2C buses
+# Every sensor of a sample is triggered up front, then the engine polls the data-ready flags without blocking and
+# reads whichever source is ready, so a slow sensor on one bus doesn't hold up the rest. Values that come from one
+# conversion (SCD30 CO2 and humidity, DPS310 temperature and pressure) are read as a batch. A source that isn't
+# ready before the timeout keeps its previous value and is marked stale in the sample set, one whose read raised
+# is zeroed and marked failed.
+# ===================================================================================================================
+
+import time
+from array import array
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+# Channel states in SampleSet.state
+STALE = 0
+FRESH = 1
+FAILED = 2
+
+
+class Source:
+    def __init__(self, name: str, bus: int, channels: tuple, read, ready=None, trigger=None, error_keys: tuple = None,
+                 cancel=None):
+        # read(out) stores one value per channel into `out`, ready() polls the data-ready flag (None means always
+        # ready), trigger() starts the measurement and cancel() is called if the sample times out waiting for it
+        self.name = name
+        self.bus = bus
+        self.channels = channels
+        self.read = read
+        self.ready = ready
+        self.trigger = trigger
+        self.cancel = cancel
+        # error_dict keys counted when the source fails, one per channel by default
+        self.error_keys = error_keys if error_keys is not None else channels
+        self.reads = 0
+        self.stale = 0
+        self.failures = 0
+
+
+class SampleSet:
+    # Values, read times and freshness of every channel, preallocated and reused for each sample
+    def __init__(self, channels: tuple):
+        self.channels = channels
+        self.index = dict((name, i) for i, name in enumerate(channels))
+        self.values = array("f", [0.0] * len(channels))
+        # read times relative to `started`, a float32 can't hold a monotonic timestamp to the millisecond
+        self.offsets = array("f", [0.0] * len(channels))
+        self.state = bytearray(len(channels))
+        self.started = 0.0
+        self.finished = 0.0
+        # time spent in trigger/ready/read calls, the window minus the waits between polls
+        self.bus_time = 0.0
+
+    def __getitem__(self, name: str) -> float:
+        return self.values[self.index[name]]
+
+    def is_fresh(self, name: str) -> bool:
+        return self.state[self.index[name]] == FRESH
+
+    def failed(self, name: str) -> bool:
+        return self.state[self.index[name]] == FAILED
+
+    def read_at(self, name: str) -> float:
+        return self.started + self.offsets[self.index[name]]
+
+    def skew(self, first: str, second: str) -> float:
+        # Time between the reads of two channels, e.g. ambient and system CO2
+        return self.offsets[self.index[second]] - self.offsets[self.index[first]]
+
+    @property
+    def window(self) -> float:
+        return self.finished - self.started
+
+    def as_dict(self) -> dict:
+        return dict((name, self.values[i]) for i, name in enumerate(self.channels))
+
+
+class AcquisitionEngine:
+    def __init__(self, sources: list, timeout: float = 2.5, poll_interval: float = 0.01, clock=None,
+                 on_error=None, profiler=None):
+        self.sources = sources
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.clock = clock or time.monotonic
+        # on_error(source, exception) after a failed read
+        self.on_error = on_error
+        # optional profiler.Profiler, each source's reads are timed as the stage measure_<name>
+        self.profiler = profiler
+        # a blocking sleep(seconds) makes acquire_async wait without yielding, replay.py sets one that advances its
+        # virtual clock
+        self.sleep = None
+        self.stages = tuple(profiler.stage("measure_" + source.name) for source in sources) if profiler else None
+        channels = []
+        for source in sources:
+            channels.extend(source.channels)
+        self.sample = SampleSet(tuple(channels))
+        self.slots = []
+        for source in sources:
+            self.slots.append(tuple(self.sample.index[name] for name in source.channels))
+        # per-source result arrays so a read allocates nothing
+        self.results = [array("f", [0.0] * len(source.channels)) for source in sources]
+        self.pending = bytearray(len(sources))
+        self.remaining = 0
+        # counters
+        self.samples = 0
+        self.polls = 0
+        self.timeouts = 0
+        self.total_window = 0.0
+        self.max_window = 0.0
+
+    def start(self):
+        # Trigger every source and open a new sample, values are kept until replaced
+        sample = self.sample
+        sample.started = self.clock()
+        for i in range(len(sample.state)):
+            sample.state[i] = STALE
+        self.remaining = len(self.sources)
+        for i in range(len(self.sources)):
+            source = self.sources[i]
+            self.pending[i] = 1
+            if source.trigger is not None:
+                try:
+                    source.trigger()
+                except Exception as e:
+                    self.fail(i, e)
+        sample.bus_time = self.clock() - sample.started
+
+    def poll(self) -> bool:
+        # One non-blocking pass over the pending sources, True once the sample is complete or timed out
+        self.polls += 1
+        sample = self.sample
+        began = self.clock()
+        for i in range(len(self.sources)):
+            if not self.pending[i]:
+                continue
+            source = self.sources[i]
+            try:
+                if source.ready is not None and not source.ready():
+                    continue
+                if self.stages is not None:
+                    started = self.profiler.begin()
+                    source.read(self.results[i])
+                    self.profiler.end(self.stages[i], started)
+                else:
+                    source.read(self.results[i])
+            except Exception as e:
+                self.fail(i, e)
+                continue
+            offset = self.clock() - sample.started
+            values = self.results[i]
+            slots = self.slots[i]
+            for j in range(len(slots)):
+                sample.values[slots[j]] = values[j]
+                sample.offsets[slots[j]] = offset
+                sample.state[slots[j]] = FRESH
+            source.reads += 1
+            self.pending[i] = 0
+            self.remaining -= 1
+        now = self.clock()
+        sample.bus_time += now - began
+        if self.remaining and now - sample.started < self.timeout:
+            return False
+        self.finish()
+        return True
+
+    def fail(self, i: int, error: Exception):
+        # Source i raised, its channels read 0.0 and are marked failed for this sample
+        source = self.sources[i]
+        sample = self.sample
+        if self.stages is not None:
+            self.stages[i].errors += 1
+        source.failures += 1
+        self.pending[i] = 0
+        self.remaining -= 1
+        for slot in self.slots[i]:
+            sample.values[slot] = 0.0
+            sample.state[slot] = FAILED
+        if self.on_error is not None:
+            self.on_error(source, error)
+
+    def finish(self):
+        sample = self.sample
+        if self.remaining:
+            self.timeouts += 1
+            for i in range(len(self.sources)):
+                if self.pending[i]:
+                    source = self.sources[i]
+                    source.stale += 1
+                    self.pending[i] = 0
+                    if source.cancel is not None:
+                        try:
+                            source.cancel()
+                        except Exception as e:
+                            print("Cancelling {0} failed: {1}".format(source.name, e))
+            self.remaining = 0
+        sample.finished = self.clock()
+        window = sample.finished - sample.started
+        self.samples += 1
+        self.total_window += window
+        self.max_window = max(self.max_window, window)
+
+    def acquire(self, sleep=time.sleep) -> SampleSet:
+        self.start()
+        while not self.poll():
+            sleep(self.poll_interval)
+        return self.sample
+
+    async def acquire_async(self) -> SampleSet:
+        # Same as acquire, but the other scheduler tasks run while waiting for data-ready
+        if self.sleep is not None:
+            return self.acquire(self.sleep)
+        self.start()
+        while not self.poll():
+            await asyncio.sleep(self.poll_interval)
+        return self.sample
+
+    def stats(self) -> dict:
+        return {
+            "samples": self.samples,
+            "mean_window_ms": 1000 * self.total_window / self.samples if self.samples else 0.0,
+            "max_window_ms": 1000 * self.max_window,
+            "polls": self.polls,
+            "timeouts": self.timeouts,
+            "stale": dict((source.name, source.stale) for source in self.sources if source.stale),
+            "failures": dict((source.name, source.failures) for source in self.sources if source.failures),
+        }
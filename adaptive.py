@@ -0,0 +1,150 @@
+# Adaptive sampling rate for the biofilm cell factory
+# Each watched signal keeps an exponentially smoothed level, its slope measured over at least slope_window seconds
+# (so sensor noise at short intervals doesn't read as growth) and the spread of the readings around the level.
+# Its activity score is the larger of slope / slope_limit and spread / spread_limit. When the busiest signal
+# scores above `high` the interval is cut at once, by at least half, down to the floor; it only grows again, by
+# `backoff`, after `calm_samples` samples in a row scored below `low`. The gap between the two thresholds and
+# the calm run keep the rate from flapping on a noisy signal.
+# ===================================================================================================================
+
+import math
+
+# weight of the newest residual in the spread
+SPREAD_WEIGHT = 0.25
+
+
+class SignalActivity:
+    def __init__(self, slope_limit: float, spread_limit: float, time_constant: float = 30.0,
+                 slope_window: float = 120.0):
+        # slope_limit in units per minute, spread_limit in units
+        self.slope_limit = slope_limit
+        self.spread_limit = spread_limit
+        self.time_constant = time_constant
+        self.slope_window = slope_window
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.level = 0.0
+        self.variance = 0.0
+        self.slope = 0.0
+        self.last_time = 0.0
+        self.reference_time = 0.0
+        self.reference_level = 0.0
+        self.score = 0.0
+
+    @property
+    def spread(self) -> float:
+        return math.sqrt(self.variance)
+
+    def update(self, value: float, now: float) -> float:
+        # Add a fresh reading, returns the activity score
+        if self.count == 0:
+            self.level = value
+            self.last_time = self.reference_time = now
+            self.reference_level = value
+            self.count = 1
+            return 0.0
+        # the level is smoothed by elapsed time so it means the same at any sampling rate, the spread per sample
+        # so a jump between two slow samples still shows
+        alpha = 1.0 - math.exp(-max(now - self.last_time, 0.0) / self.time_constant)
+        residual = value - self.level
+        self.level += alpha * residual
+        self.variance += SPREAD_WEIGHT * (residual * residual - self.variance)
+        self.last_time = now
+        self.count += 1
+        span = now - self.reference_time
+        if span >= self.slope_window:
+            self.slope = 60.0 * (self.level - self.reference_level) / span
+            self.reference_time = now
+            self.reference_level = self.level
+        self.score = max(abs(self.slope) / self.slope_limit, self.spread / self.spread_limit)
+        return self.score
+
+
+class AdaptiveRate:
+    def __init__(self, interval: float, floor: float, ceiling: float, signals: dict, high: float = 1.0,
+                 low: float = 0.5, calm_samples: int = 5, backoff: float = 1.5):
+        # floor is the shortest interval in seconds, ceiling the longest; signals maps record keys to SignalActivity
+        if not 0 < floor <= ceiling:
+            raise ValueError("Need 0 < floor <= ceiling, got {0} and {1}".format(floor, ceiling))
+        if low >= high:
+            raise ValueError("low ({0}) must be below high ({1}) for hysteresis".format(low, high))
+        self.floor = floor
+        self.ceiling = ceiling
+        self.interval = min(ceiling, max(floor, interval))
+        self.signals = signals
+        self.high = high
+        self.low = low
+        self.calm_samples = calm_samples
+        self.backoff = backoff
+        self.calm = 0
+        self.score = 0.0
+        # counters
+        self.samples = 0
+        self.speedups = 0
+        self.slowdowns = 0
+        self.samples_at_floor = 0
+        self.samples_at_ceiling = 0
+
+    def observe(self, key: str, value: float, now: float):
+        self.signals[key].update(value, now)
+
+    def adjust(self) -> float:
+        # Pick the next interval from the signals' latest scores
+        score = 0.0
+        for signal in self.signals.values():
+            if signal.score > score:
+                score = signal.score
+        self.score = score
+        self.samples += 1
+        interval = self.interval
+        if score >= self.high:
+            self.calm = 0
+            interval = max(self.floor, interval / max(2.0, score))
+        elif score < self.low:
+            self.calm += 1
+            if self.calm >= self.calm_samples:
+                self.calm = 0
+                interval = min(self.ceiling, interval * self.backoff)
+        else:
+            self.calm = 0
+        if interval < self.interval:
+            self.speedups += 1
+        elif interval > self.interval:
+            self.slowdowns += 1
+        self.interval = interval
+        if interval == self.floor:
+            self.samples_at_floor += 1
+        elif interval == self.ceiling:
+            self.samples_at_ceiling += 1
+        return interval
+
+    def stats(self) -> dict:
+        return {
+            "interval_s": self.interval,
+            "score": self.score,
+            "speedups": self.speedups,
+            "slowdowns": self.slowdowns,
+            "samples_at_floor": self.samples_at_floor,
+            "samples_at_ceiling": self.samples_at_ceiling,
+            "slopes_per_min": dict((key, signal.slope) for key, signal in self.signals.items()),
+            "spreads": dict((key, signal.spread) for key, signal in self.signals.items()),
+        }
+
+
+class LagClock:
+    # Pushes into CO2LagBuffer on a fixed time grid, so CO2_lag_depth keeps meaning depth * step seconds when the
+    # sampling interval changes: faster samples are skipped, a slower one is pushed once per step it spans.
+    def __init__(self, step: float):
+        self.step = step
+        self.last = None
+
+    def pushes(self, now: float) -> int:
+        if self.last is None:
+            self.last = now
+            return 1
+        count = int((now - self.last) / self.step + 0.5)
+        if count:
+            self.last += count * self.step
+        return count
@@ -0,0 +1,19 @@
+# Offline analysis of biofilm runs logged by write_sd, as text rows or binlog records
+# Logs are streamed in chunks into NumPy arrays and every metric is vectorized per chunk, so multi-gigabyte
+# run directories are processed without loading whole files.
+#   python -m analysis /path/to/runs
+# ===================================================================================================================
+
+from analysis.reader import LOG_DTYPE, iter_chunks, iter_logs, read_log, read_window
+from analysis.metrics import (
+    ProductionIntegrator,
+    RollingStats,
+    StreamingCorrelation,
+    attenuation,
+    correlation,
+    production_curve,
+    rolling_mean,
+    rolling_std,
+)
+from analysis.rollups import read_rollup
+from analysis.runs import summarize_directory, summarize_run
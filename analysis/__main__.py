@@ -0,0 +1,48 @@
+# Summarise every log under a directory
+#   python -m analysis /path/to/runs --window 20 --flow 0.5 --curves out/
+# ===================================================================================================================
+
+import argparse
+import json
+import os
+import sys
+
+from analysis.reader import DEFAULT_CHUNK_ROWS
+from analysis.runs import save_curve, summarize_directory
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m analysis", description="Summarise biofilm run logs")
+    parser.add_argument("directory", help="directory of .csv/.bin logs, searched recursively")
+    parser.add_argument("--window", type=int, default=20, help="rolling window in samples")
+    parser.add_argument("--flow", type=float, help="chamber air flow in L/min, gives production in umol")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--curves", metavar="DIR", help="write decimated per-run curves as .npz into DIR")
+    parser.add_argument("--curve-every", type=int, default=10, help="keep every n-th row of the curves")
+    parser.add_argument("--json", action="store_true", help="one JSON summary per line")
+    args = parser.parse_args(argv)
+
+    if args.curves:
+        os.makedirs(args.curves, exist_ok=True)
+    summaries = summarize_directory(
+        args.directory, window=args.window, flow_l_per_min=args.flow, chunk_rows=args.chunk_rows,
+        curve_every=args.curve_every if args.curves else 0)
+    if not args.json:
+        print("{0:<40}{1:>10}{2:>10}{3:>14}{4:>10}{5:>10}{6:>8}{7:>9}".format(
+            "run", "rows", "hours", "production", "mean A", "r(CO2,A)", "errors", "dropped"))
+    for summary in summaries:
+        if args.curves:
+            summary["curve_file"] = save_curve(summary, args.curves, args.directory)
+        summary.pop("curve", None)
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            print("{0:<40}{1:>10}{2:>10.2f}{3:>14.3f}{4:>10.3f}{5:>10.3f}{6:>8}{7:>9}".format(
+                os.path.basename(summary["path"])[:39], summary["rows"], summary["duration_h"],
+                summary["production"], summary["mean_absorbance"], summary["r_co2_absorbance"],
+                summary["errors"], summary["dropped_rows"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+# Vectorized metrics for biofilm runs
+# Each metric has a plain function for whole arrays and, where it needs history, a streaming class that carries
+# just enough state between chunks (the previous sample, a window tail or running moments) to give the same
+# result as processing the whole run at once.
+# ===================================================================================================================
+
+import numpy as np
+
+# Litres per mole of ideal gas at 25 C and 1 atm, the SCD30 reports ppm at chamber conditions
+MOLAR_VOLUME = 24.465
+
+
+class ProductionIntegrator:
+    # Cumulative biofilm CO2 production by trapezoidal integration over time.
+    # Without a flow rate the result is in ppm x hours; with the chamber's air flow in L/min it is in umol CO2.
+    def __init__(self, flow_l_per_min: float = None, molar_volume: float = MOLAR_VOLUME):
+        self.flow = flow_l_per_min
+        self.molar_volume = molar_volume
+        self.last_time = None
+        self.last_value = None
+        self.total = 0.0
+
+    def rate(self, biofilm_co2: np.ndarray) -> np.ndarray:
+        # Production rate per second for each sample, in ppm/3600 or umol/s
+        if self.flow is None:
+            return biofilm_co2 / 3600.0
+        return biofilm_co2 * self.flow / self.molar_volume / 60.0
+
+    def update(self, seconds: np.ndarray, biofilm_co2: np.ndarray) -> np.ndarray:
+        seconds = np.asarray(seconds, dtype=np.float64)
+        rate = np.nan_to_num(self.rate(np.asarray(biofilm_co2, dtype=np.float64)))
+        if not len(seconds):
+            return np.zeros(0)
+        if self.last_time is None:
+            self.last_time = seconds[0]
+            self.last_value = rate[0]
+        times = np.concatenate(([self.last_time], seconds))
+        rates = np.concatenate(([self.last_value], rate))
+        steps = np.diff(times) * (rates[1:] + rates[:-1]) / 2.0
+        curve = self.total + np.cumsum(steps)
+        self.total = curve[-1]
+        self.last_time = seconds[-1]
+        self.last_value = rate[-1]
+        return curve
+
+
+def production_curve(seconds: np.ndarray, biofilm_co2: np.ndarray, flow_l_per_min: float = None) -> np.ndarray:
+    return ProductionIntegrator(flow_l_per_min).update(seconds, biofilm_co2)
+
+
+def attenuation(lux_start: np.ndarray, lux_end: np.ndarray, dark: float = 0.0) -> tuple:
+    # Transmittance and absorbance (-log10 T) of the biofilm between the two light sensors.
+    # Samples without light at the start sensor give NaN.
+    start = np.asarray(lux_start, dtype=np.float64) - dark
+    end = np.asarray(lux_end, dtype=np.float64) - dark
+    with np.errstate(divide="ignore", invalid="ignore"):
+        transmittance = np.where(start > 0, end / start, np.nan)
+        absorbance = -np.log10(np.where(transmittance > 0, transmittance, np.nan))
+    return transmittance, absorbance
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    # Trailing mean over `window` samples, the first window - 1 results are NaN
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if window < 1 or len(values) < window:
+        return result
+    sums = np.cumsum(np.concatenate(([0.0], values)))
+    result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    # Trailing sample standard deviation, centred first so the sum of squares doesn't cancel
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if window < 2 or len(values) < window:
+        return result
+    centred = values - np.nanmean(values)
+    sums = np.cumsum(np.concatenate(([0.0], centred)))
+    squares = np.cumsum(np.concatenate(([0.0], centred * centred)))
+    total = sums[window:] - sums[:-window]
+    total_sq = squares[window:] - squares[:-window]
+    variance = (total_sq - total * total / window) / (window - 1)
+    result[window - 1:] = np.sqrt(np.maximum(variance, 0.0))
+    return result
+
+
+class RollingStats:
+    # rolling_mean/rolling_std across chunk boundaries by carrying the last window - 1 samples
+    def __init__(self, window: int):
+        self.window = window
+        self.tail = np.zeros(0)
+
+    def update(self, values: np.ndarray) -> tuple:
+        values = np.asarray(values, dtype=np.float64)
+        joined = np.concatenate((self.tail, values))
+        skip = len(self.tail)
+        means = rolling_mean(joined, self.window)[skip:]
+        stds = rolling_std(joined, self.window)[skip:]
+        self.tail = joined[-(self.window - 1):] if self.window > 1 else np.zeros(0)
+        return means, stds
+
+
+class StreamingCorrelation:
+    # Pearson correlation from per-chunk moments merged with Chan's parallel update, NaN pairs are ignored
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.co_moment = 0.0
+
+    def update(self, x: np.ndarray, y: np.ndarray):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        x = x[valid]
+        y = y[valid]
+        n = len(x)
+        if not n:
+            return self
+        mean_x = x.mean()
+        mean_y = y.mean()
+        dx = x - mean_x
+        dy = y - mean_y
+        total = self.count + n
+        delta_x = mean_x - self.mean_x
+        delta_y = mean_y - self.mean_y
+        self.m2_x += (dx * dx).sum() + delta_x * delta_x * self.count * n / total
+        self.m2_y += (dy * dy).sum() + delta_y * delta_y * self.count * n / total
+        self.co_moment += (dx * dy).sum() + delta_x * delta_y * self.count * n / total
+        self.mean_x += delta_x * n / total
+        self.mean_y += delta_y * n / total
+        self.count = total
+        return self
+
+    @property
+    def r(self) -> float:
+        if self.count < 2 or self.m2_x <= 0 or self.m2_y <= 0:
+            return float("nan")
+        return self.co_moment / np.sqrt(self.m2_x * self.m2_y)
+
+
+def correlation(x: np.ndarray, y: np.ndarray) -> float:
+    return StreamingCorrelation().update(x, y).r
@@ -0,0 +1,196 @@
+# Chunked log reader
+# Text logs come in two dialects: Refactored_OOP_code's "YYYY-MM-DD, HH:MM:SS,elapsed,...,{error dict}" and the
+# older ", "-separated rows of Code_with_MQTT.py. Both split the timestamp over two fields and end in a stringified
+# error dict full of commas, so a row is split at most eleven times and the dict is reduced to its error total.
+# CSVs from binlog_export (ISO timestamp, per-record error increments) are read too, as are binary logs through
+# binlog_export itself. A run written in chunk files is read through its .idx (see chunklog.py), which also lets
+# read_window fetch a time range without scanning the run. Every chunk is a LOG_DTYPE structured array.
+# ===================================================================================================================
+
+import itertools
+import os
+import re
+
+import numpy as np
+
+CHANNELS = ("lux_start", "lux_end", "ambient_co2", "system_co2", "biofilm_co2",
+            "temperature", "humidity", "pressure")
+LOG_DTYPE = np.dtype([("epoch", "<i8"), ("elapsed", "<f8")] + [(name, "<f8") for name in CHANNELS]
+                     + [("errors", "<i8")])
+LOG_EXTENSIONS = (".csv", ".bin")
+INDEX_EXTENSION = ".idx"
+# files written next to a log that aren't logs themselves
+SIDECARS = ("-outbox", "-profile", "-rollup")
+CHUNK_NAME = re.compile(r"^(.*)\.\d{4}\.(csv|bin)$")
+ERROR_COUNT = re.compile(r":\s*(\d+)")
+DEFAULT_CHUNK_ROWS = 100000
+
+
+def parse_lines(lines: list, exported_errors: int = 0, dropped: list = None) -> tuple:
+    # Returns the chunk and the running error total of exported rows, to carry into the next chunk. Rows that
+    # don't parse (a torn row run into the next one, a damaged sector) are left out and, with a dropped list,
+    # appended to it.
+    stamps = []
+    values = []
+    errors = []
+    for line in lines:
+        parts = line.split(",", 11)
+        if len(parts) < 11 or not parts[0][:1].isdigit():
+            # header, blank or truncated row (e.g. power lost mid-write)
+            continue
+        exported = parts[0][10:11] == "T"
+        try:
+            if exported:
+                # binlog_export row: ISO timestamp, elapsed, channels, error increments, flags
+                parts = line.split(",")
+                stamp = np.datetime64(parts[0], "s")
+                numbers = [float(value) for value in parts[1:10]]
+                total = exported_errors + sum(int(n) for n in parts[10:-1])
+            else:
+                stamp = np.datetime64(parts[0].strip() + "T" + parts[1].strip(), "s")
+                numbers = [float(value) for value in parts[2:11]]
+                total = sum(int(n) for n in ERROR_COUNT.findall(parts[11])) if len(parts) > 11 else 0
+            if len(numbers) != 9:
+                raise ValueError("{0} values".format(len(numbers)))
+        except ValueError:
+            if dropped is not None:
+                dropped.append(line.rstrip("\n"))
+            continue
+        if exported:
+            exported_errors = total
+        stamps.append(stamp)
+        values.append(numbers)
+        errors.append(total)
+    chunk = np.zeros(len(stamps), dtype=LOG_DTYPE)
+    if not stamps:
+        return chunk, exported_errors
+    chunk["epoch"] = np.array(stamps, dtype="datetime64[s]").astype(np.int64)
+    numbers = np.array(values, dtype=np.float64)
+    chunk["elapsed"] = numbers[:, 0]
+    for i, name in enumerate(CHANNELS):
+        chunk[name] = numbers[:, i + 1]
+    chunk["errors"] = errors
+    return chunk, exported_errors
+
+
+def iter_text_chunks(path: str, chunk_rows: int, dropped: list = None):
+    with open(path, "r", errors="replace") as file:
+        exported_errors = 0
+        while True:
+            lines = list(itertools.islice(file, chunk_rows))
+            if not lines:
+                break
+            chunk, exported_errors = parse_lines(lines, exported_errors, dropped)
+            if len(chunk):
+                yield chunk
+
+
+def iter_binary_chunks(path: str, chunk_rows: int, errors: int = 0):
+    # errors is the running error total the file's increments start from
+    import binlog_export
+
+    buffer = binlog_export.open_log(path)
+    try:
+        pending = []
+        pending_rows = 0
+        for records in binlog_export.iter_arrays(buffer):
+            pending.append(records)
+            pending_rows += len(records)
+            if pending_rows >= chunk_rows:
+                chunk, errors = convert_records(np.concatenate(pending), errors)
+                pending = []
+                pending_rows = 0
+                yield chunk
+        if pending:
+            chunk, errors = convert_records(np.concatenate(pending), errors)
+            pending = None
+            yield chunk
+    finally:
+        # views into the map have to go before it can be closed
+        pending = records = None
+        buffer.close()
+
+
+def convert_records(records: np.ndarray, errors: int) -> tuple:
+    import binlog
+
+    chunk = np.zeros(len(records), dtype=LOG_DTYPE)
+    chunk["epoch"] = records["timestamp"]
+    chunk["elapsed"] = records["elapsed"]
+    for name in CHANNELS:
+        chunk[name] = records[name]
+    # binary records carry increments, text rows running totals
+    increments = sum(records["err_" + key].astype(np.int64) for key in binlog.ERROR_KEYS)
+    chunk["errors"] = errors + np.cumsum(increments)
+    return chunk, int(chunk["errors"][-1]) if len(chunk) else errors
+
+
+def iter_chunked_run(path: str, chunk_rows: int, dropped: list = None):
+    # Chunk files of an indexed run in order, binary error increments carried from one into the next
+    from chunklog import ChunkReader
+
+    reader = ChunkReader(path)
+    errors = 0
+    for number in reader.chunks():
+        if reader.binary:
+            for chunk in iter_binary_chunks(reader.path(number), chunk_rows, errors):
+                errors = int(chunk["errors"][-1])
+                yield chunk
+        else:
+            yield from iter_text_chunks(reader.path(number), chunk_rows, dropped)
+
+
+def iter_chunks(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, dropped: list = None):
+    # LOG_DTYPE arrays of at most about chunk_rows rows, unparseable text rows go to dropped
+    if path.endswith(INDEX_EXTENSION):
+        return iter_chunked_run(path, chunk_rows, dropped)
+    if path.endswith(".bin"):
+        return iter_binary_chunks(path, chunk_rows)
+    return iter_text_chunks(path, chunk_rows, dropped)
+
+
+def to_epoch(value) -> int:
+    # Epoch seconds from an int, an ISO string or a datetime64
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return int(np.datetime64(value, "s").astype(np.int64))
+
+
+def read_window(path: str, start=None, end=None, dropped: list = None) -> np.ndarray:
+    # Rows of a chunked run (its .idx or base path) from start to end inclusive, reading only the blocks the index
+    # places in that range. Error totals of binary logs count from the window's start.
+    from chunklog import ChunkReader
+
+    reader = ChunkReader(path)
+    rows = list(reader.rows(to_epoch(start), to_epoch(end)))
+    if reader.binary:
+        import binlog_export
+
+        chunk, _ = convert_records(np.array(rows, dtype=binlog_export.numpy_dtype()), 0)
+    else:
+        chunk, _ = parse_lines(rows, 0, dropped)
+    return chunk
+
+
+def read_log(path: str, dropped: list = None) -> np.ndarray:
+    chunks = list(iter_chunks(path, dropped=dropped))
+    if not chunks:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    return np.concatenate(chunks)
+
+
+def iter_logs(directory: str):
+    # Log files under a run directory in name order, which is start time order for write_sd's file names.
+    # A chunked run is yielded once as its .idx, outbox spills, profile summaries and rollups are skipped.
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        indexed = set(name[:-len(INDEX_EXTENSION)] for name in files if name.endswith(INDEX_EXTENSION))
+        for name in sorted(files):
+            if name.endswith(INDEX_EXTENSION):
+                yield os.path.join(root, name)
+                continue
+            if not name.endswith(LOG_EXTENSIONS) or any(sidecar in name for sidecar in SIDECARS):
+                continue
+            match = CHUNK_NAME.match(name)
+            if match is None or match.group(1) not in indexed:
+                yield os.path.join(root, name)
@@ -0,0 +1,165 @@
+# Queries over the rollup side files
+# The device keeps count/min/mean/max summaries of every channel at 1 minute, 1 hour and 1 day next to each run
+# (rollup.py). read_rollup answers a query at a requested resolution from the coarsest level that is still at least
+# that fine, so a month plotted by the hour reads about 100 kB instead of the whole run. Buckets a level never
+# closed (the device lost power) are rebuilt from the next finer level, and buckets a reboot split between two runs
+# are merged into one.
+# ===================================================================================================================
+
+import os
+import re
+
+import numpy as np
+
+from analysis.reader import CHANNELS, CHUNK_NAME, INDEX_EXTENSION, LOG_EXTENSIONS, to_epoch
+
+ROLLUP_NAME = re.compile(r"^(.*)-rollup-(\d+)\.bin$")
+STATS = ("count", "min", "mean", "max")
+ROLLUP_DTYPE = np.dtype([("epoch", "<i8"), ("period", "<i8")]
+                        + [("{0}_{1}".format(name, stat), "<i8" if stat == "count" else "<f8")
+                           for name in CHANNELS for stat in STATS])
+
+
+def record_dtype(channels: int) -> np.dtype:
+    # rollup.record_format as a NumPy dtype
+    return np.dtype([("start", "<u4"), ("count", "<u4", (channels,)), ("min", "<f4", (channels,)),
+                     ("mean", "<f4", (channels,)), ("max", "<f4", (channels,))])
+
+
+def read_rollup_file(path: str) -> tuple:
+    # (period, records) of one side file, a torn last record is dropped and a rewritten bucket keeps its last copy
+    import struct
+
+    import rollup
+
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < rollup.HEADER_SIZE:
+        raise ValueError("{0} is too short for a rollup header".format(path))
+    magic, version, channels, _, period = struct.unpack_from(rollup.HEADER_FORMAT, data, 0)
+    if magic != rollup.MAGIC or version != rollup.VERSION:
+        raise ValueError("{0} is not a version {1} rollup file".format(path, rollup.VERSION))
+    if channels != len(CHANNELS):
+        raise ValueError("{0} has {1} channels, expected {2}".format(path, channels, len(CHANNELS)))
+    dtype = record_dtype(channels)
+    body = data[rollup.HEADER_SIZE:]
+    records = np.frombuffer(body, dtype=dtype, count=len(body) // dtype.itemsize)
+    records = records[(records["start"] % period == 0) & (records["count"].max(axis=1) > 0)]
+    # index of the last occurrence of every start, in file order
+    _, last = np.unique(records["start"][::-1], return_index=True)
+    return period, records[np.sort(len(records) - 1 - last)]
+
+
+def run_base(path: str) -> str:
+    # Run path without extension from its .idx, a chunk file, a single-file log or a rollup file
+    directory, name = os.path.split(path)
+    match = CHUNK_NAME.match(name) or ROLLUP_NAME.match(name)
+    if match is not None:
+        return os.path.join(directory, match.group(1))
+    for extension in (INDEX_EXTENSION,) + LOG_EXTENSIONS:
+        if name.endswith(extension):
+            return os.path.join(directory, name[:-len(extension)])
+    return path
+
+
+def find_rollups(path: str) -> dict:
+    # run base -> {period: side file} for a run or every run under a directory
+    runs = {}
+    if os.path.isdir(path):
+        candidates = ((root, name) for root, _, files in os.walk(path) for name in files)
+    else:
+        base = run_base(path)
+        directory = os.path.dirname(base) or "."
+        prefix = os.path.basename(base) + "-rollup-"
+        candidates = ((directory, name) for name in os.listdir(directory) if name.startswith(prefix))
+    for root, name in candidates:
+        match = ROLLUP_NAME.match(name)
+        if match is not None:
+            runs.setdefault(os.path.join(root, match.group(1)), {})[int(match.group(2))] = os.path.join(root, name)
+    return runs
+
+
+def aggregate(records: np.ndarray, period: int) -> np.ndarray:
+    # Records combined into buckets of `period` seconds, also merges records of the same bucket.
+    # A channel with no readings in a record holds stale min/mean/max and is left out.
+    dtype = records.dtype
+    if not len(records):
+        return np.zeros(0, dtype=dtype)
+    starts, inverse = np.unique(records["start"] - records["start"] % period, return_inverse=True)
+    counts = records["count"].astype(np.int64)
+    valid = counts > 0
+    total = np.zeros((len(starts), counts.shape[1]), dtype=np.int64)
+    weighted = np.zeros(total.shape)
+    minimum = np.full(total.shape, np.inf)
+    maximum = np.full(total.shape, -np.inf)
+    np.add.at(total, inverse, counts)
+    np.add.at(weighted, inverse, np.where(valid, records["mean"].astype(np.float64) * counts, 0.0))
+    np.minimum.at(minimum, inverse, np.where(valid, records["min"], np.inf))
+    np.maximum.at(maximum, inverse, np.where(valid, records["max"], -np.inf))
+    result = np.zeros(len(starts), dtype=dtype)
+    result["start"] = starts
+    result["count"] = total
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result["mean"] = np.where(total > 0, weighted / total, 0.0)
+    result["min"] = np.where(total > 0, minimum, 0.0)
+    result["max"] = np.where(total > 0, maximum, 0.0)
+    return result
+
+
+def run_level(levels: dict, period: int) -> np.ndarray:
+    # One run's records at `period`, with the buckets after the level's last record built from a finer level
+    records = None
+    if period in levels:
+        _, records = read_rollup_file(levels[period])
+    finer = [candidate for candidate in levels if candidate < period and period % candidate == 0]
+    if not finer:
+        if records is None:
+            raise ValueError("No rollup of {0} s or finer".format(period))
+        return records
+    tail = run_level(levels, max(finer))
+    if records is None:
+        return aggregate(tail, period)
+    if len(records):
+        tail = tail[tail["start"] >= int(records["start"].max()) + period]
+    return np.concatenate([records, aggregate(tail, period)])
+
+
+def read_rollup(path: str, start=None, end=None, resolution: float = None, points: int = None) -> np.ndarray:
+    # ROLLUP_DTYPE buckets of a run (its .idx or log file) or of every run under a directory, from the coarsest
+    # level no coarser than `resolution` seconds, or than (end - start) / points. Without either the finest level
+    # is used. Buckets overlapping [start, end] are returned in time order, statistics of a channel without
+    # readings are NaN.
+    runs = find_rollups(path)
+    if not runs:
+        raise FileNotFoundError("No rollup files for {0}".format(path))
+    start, end = to_epoch(start), to_epoch(end)
+    if points is not None:
+        if start is None or end is None:
+            raise ValueError("points needs both start and end")
+        resolution = (end - start) / points
+    periods = sorted(set(period for levels in runs.values() for period in levels))
+    if resolution is None:
+        period = periods[0]
+    else:
+        usable = [period for period in periods if period <= resolution]
+        if not usable:
+            raise ValueError("The finest rollup is {0} s, read the log itself (read_window) for {1} s".format(
+                periods[0], resolution))
+        period = usable[-1]
+    parts = [run_level(levels, period) for levels in runs.values()]
+    records = aggregate(np.concatenate(parts), period)
+    keep = np.ones(len(records), dtype=bool)
+    if start is not None:
+        keep &= records["start"].astype(np.int64) + period > start
+    if end is not None:
+        keep &= records["start"].astype(np.int64) <= end
+    records = records[keep]
+    result = np.zeros(len(records), dtype=ROLLUP_DTYPE)
+    result["epoch"] = records["start"]
+    result["period"] = period
+    for i, name in enumerate(CHANNELS):
+        counts = records["count"][:, i]
+        result[name + "_count"] = counts
+        for stat in ("min", "mean", "max"):
+            result["{0}_{1}".format(name, stat)] = np.where(counts > 0, records[stat][:, i], np.nan)
+    return result
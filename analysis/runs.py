@@ -0,0 +1,97 @@
+# Per-run summaries over a directory of logs
+# Every log is streamed chunk by chunk through the metrics, only running state and an optional decimated curve
+# are kept, so memory use doesn't depend on run length.
+# ===================================================================================================================
+
+import os
+
+import numpy as np
+
+from analysis.metrics import ProductionIntegrator, RollingStats, StreamingCorrelation, attenuation
+from analysis.reader import DEFAULT_CHUNK_ROWS, iter_chunks, iter_logs
+
+CURVE_FIELDS = ("epoch", "biofilm_co2", "production", "absorbance", "co2_rolling_mean", "co2_rolling_std")
+
+
+def summarize_run(path: str, window: int = 20, flow_l_per_min: float = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                  curve_every: int = 0) -> dict:
+    # curve_every > 0 also returns every n-th row of the derived curves under "curve"
+    integrator = ProductionIntegrator(flow_l_per_min)
+    rolling = RollingStats(window)
+    co2_vs_lux = StreamingCorrelation()
+    co2_vs_absorbance = StreamingCorrelation()
+    rows = 0
+    first_epoch = last_epoch = None
+    absorbance_sum = 0.0
+    absorbance_count = 0
+    last_absorbance = float("nan")
+    max_rolling_std = float("nan")
+    errors = 0
+    curve = []
+    dropped = []
+
+    for chunk in iter_chunks(path, chunk_rows, dropped):
+        seconds = chunk["epoch"].astype(np.float64)
+        production = integrator.update(seconds, chunk["biofilm_co2"])
+        transmittance, absorbance = attenuation(chunk["lux_start"], chunk["lux_end"])
+        means, stds = rolling.update(chunk["biofilm_co2"])
+        co2_vs_lux.update(chunk["biofilm_co2"], chunk["lux_end"])
+        co2_vs_absorbance.update(chunk["biofilm_co2"], absorbance)
+
+        valid = absorbance[~np.isnan(absorbance)]
+        absorbance_sum += valid.sum()
+        absorbance_count += len(valid)
+        if len(valid):
+            last_absorbance = valid[-1]
+        if not np.all(np.isnan(stds)):
+            max_rolling_std = np.nanmax([max_rolling_std, np.nanmax(stds)])
+        if first_epoch is None:
+            first_epoch = int(chunk["epoch"][0])
+        last_epoch = int(chunk["epoch"][-1])
+        errors = int(chunk["errors"][-1])
+
+        if curve_every > 0:
+            # keep the phase of the decimation across chunks
+            start = (-rows) % curve_every
+            picked = slice(start, None, curve_every)
+            curve.append(np.rec.fromarrays(
+                (chunk["epoch"][picked], chunk["biofilm_co2"][picked], production[picked],
+                 absorbance[picked], means[picked], stds[picked]), names=CURVE_FIELDS))
+        rows += len(chunk)
+
+    summary = {
+        "path": path,
+        "rows": rows,
+        "start_epoch": first_epoch,
+        "end_epoch": last_epoch,
+        "duration_h": (last_epoch - first_epoch) / 3600.0 if rows else 0.0,
+        "production": integrator.total,
+        "production_unit": "umol" if flow_l_per_min else "ppm*h",
+        "mean_absorbance": absorbance_sum / absorbance_count if absorbance_count else float("nan"),
+        "final_absorbance": float(last_absorbance),
+        "max_co2_rolling_std": float(max_rolling_std),
+        "r_co2_lux_end": float(co2_vs_lux.r),
+        "r_co2_absorbance": float(co2_vs_absorbance.r),
+        "errors": errors,
+        "dropped_rows": len(dropped),
+    }
+    if curve_every > 0:
+        summary["curve"] = np.concatenate(curve) if curve else None
+    return summary
+
+
+def summarize_directory(directory: str, **kwargs):
+    # Yields one summary per log file, see summarize_run for the options
+    for path in iter_logs(directory):
+        yield summarize_run(path, **kwargs)
+
+
+def save_curve(summary: dict, directory: str, root: str = None) -> str:
+    # File named after the log's path below `root`, so runs from different subdirectories don't collide
+    if summary.get("curve") is None:
+        return None
+    name = os.path.relpath(summary["path"], root) if root else os.path.basename(summary["path"])
+    path = os.path.join(directory, name.replace(os.sep, "_") + ".curve.npz")
+    curve = summary["curve"]
+    np.savez_compressed(path, **dict((field, curve[field]) for field in CURVE_FIELDS))
+    return path
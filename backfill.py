@@ -0,0 +1,316 @@
+# Store-and-forward backfill for Adafruit IO
+# The outbox rides out short outages in memory, but readings it has to drop when its queue fills, and everything
+# between the last publish before a reboot and the first one after, never reach the feeds, although every sample
+# is on the SD card. Backfill keeps a high-water mark, the RTC epoch of the newest reading published live, and a
+# list of gaps behind it: a live publish after a drop or after boot opens the gap (mark, its epoch). Gaps are
+# replayed oldest first from the chunked SD logs (chunklog.py), averaged over windows as long as the governor's so
+# the feeds keep their density, and published with their original created_at.
+# The card logs raw readings while live uploads are filtered (dsp.py), so each gap's rows run through fresh filters
+# from filters(clock), whose clock reads the row's epoch, primed on the `warmup` seconds of rows before the gap.
+# Without filters the feeds get the logged values.
+# Live readings keep priority: a replayed window only goes out while the outbox queue is empty, and while gaps are
+# pending the governor gives up `share` of its rate so the token bucket has room for them. The mark and the gaps
+# are saved on the card (at most every save_every seconds for the mark) so a reboot resumes where it left off.
+# Replay runs inside the MQTT task, so it only opens the runs and chunks that can hold a gap's rows (run names start
+# with their start time, the index gives each chunk's) and at most max_opens files per service() call: a long walk
+# pauses and carries on at the next call instead of stalling the task.
+# ===================================================================================================================
+
+import time
+
+import binlog
+from chunklog import ChunkReader, row_epoch, run_epoch
+from throttle import WindowAggregator
+
+# next_window() result when a service() call has opened its share of files
+PAUSED = object()
+
+
+class Backfill:
+    def __init__(self, outbox, governor, runs, written, state_path: str, channels: tuple, open_file=open,
+                 share: float = 0.5, batch: int = 2, max_gaps: int = 8, save_every: float = 60,
+                 max_opens: int = 8, filters=None, warmup: int = 0, clock=None):
+        # runs() lists the chunked runs on the card (base paths) oldest first, written() is the RTC epoch of the
+        # newest row on the card. channels name the logged channels behind the outbox's feeds, in feed order,
+        # filters(clock) returns a dict of channel name -> stage with process(value), e.g. a dsp.Pipeline.
+        if max_gaps < 3:
+            raise ValueError("Backfill needs room for at least 3 gaps, got {0}".format(max_gaps))
+        self.outbox = outbox
+        self.governor = governor
+        self.runs = runs
+        self.written = written
+        self.state_path = state_path
+        self.open_file = open_file
+        self.share = share
+        self.batch = batch
+        self.max_gaps = max_gaps
+        self.save_every = save_every
+        self.max_opens = max_opens
+        self.channels = channels
+        self.filters = filters
+        self.warmup = warmup
+        self.clock = clock or time.monotonic
+        self.slots = tuple(binlog.CHANNELS.index(name) for name in channels)
+        self.aggregator = WindowAggregator(len(channels))
+        self.mark = 0
+        self.gaps = []
+        self.live = False
+        self.dropped = outbox.dropped
+        self.base_share = None
+        self.dirty = False
+        self.saved_at = None
+        # replay of gaps[0]
+        self.rows = None
+        self.window = 0.0
+        self.window_start = 0
+        self.last_epoch = 0
+        self.message = None
+        self.replay_from = 0
+        self.pipelines = ()
+        self.row_epoch = 0
+        # files opened by this service() call
+        self.opened = 0
+        # counters
+        self.gaps_opened = 0
+        self.gaps_merged = 0
+        self.replayed = 0
+        self.rows_replayed = 0
+        self.read_errors = 0
+        self.save_errors = 0
+        self.pauses = 0
+        self.load()
+
+    @property
+    def pending(self) -> bool:
+        return bool(self.gaps)
+
+    def load(self):
+        # "mark", one "start,end" line per gap and "end", a file without the trailer was torn and is ignored
+        try:
+            with self.open_file(self.state_path, "r") as file:
+                lines = file.read().split("\n")
+            if "end" not in lines:
+                raise ValueError("no trailer")
+            lines = lines[:lines.index("end")]
+            mark = int(lines[0])
+            gaps = [tuple(int(value) for value in line.split(",")) for line in lines[1:]]
+        except OSError:
+            # first boot with this card
+            return
+        except (ValueError, IndexError) as e:
+            print(f"Upload mark unreadable ({e}), backfill starts from the next publish")
+            return
+        self.mark = mark
+        self.gaps = [(start, end) for start, end in gaps][:self.max_gaps]
+
+    def save(self, force: bool = False):
+        if not force:
+            if not self.dirty or (self.saved_at is not None and self.clock() - self.saved_at < self.save_every):
+                return
+        lines = [str(self.mark)] + ["{0},{1}".format(start, end) for start, end in self.gaps] + ["end", ""]
+        try:
+            with self.open_file(self.state_path, "w") as file:
+                file.write("\n".join(lines))
+        except Exception as e:
+            print(f"Error saving upload mark: {e}")
+            self.save_errors += 1
+            return
+        self.saved_at = self.clock()
+        self.dirty = False
+
+    def published(self, epoch: int):
+        # Outbox hook, called for every live reading that reached Adafruit IO
+        if epoch <= 0:
+            return
+        if self.mark and epoch > self.mark and (not self.live or self.outbox.dropped != self.dropped):
+            self.open_gap(self.mark, epoch)
+        self.live = True
+        self.dropped = self.outbox.dropped
+        if epoch > self.mark:
+            self.mark = epoch
+            self.dirty = True
+            self.save()
+
+    def open_gap(self, start: int, end: int):
+        # Readings strictly between start and end are missing from the feeds
+        self.gaps.append((start, end))
+        self.gaps_opened += 1
+        if len(self.gaps) > self.max_gaps:
+            # merge the two closest gaps, republishing the few readings between them; the one being replayed stays
+            first = 1 if self.rows is not None else 0
+            i = min(range(first, len(self.gaps) - 1), key=lambda i: self.gaps[i + 1][0] - self.gaps[i][1])
+            self.gaps[i:i + 2] = [(self.gaps[i][0], self.gaps[i + 1][1])]
+            self.gaps_merged += 1
+        self.save(force=True)
+
+    def throttle(self, on: bool):
+        # Cuts the governor's share while gaps are pending, restores it once they're replayed
+        if on and self.base_share is None:
+            self.base_share = self.governor.share
+            self.governor.share = self.base_share * (1 - self.share)
+        elif not on and self.base_share is not None:
+            self.governor.share = self.base_share
+            self.base_share = None
+
+    def service(self) -> int:
+        # Publish up to `batch` replayed windows when the outbox is idle, returns how many were sent
+        if not self.gaps:
+            return 0
+        self.throttle(True)
+        outbox = self.outbox
+        if (outbox.io is None or not outbox.connected or outbox.queue or outbox.spill_pending
+                or self.clock() < outbox.next_attempt):
+            return 0
+        if self.written() < self.gaps[0][1]:
+            # the rows up to the gap's end are still in the SD logger's buffer
+            return 0
+        sent = 0
+        self.opened = 0
+        while sent < self.batch:
+            if self.message is None:
+                try:
+                    self.message = self.next_window()
+                except Exception as e:
+                    # start the gap over from its last published window on the next call
+                    print(f"Error reading SD log for backfill: {e}")
+                    self.read_errors += 1
+                    self.rows = None
+                    self.aggregator.reset()
+                    break
+                if self.message is PAUSED:
+                    self.message = None
+                    self.pauses += 1
+                    break
+                if self.message is None:
+                    self.finish_gap()
+                    break
+            epoch, values = self.message
+            if outbox.bucket is not None and not outbox.bucket.take(len(values)):
+                break
+            try:
+                outbox.io.publish(outbox.group, outbox.payload(epoch, values), is_group=True)
+            except Exception as e:
+                outbox.fail(e)
+                break
+            self.message = None
+            self.replayed += 1
+            sent += 1
+            self.gaps[0] = (epoch, self.gaps[0][1])
+            self.dirty = True
+            self.save()
+        return sent
+
+    def next_window(self) -> tuple:
+        # (epoch, values) of the next replayed window of gaps[0], None once the gap is done, PAUSED when this
+        # call's file opens are used up
+        aggregator = self.aggregator
+        if self.rows is None:
+            start, end = self.gaps[0]
+            self.replay_from = start + 1
+            self.pipelines = self.make_pipelines()
+            self.rows = self.iter_rows(start + 1 - (self.warmup if self.pipelines else 0), end - 1)
+            self.window = len(self.outbox.feeds) / (self.governor.bucket.rate * self.base_share)
+            aggregator.reset()
+        for row in self.rows:
+            if row is None:
+                return PAUSED
+            epoch, values = row
+            if self.pipelines:
+                values = self.filter(epoch, values)
+                if epoch < self.replay_from:
+                    continue
+            self.rows_replayed += 1
+            if aggregator.count and epoch - self.window_start >= self.window:
+                message = self.close_window()
+                self.add(epoch, values)
+                return message
+            self.add(epoch, values)
+        if aggregator.count:
+            return self.close_window()
+        return None
+
+    def make_pipelines(self) -> tuple:
+        # Fresh filter state per gap, None for a channel replayed as logged
+        if self.filters is None:
+            return ()
+        filters = self.filters(self.replay_clock)
+        return tuple(filters.get(name) for name in self.channels)
+
+    def replay_clock(self) -> float:
+        return self.row_epoch
+
+    def filter(self, epoch: int, values: tuple) -> tuple:
+        self.row_epoch = epoch
+        return tuple(value if pipeline is None else pipeline.process(value)
+                     for value, pipeline in zip(values, self.pipelines))
+
+    def add(self, epoch: int, values: tuple):
+        if not self.aggregator.count:
+            self.window_start = epoch
+        self.aggregator.add(values)
+        self.last_epoch = epoch
+
+    def close_window(self) -> tuple:
+        aggregator = self.aggregator
+        values = aggregator.means()
+        if self.governor.extremes:
+            values += tuple(aggregator.minimums) + tuple(aggregator.maximums)
+        aggregator.reset()
+        return self.last_epoch, values
+
+    def finish_gap(self):
+        self.gaps.pop(0)
+        self.rows = None
+        self.save(force=True)
+        if not self.gaps:
+            self.throttle(False)
+
+    def iter_rows(self, start: int, end: int):
+        # (epoch, channel values) of the logged rows in [start, end], run after run, and None whenever the
+        # call's file opens are used up; the generator carries on from there on the next call
+        runs = self.runs()
+        starts = [run_epoch(run) for run in runs]
+        for i, run in enumerate(runs):
+            # a run's rows lie between its start and the next run's
+            if starts[i] is not None and starts[i] > end:
+                break
+            if i + 1 < len(runs) and starts[i + 1] is not None and starts[i + 1] < start:
+                continue
+            while self.opened >= self.max_opens:
+                yield None
+            try:
+                reader = ChunkReader(run, self.open_counted)
+            except OSError:
+                continue
+            for row in reader.rows(start, end):
+                try:
+                    yield self.extract(row)
+                except (ValueError, IndexError):
+                    self.read_errors += 1
+                while self.opened >= self.max_opens:
+                    yield None
+
+    def open_counted(self, path: str, mode: str = "r"):
+        self.opened += 1
+        return self.open_file(path, mode)
+
+    def extract(self, row) -> tuple:
+        # text rows are "date, time,elapsed,<channels>,...", binlog records (epoch, elapsed, <channels>, ...)
+        if isinstance(row, str):
+            fields = row.split(",")
+            return row_epoch(row), tuple(float(fields[3 + slot]) for slot in self.slots)
+        return row[0], tuple(row[2 + slot] for slot in self.slots)
+
+    def stats(self) -> dict:
+        return {
+            "mark": self.mark,
+            "gaps": len(self.gaps),
+            "pending_s": sum(end - start for start, end in self.gaps),
+            "gaps_opened": self.gaps_opened,
+            "gaps_merged": self.gaps_merged,
+            "replayed": self.replayed,
+            "rows_replayed": self.rows_replayed,
+            "read_errors": self.read_errors,
+            "save_errors": self.save_errors,
+            "pauses": self.pauses,
+        }
@@ -0,0 +1,293 @@
+# Host-side throughput benchmark for the biofilm acquisition loop
+# Runs collect_data -> update_display -> write_sd -> adafruitio_upload on CPython against sim_backend and reports
+# cycles/s, per-stage latency percentiles and memory allocated per cycle
+#   python benchmark.py --cycles 2000 --latency sd=0.002 --latency mqtt=0.05 --fault scd30=0.01
+# The simulated hardware's clock jumps --step seconds ahead per cycle, so upload windows close, the outbox publishes
+# and SD rows age out as they would over that much time, while durations within a cycle stay real.
+# --chambers 1,2,4,8 repeats the run for fleets of that many chambers behind TCA9548As and tabulates how the
+# time per chamber and per round of all chambers grows with the chamber count
+# ===================================================================================================================
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from sim_backend import ROLES, SimBackend
+import Refactored_OOP_code
+from Refactored_OOP_code import Biofilm_Fleet, Biofilm_Measure
+from chambers import mux_chambers
+
+STAGES = ("collect_data", "update_display", "write_sd", "adafruitio_upload")
+
+
+class SteppedClock:
+    # The wall clock plus the seconds skipped so far
+    def __init__(self):
+        self.offset = 0.0
+
+    def __call__(self) -> float:
+        return time.perf_counter() + self.offset
+
+    def sleep(self, seconds: float):
+        self.offset += seconds
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_cycle(monitor: Biofilm_Measure, timings: dict, errors: dict):
+    clock = time.perf_counter
+    start = clock()
+    try:
+        data = monitor.collect_data()
+    except Exception:
+        errors["collect_data"] += 1
+        return
+    after_collect = clock()
+    monitor.bus_timer.add("sensors", after_collect - start)
+    try:
+        monitor.update_display(data)
+    except Exception:
+        errors["update_display"] += 1
+    after_display = clock()
+    try:
+        elapsed_time = monitor.read_clock()
+        monitor.write_sd(monitor.raw_record, elapsed_time)
+    except Exception:
+        errors["write_sd"] += 1
+    after_write = clock()
+    try:
+        monitor.adafruitio_upload(data)
+    except Exception:
+        errors["adafruitio_upload"] += 1
+    end = clock()
+    if timings is not None:
+        timings["collect_data"].append(after_collect - start)
+        timings["update_display"].append(after_display - after_collect)
+        timings["write_sd"].append(after_write - after_display)
+        timings["adafruitio_upload"].append(end - after_write)
+
+
+def build_monitors(seed: int, latency: dict, faults: dict, sd_root: str = None,
+                   scd30_interval: float = 0, chambers: int = 1, clock=None) -> list:
+    # One Biofilm_Measure per chamber, a single chamber keeps the default two-bus layout
+    backend = SimBackend(seed=seed, latency=latency, sd_root=sd_root, clock=clock)
+    if chambers == 1:
+        monitors = [Biofilm_Measure(backend)]
+    else:
+        monitors = Biofilm_Fleet(mux_chambers(chambers), backend).chambers
+    for monitor in monitors:
+        # Back-to-back cycles would otherwise wait out the SCD30's 2 s conversion on every sample
+        monitor.scd_ambient.measurement_interval = scd30_interval
+        monitor.scd_system.measurement_interval = scd30_interval
+        # or the VEML7700s' integration, the simulated ones convert instantly
+        for meter in (monitor.light_start, monitor.light_end):
+            meter.tolerance = 0
+            meter.settle = 0
+        if clock is not None:
+            # waits for data-ready skip ahead rather than sleep
+            monitor.acquisition.sleep = clock.sleep
+    # The network normally comes up after the first sample, the upload stage is timed against a connected link
+    while not monitors[0].network.service():
+        pass
+    # Faults are switched on after construction so bring-up always succeeds
+    backend.faults.update(faults)
+    return monitors
+
+
+def run_round(monitors: list, timings: dict, errors: dict, clock=None, step: float = 0):
+    if clock is not None:
+        clock.sleep(step)
+    for monitor in monitors:
+        run_cycle(monitor, timings, errors)
+
+
+def run_benchmark(cycles: int = 1000, seed: int = 0, latency: dict = None, faults: dict = None,
+                  alloc_cycles: int = 200, warmup: int = 10, sd_root: str = None, scd30_interval: float = 0,
+                  chambers: int = 1, step: float = None) -> dict:
+    # A cycle is one round over every chamber, `step` virtual seconds after the previous one
+    if step is None:
+        step = Refactored_OOP_code.Reading_interval
+    clock = SteppedClock()
+    latency = latency or {}
+    faults = faults or {}
+    timings = dict((stage, []) for stage in STAGES)
+    errors = dict.fromkeys(STAGES, 0)
+    rounds = []
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        monitors = build_monitors(seed, latency, faults, sd_root, scd30_interval, chambers, clock)
+        monitor = monitors[0]
+        for _ in range(warmup):
+            run_round(monitors, None, dict.fromkeys(STAGES, 0), clock, step)
+
+        # Timing pass, tracemalloc is kept off here because it slows every allocation down
+        wall_start = time.perf_counter()
+        for _ in range(cycles):
+            round_start = time.perf_counter()
+            run_round(monitors, timings, errors, clock, step)
+            rounds.append(time.perf_counter() - round_start)
+        wall = time.perf_counter() - wall_start
+
+        # Allocation pass
+        peaks = []
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        for _ in range(alloc_cycles):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            run_round(monitors, None, dict.fromkeys(STAGES, 0), clock, step)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+        blocks_after = sys.getallocatedblocks()
+        for chamber in monitors:
+            chamber.close_sd()
+
+    stages = {}
+    for stage in STAGES:
+        values = sorted(timings[stage])
+        stages[stage] = {
+            "count": len(values),
+            "errors": errors[stage],
+            "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+            "p50_ms": 1000 * percentile(values, 0.50),
+            "p95_ms": 1000 * percentile(values, 0.95),
+            "p99_ms": 1000 * percentile(values, 0.99),
+            "max_ms": 1000 * values[-1] if values else 0.0,
+        }
+    rounds.sort()
+    return {
+        "chambers": chambers,
+        "round_ms": 1000 * sum(rounds) / len(rounds) if rounds else 0.0,
+        "round_p95_ms": 1000 * percentile(rounds, 0.95),
+        "chamber_ms": 1000 * sum(rounds) / len(rounds) / chambers if rounds else 0.0,
+        "cycles": cycles,
+        "step_s": step,
+        "seed": seed,
+        "latency": latency,
+        "faults": faults,
+        "wall_s": wall,
+        "cycles_per_s": cycles / wall if wall else 0.0,
+        "stages": stages,
+        "peak_bytes_per_cycle": sum(peaks) / len(peaks) if peaks else 0.0,
+        "net_blocks_per_cycle": (blocks_after - blocks_before) / alloc_cycles if alloc_cycles else 0.0,
+        "sd_logger": monitor.sd_logger.stats(),
+        "outbox": monitor.outbox.stats(),
+        "governor": monitor.governor.stats(),
+        "acquisition": monitor.acquisition.stats(),
+        "display": monitor.display_renderer.stats(),
+        # the on-device profile's view of the same run, including the sensor reads and warmup
+        "profile": monitor.profiler.stats(),
+        "i2c": monitor.bus_timer.stats(),
+        "injected_faults": dict((role, n) for role, n in monitor.backend.fault_counts.items() if n),
+        "sd_file": monitor.sd_logger.path,
+    }
+
+
+def print_report(report: dict):
+    print("Cycles: {0} in {1:.3f} s -> {2:.1f} cycles/s".format(
+        report["cycles"], report["wall_s"], report["cycles_per_s"]))
+    if report["chambers"] > 1:
+        print("Chambers: {0}, {1:.3f} ms per round, {2:.3f} ms per chamber".format(
+            report["chambers"], report["round_ms"], report["chamber_ms"]))
+        print("Stages cover every chamber, SD and upload stats are the first chamber's")
+    print("{0:<20}{1:>10}{2:>10}{3:>10}{4:>10}{5:>10}{6:>8}".format(
+        "stage", "mean ms", "p50 ms", "p95 ms", "p99 ms", "max ms", "errors"))
+    for stage, stats in report["stages"].items():
+        print("{0:<20}{1:>10.3f}{2:>10.3f}{3:>10.3f}{4:>10.3f}{5:>10.3f}{6:>8}".format(
+            stage, stats["mean_ms"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"],
+            stats["max_ms"], stats["errors"]))
+    print("Sensor reads (on-device profile):")
+    for stage, stats in report["profile"].items():
+        if stage.startswith("measure_"):
+            print("{0:<20}{1:>10.3f}{2:>10}{3:>10.3f}{4:>10}{5:>10.3f}{6:>8}".format(
+                stage, stats["mean_ms"], "", stats["p95_ms"], "", stats["max_ms"], stats["errors"]))
+    print("Peak bytes allocated per cycle: {0:.0f}".format(report["peak_bytes_per_cycle"]))
+    print("Net blocks retained per cycle: {0:.2f}".format(report["net_blocks_per_cycle"]))
+    print("SD logger: {0}".format(report["sd_logger"]))
+    print("Outbox: {0}".format(report["outbox"]))
+    print("Upload governor: {0}".format(report["governor"]))
+    print("Acquisition: {0}".format(report["acquisition"]))
+    print("Display: {0}".format(report["display"]))
+    print("I2C time: {0}".format(report["i2c"]))
+    if report["injected_faults"]:
+        print("Injected faults: {0}".format(report["injected_faults"]))
+    print("SD output: {0}".format(report["sd_file"]))
+
+
+def print_scaling(reports: list):
+    print("{0:>9}{1:>12}{2:>16}{3:>16}{4:>14}".format(
+        "chambers", "round ms", "round p95 ms", "per chamber ms", "rounds/s"))
+    for report in reports:
+        print("{0:>9}{1:>12.3f}{2:>16.3f}{3:>16.3f}{4:>14.1f}".format(
+            report["chambers"], report["round_ms"], report["round_p95_ms"], report["chamber_ms"],
+            report["cycles_per_s"]))
+
+
+def parse_role_values(items: list, option: str) -> dict:
+    values = {}
+    for item in items or []:
+        role, _, value = item.partition("=")
+        if role not in ROLES or not value:
+            raise argparse.ArgumentTypeError(
+                "{0} expects ROLE=VALUE with ROLE in {1}, got {2!r}".format(option, ", ".join(ROLES), item))
+        values[role] = float(value)
+    return values
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition loop on simulated hardware")
+    parser.add_argument("--cycles", type=int, default=1000)
+    parser.add_argument("--alloc-cycles", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", action="append", metavar="ROLE=SECONDS",
+                        help="per-access latency for a role, may be repeated")
+    parser.add_argument("--fault", action="append", metavar="ROLE=PROBABILITY",
+                        help="per-access fault probability for a role, may be repeated")
+    parser.add_argument("--sd-root", help="directory the simulated SD card writes into")
+    parser.add_argument("--step", type=float, default=Refactored_OOP_code.Reading_interval,
+                        help="virtual seconds between cycles, the sampling interval")
+    parser.add_argument("--scd30-interval", type=float, default=0,
+                        help="simulated SCD30 measurement interval, 2 s on the real sensor")
+    parser.add_argument("--chambers", default="1", metavar="N[,N...]",
+                        help="chambers per controller, a list runs a scaling sweep (up to 8)")
+    parser.add_argument("--log-format", choices=("csv", "binary"), default=Refactored_OOP_code.SD_log_format)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        latency = parse_role_values(args.latency, "--latency")
+        faults = parse_role_values(args.fault, "--fault")
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    try:
+        counts = [int(n) for n in args.chambers.split(",")]
+    except ValueError:
+        parser.error("--chambers expects a comma separated list of counts, got {0!r}".format(args.chambers))
+    if not all(0 < n <= 8 for n in counts):
+        parser.error("--chambers counts must be between 1 and 8")
+
+    Refactored_OOP_code.SD_log_format = args.log_format
+    reports = [run_benchmark(args.cycles, args.seed, latency, faults, args.alloc_cycles, sd_root=args.sd_root,
+                             scd30_interval=args.scd30_interval, chambers=n, step=args.step) for n in counts]
+    if args.json:
+        print(json.dumps(reports[0] if len(reports) == 1 else reports, indent=2))
+    elif len(reports) == 1:
+        print_report(reports[0])
+    else:
+        print_scaling(reports)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
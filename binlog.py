@@ -0,0 +1,160 @@
+# Compact binary log format for the biofilm cell factory
+# A file is a 16 byte header followed by blocks, each block one SD flush:
+#   header  "<4sHHII"  magic b"BFLG", schema version, record size, channel count, RTC epoch at creation
+#   block   "<2sHHI"   magic b"BK", record count, payload length, CRC32 of the payload, then the records
+#   record  "<If8f7BB" RTC epoch seconds, elapsed seconds, the eight sensor channels,
+#                      error counter increments since the previous record (saturating at 255), flags
+# A record is 48 bytes against ~190 for a text row. The writer runs on the device, the reader is shared with
+# binlog_export.py on the host.
+# ===================================================================================================================
+
+import struct
+
+from sd_logger import SDLogger
+
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+SCHEMA_VERSION = 1
+FILE_MAGIC = b"BFLG"
+BLOCK_MAGIC = b"BK"
+HEADER_FORMAT = "<4sHHII"
+BLOCK_FORMAT = "<2sHHI"
+RECORD_FORMAT = "<If8f7BB"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+BLOCK_SIZE = struct.calcsize(BLOCK_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+CHANNELS = ("lux_start", "lux_end", "ambient_co2", "system_co2", "biofilm_co2",
+            "temperature", "humidity", "pressure")
+ERROR_KEYS = ("lux_start", "lux_end", "ambient_co2", "system_co2", "temp", "humidity", "pressure")
+FIELDS = ("timestamp", "elapsed") + CHANNELS + tuple("err_" + key for key in ERROR_KEYS) + ("flags",)
+
+
+class BinlogError(ValueError):
+    pass
+
+
+def checksum(data) -> int:
+    if crc32 is not None:
+        return crc32(data) & 0xFFFFFFFF
+    # Bitwise CRC32 for builds without binascii.crc32
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ (0xEDB88320 & -(crc & 1))
+    return crc ^ 0xFFFFFFFF
+
+
+def rtc_epoch(t) -> int:
+    # Seconds since 1970-01-01 for an RTC struct_time, independent of the port's own time epoch
+    return civil_epoch(t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
+
+
+def civil_epoch(year: int, month: int, day: int, hour: int, minute: int, second: int) -> int:
+    if month <= 2:
+        year -= 1
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+    return days * 86400 + hour * 3600 + minute * 60 + second
+
+
+class BinaryLogger(SDLogger):
+    # SDLogger that packs fixed-width records straight into its buffer and frames each flush as a CRC'd block
+    def __init__(self, open_file, path: str, start_epoch: int = 0, **kwargs):
+        super().__init__(open_file, path, **kwargs)
+        if self.max_bytes > 0xFFFF:
+            raise ValueError("Binary log blocks are limited to 65535 bytes")
+        self.start_epoch = start_epoch
+        self.block_header = bytearray(BLOCK_SIZE)
+        self.last_errors = [0] * len(ERROR_KEYS)
+        self.deltas = [0] * len(ERROR_KEYS)
+
+    def open(self):
+        if self.file is None:
+            super().open()
+            if self.file.tell() == 0:
+                self.file.write(struct.pack(HEADER_FORMAT, FILE_MAGIC, SCHEMA_VERSION, RECORD_SIZE,
+                                            len(CHANNELS), self.start_epoch))
+
+    def log(self, epoch: int, elapsed_time: float, data: dict, errors: dict) -> bool:
+        if not self.reserve(RECORD_SIZE):
+            return False
+        deltas = self.deltas
+        last = self.last_errors
+        for i in range(len(ERROR_KEYS)):
+            count = errors.get(ERROR_KEYS[i], 0)
+            delta = count - last[i]
+            deltas[i] = 255 if delta > 255 else (delta if delta > 0 else 0)
+            last[i] = count
+        struct.pack_into(RECORD_FORMAT, self.buffer, self.length, epoch, elapsed_time,
+                         data["lux_start"], data["lux_end"], data["ambient_co2"], data["system_co2"],
+                         data["biofilm_co2"], data["temperature"], data["humidity"], data["pressure"],
+                         *deltas, 0)
+        self.commit(RECORD_SIZE, epoch)
+        return True
+
+    def write_block(self, block: memoryview):
+        struct.pack_into(BLOCK_FORMAT, self.block_header, 0, BLOCK_MAGIC, len(block) // RECORD_SIZE,
+                         len(block), checksum(block))
+        self.file.write(self.block_header)
+        self.file.write(block)
+
+
+def read_header(buffer) -> dict:
+    if len(buffer) < HEADER_SIZE:
+        raise BinlogError("File is shorter than the binary log header")
+    magic, version, record_size, channels, start_epoch = struct.unpack_from(HEADER_FORMAT, buffer, 0)
+    if magic != FILE_MAGIC:
+        raise BinlogError("Not a binary biofilm log (magic {0!r})".format(magic))
+    if version != SCHEMA_VERSION or record_size != RECORD_SIZE:
+        raise BinlogError("Unsupported schema version {0} with {1} byte records".format(version, record_size))
+    return {"version": version, "record_size": record_size, "channels": channels, "start_epoch": start_epoch}
+
+
+def iter_blocks(buffer, errors: list = None, start: int = None):
+    # Yields (offset, count) of every valid block's payload, corrupt or truncated blocks are skipped
+    # and reported as (offset, reason) in `errors` when given. start is where the first block header is for a buffer
+    # that begins past the file header, None checks the file header and starts after it
+    if start is None:
+        read_header(buffer)
+        start = HEADER_SIZE
+    offset = start
+    end = len(buffer)
+    while offset + BLOCK_SIZE <= end:
+        magic, count, length, crc = struct.unpack_from(BLOCK_FORMAT, buffer, offset)
+        payload = offset + BLOCK_SIZE
+        if magic != BLOCK_MAGIC or length != count * RECORD_SIZE:
+            if errors is not None:
+                errors.append((offset, "bad block header"))
+            offset = resync(buffer, offset + 1)
+            continue
+        if payload + length > end:
+            if errors is not None:
+                errors.append((offset, "truncated block"))
+            break
+        if checksum(buffer[payload:payload + length]) != crc:
+            if errors is not None:
+                errors.append((offset, "CRC mismatch"))
+        else:
+            yield payload, count
+        offset = payload + length
+
+
+def resync(buffer, offset: int) -> int:
+    # Next position that looks like a block header, used to step over a damaged region
+    index = buffer.find(BLOCK_MAGIC, offset)
+    if index < 0:
+        return len(buffer)
+    return index
+
+
+def iter_records(buffer, errors: list = None, start: int = None):
+    for payload, count in iter_blocks(buffer, errors, start):
+        for i in range(count):
+            yield struct.unpack_from(RECORD_FORMAT, buffer, payload + i * RECORD_SIZE)
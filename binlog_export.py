@@ -0,0 +1,162 @@
+# Host-side decoder for binary biofilm logs written by binlog.BinaryLogger
+# Memory-maps the log and streams it block by block to CSV, a NumPy .npy structured array or Parquet
+#   python binlog_export.py run.bin --format csv -o run.csv
+#   python binlog_export.py run.bin --format npy -o run.npy
+#   python binlog_export.py run.bin --format parquet -o run.parquet
+# NumPy is needed for npy, pyarrow for parquet; CSV only needs the standard library
+# ===================================================================================================================
+
+import argparse
+import csv
+import mmap
+import struct
+import sys
+import time
+
+import binlog
+
+
+def numpy_dtype():
+    import numpy as np
+
+    # Mirrors binlog.RECORD_FORMAT, packed little-endian
+    fields = [("timestamp", "<u4"), ("elapsed", "<f4")]
+    fields += [(channel, "<f4") for channel in binlog.CHANNELS]
+    fields += [("err_" + key, "u1") for key in binlog.ERROR_KEYS]
+    fields += [("flags", "u1")]
+    dtype = np.dtype(fields)
+    assert dtype.itemsize == binlog.RECORD_SIZE
+    return dtype
+
+
+def open_log(path: str):
+    with open(path, "rb") as file:
+        if not file.seek(0, 2):
+            raise binlog.BinlogError("{0} is empty".format(path))
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_arrays(buffer, errors: list = None):
+    # One structured array per block, viewing the mapped file without copying
+    import numpy as np
+
+    dtype = numpy_dtype()
+    for payload, count in binlog.iter_blocks(buffer, errors):
+        yield np.frombuffer(buffer, dtype=dtype, count=count, offset=payload)
+
+
+def read_array(path: str, errors: list = None):
+    # Whole log as one structured array, for notebooks
+    buffer = open_log(path)
+    try:
+        return concatenate(list(iter_arrays(buffer, errors)))
+    finally:
+        buffer.close()
+
+
+def concatenate(arrays: list):
+    # Copies the records out of the map so it can be closed afterwards
+    import numpy as np
+
+    if not arrays:
+        return np.zeros(0, dtype=numpy_dtype())
+    return np.concatenate(arrays)
+
+
+def format_timestamp(epoch: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(epoch))
+
+
+def export_csv(buffer, output, errors: list) -> int:
+    writer = csv.writer(output)
+    writer.writerow(binlog.FIELDS)
+    rows = 0
+    unpack = struct.Struct(binlog.RECORD_FORMAT).iter_unpack
+    for payload, count in binlog.iter_blocks(buffer, errors):
+        block = buffer[payload:payload + count * binlog.RECORD_SIZE]
+        for record in unpack(block):
+            writer.writerow((format_timestamp(record[0]), "{0:.2f}".format(record[1]))
+                            + tuple("{0:.2f}".format(value) for value in record[2:10]) + record[10:])
+        rows += count
+    return rows
+
+
+def export_npy(buffer, path: str, errors: list) -> int:
+    import numpy as np
+
+    records = concatenate(list(iter_arrays(buffer, errors)))
+    np.save(path, records)
+    return len(records)
+
+
+def export_parquet(buffer, path: str, errors: list, row_group_blocks: int = 256) -> int:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dtype = numpy_dtype()
+    schema = pa.schema([(name, pa.from_numpy_dtype(dtype[name])) for name in dtype.names])
+    rows = 0
+    pending = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for array in iter_arrays(buffer, errors):
+            pending.append(array)
+            if len(pending) >= row_group_blocks:
+                rows += write_row_group(writer, schema, np.concatenate(pending))
+                pending = []
+        if pending:
+            rows += write_row_group(writer, schema, np.concatenate(pending))
+    # drop the last views into the map so the caller can close it
+    array = pending = None
+    return rows
+
+
+def write_row_group(writer, schema, records) -> int:
+    import pyarrow as pa
+
+    writer.write_table(pa.Table.from_arrays([records[name] for name in schema.names], schema=schema))
+    return len(records)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Decode a binary biofilm log")
+    parser.add_argument("log", help="binary log written by BinaryLogger")
+    parser.add_argument("--format", choices=("csv", "npy", "parquet"), default="csv")
+    parser.add_argument("-o", "--output", help="output file, CSV goes to stdout when omitted")
+    args = parser.parse_args(argv)
+
+    if args.format != "csv" and not args.output:
+        parser.error("--output is required for {0}".format(args.format))
+
+    errors = []
+    try:
+        buffer = open_log(args.log)
+    except binlog.BinlogError as e:
+        print("Error: {0}".format(e), file=sys.stderr)
+        return 1
+    try:
+        header = binlog.read_header(buffer)
+        if args.format == "csv":
+            if args.output:
+                with open(args.output, "w", newline="") as output:
+                    rows = export_csv(buffer, output, errors)
+            else:
+                rows = export_csv(buffer, sys.stdout, errors)
+        elif args.format == "npy":
+            rows = export_npy(buffer, args.output, errors)
+        else:
+            rows = export_parquet(buffer, args.output, errors)
+    except binlog.BinlogError as e:
+        print("Error: {0}".format(e), file=sys.stderr)
+        return 1
+    finally:
+        buffer.close()
+
+    print("Schema v{0}: {1} records exported".format(header["version"], rows), file=sys.stderr)
+    for offset, reason in errors:
+        print("Skipped block at byte {0}: {1}".format(offset, reason), file=sys.stderr)
+    return 0 if not errors else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+# Chamber definitions for one controller driving several biofilm reactors
+# A bus is given as (bus, mux channel): bus 0 or 1 is self.i2c or self.i2c2, the channel selects a port of a
+# TCA9548A on that bus, None means the sensor sits on the bus itself. LEDs are indices into LED_pins in
+# Refactored_OOP_code.py, which needs a pair of pins per chamber.
+# ===================================================================================================================
+
+
+class ChamberConfig:
+    def __init__(self, name: str = "", ambient: tuple = (0, None), system: tuple = (1, None), leds: tuple = (0, 1),
+                 group: str = None, feeds: tuple = None, priority: int = 0):
+        # name is appended to the log file names, leave it empty for a single chamber
+        self.name = name
+        # the ambient SCD30 and start VEML7700 share one bus, the system SCD30 and end VEML7700 the other
+        self.ambient = ambient
+        self.system = system
+        self.leds = leds
+        # Adafruit IO group and feed keys, None uses the controller's defaults
+        self.group = group
+        self.feeds = feeds
+        # higher priority chambers are sampled first when several are due at once
+        self.priority = priority
+
+    def __repr__(self) -> str:
+        return "ChamberConfig({0!r}, ambient={1}, system={2}, leds={3})".format(
+            self.name, self.ambient, self.system, self.leds)
+
+
+def mux_chambers(count: int, group: str = "biofilm") -> tuple:
+    # Up to 8 chambers behind a TCA9548A on each bus: chamber n uses the mux on bus n // 4, channels 2 (n % 4) and
+    # 2 (n % 4) + 1, and LEDs 2n and 2n + 1
+    if not 0 < count <= 8:
+        raise ValueError("Two TCA9548As have room for 1 to 8 chambers, got {0}".format(count))
+    return tuple(
+        ChamberConfig("c{0}".format(n), ambient=(n // 4, 2 * (n % 4)), system=(n // 4, 2 * (n % 4) + 1),
+                      leds=(2 * n, 2 * n + 1), group="{0}-c{1}".format(group, n))
+        for n in range(count))
@@ -0,0 +1,305 @@
+# Chunked SD logs with a time index
+# Instead of one file per boot that grows without bound, a run is written as numbered chunk files plus an index:
+#   <run>.0000.csv, <run>.0001.csv, ...  (.bin for binary logs) a new chunk starts when the current one would pass
+#                                        chunk_bytes or the rows enter a new chunk_seconds period of RTC time
+#   <run>.idx                            one text line per flushed block: chunk,offset,length,rows,first,last
+# first/last are RTC epochs (binlog.rtc_epoch) of the block's rows and offset is where the block starts, its block
+# header in a binary log, so a reader seeks straight to the blocks overlapping a time window. Every chunk stands on
+# its own (binary chunks get their own file header): a damaged chunk loses only its rows. A block is on the card
+# before its index line, so a reset between the two writes or a failed index write leaves blocks without one: a
+# reader scans a chunk from the end of its last indexed block, or from the start if it has none. The writer runs on
+# the device, ChunkReader there and on the host.
+# ===================================================================================================================
+
+import struct
+
+import binlog
+
+INDEX_EXTENSION = ".idx"
+INDEX_HEADER = "chunk,offset,length,rows,first_epoch,last_epoch\n"
+
+
+def chunk_path(base: str, chunk: int, extension: str) -> str:
+    return "{0}.{1:04}{2}".format(base, chunk, extension)
+
+
+def row_epoch(line) -> int:
+    # RTC epoch of a write_sd text row, "YYYY-MM-DD, HH:MM:SS,..."
+    return binlog.civil_epoch(int(line[0:4]), int(line[5:7]), int(line[8:10]),
+                              int(line[12:14]), int(line[15:17]), int(line[18:20]))
+
+
+def run_epoch(base: str):
+    # RTC epoch a run started at, from its name "YYYY-MM-DD,HH-MM-SS[-chamber]", None for any other name
+    name = base[base.rfind("/") + 1:]
+    try:
+        return binlog.civil_epoch(int(name[0:4]), int(name[5:7]), int(name[8:10]),
+                                  int(name[11:13]), int(name[14:16]), int(name[17:19]))
+    except ValueError:
+        return None
+
+
+class ChunkWriter:
+    def __init__(self, open_file, base: str, extension: str, chunk_bytes: int = 1048576,
+                 chunk_seconds: int = 86400):
+        # base is the run's path without extension, 0 turns either rotation limit off
+        self.open_file = open_file
+        self.base = base
+        self.extension = extension
+        self.chunk_bytes = chunk_bytes
+        self.chunk_seconds = chunk_seconds
+        self.index_path = base + INDEX_EXTENSION
+        self.index = None
+        self.chunk = 0
+        self.size = 0
+        self.period = None
+        # RTC epoch of the newest row on the card
+        self.last_epoch = 0
+        # counters
+        self.chunks = 1
+        self.entries = 0
+        self.index_errors = 0
+
+    @property
+    def path(self) -> str:
+        return chunk_path(self.base, self.chunk, self.extension)
+
+    def resume(self, chunk: int, size: int, period, last_epoch: int):
+        # Carries on a run after a warm restart, rows are appended to its current chunk and the index to its index
+        self.chunk = chunk
+        self.chunks = chunk + 1
+        self.size = size
+        self.period = period
+        self.last_epoch = last_epoch
+
+    def select(self, logger):
+        # Called before a flush: moves the logger on to a new chunk if its pending block doesn't belong in this one
+        period = logger.first_epoch // self.chunk_seconds if self.chunk_seconds else 0
+        if self.period is None:
+            self.period = period
+        elif period != self.period or (self.chunk_bytes and self.size
+                                       and self.size + logger.length > self.chunk_bytes):
+            logger.close_file()
+            self.chunk += 1
+            self.chunks += 1
+            self.size = 0
+            self.period = period
+        logger.path = self.path
+
+    def record(self, logger, offset: int, length: int):
+        # Index a block that is on the card, a failing index doesn't fail the flush: readers scan unindexed chunks
+        self.size = offset + length
+        self.last_epoch = logger.last_epoch
+        try:
+            if self.index is None:
+                self.index = self.open_file(self.index_path, "a")
+                if self.index.tell() == 0:
+                    self.index.write(INDEX_HEADER)
+            self.index.write("{0},{1},{2},{3},{4},{5}\n".format(
+                self.chunk, offset, length, logger.rows, logger.first_epoch, logger.last_epoch))
+            self.index.flush()
+            self.entries += 1
+        except Exception as e:
+            print(f"Error writing log index: {e}")
+            self.index_errors += 1
+            self.close()
+
+    def close(self):
+        if self.index is not None:
+            try:
+                self.index.close()
+            except Exception:
+                pass
+            self.index = None
+
+    def stats(self) -> dict:
+        return {
+            "chunk": self.chunk,
+            "chunk_bytes": self.size,
+            "chunks": self.chunks,
+            "index_entries": self.entries,
+            "index_errors": self.index_errors,
+        }
+
+
+def parse_index(lines):
+    # Yields (chunk, offset, length, rows, first, last) per well-formed line, a torn last line is skipped
+    for line in lines:
+        parts = line.split(",")
+        if len(parts) != 6 or not parts[0].isdigit():
+            continue
+        try:
+            yield tuple(int(part) for part in parts)
+        except ValueError:
+            continue
+
+
+def overlaps(low, high, start, end) -> bool:
+    # Whether rows between epochs low and high, None for unbounded, can fall in [start, end]
+    return (low is None or end is None or low <= end) and (high is None or start is None or high >= start)
+
+
+class ChunkReader:
+    # Reads the rows of a chunked run in a time window: text lines for a CSV log, binary record tuples for a
+    # binary one. Indexed chunks are read block by block from the offsets and scanned after the last indexed block,
+    # unindexed ones from the start. The index is streamed rather than held, a year-long run has some 100k entries,
+    # only each chunk's time range is kept. Chunks follow each other in time, so rows missing from the index lie
+    # between the indexed rows around them: a chunk, or the part of one after its indexed blocks, is only opened
+    # when that stretch overlaps the window.
+    def __init__(self, base: str, open_file=open):
+        # base is the run's path without extension, or its .idx
+        if base.endswith(INDEX_EXTENSION):
+            base = base[:-len(INDEX_EXTENSION)]
+        self.base = base
+        self.open_file = open_file
+        # chunk -> [first epoch, last epoch, end of its last indexed block]
+        self.ranges = {}
+        for chunk, offset, length, _, first, last in self.entries():
+            span = self.ranges.get(chunk)
+            if span is None:
+                self.ranges[chunk] = [first, last, offset + length]
+            else:
+                span[0] = min(span[0], first)
+                span[1] = max(span[1], last)
+                span[2] = max(span[2], offset + length)
+        self.indexed = sorted(self.ranges)
+        self.extension = None
+        for extension in (".csv", ".bin"):
+            if self.exists(chunk_path(base, 0, extension)):
+                self.extension = extension
+                break
+        if self.extension is None:
+            raise OSError("No chunks found for {0}".format(base))
+        self.binary = self.extension == ".bin"
+        self.corrupt = []
+
+    def exists(self, path: str) -> bool:
+        try:
+            self.open_file(path, "rb").close()
+            return True
+        except OSError:
+            return False
+
+    def entries(self):
+        try:
+            with self.open_file(self.base + INDEX_EXTENSION, "r") as file:
+                yield from parse_index(file)
+        except OSError:
+            return
+
+    def chunks(self) -> list:
+        # Chunk numbers in order, the index's plus any written after its last line
+        last = self.indexed[-1] if self.indexed else 0
+        while self.exists(chunk_path(self.base, last + 1, self.extension)):
+            last += 1
+        return [chunk for chunk in range(last + 1)
+                if chunk in self.ranges or self.exists(chunk_path(self.base, chunk, self.extension))]
+
+    def path(self, chunk: int) -> str:
+        return chunk_path(self.base, chunk, self.extension)
+
+    def blocks(self, start: int = None, end: int = None) -> list:
+        # Index entries overlapping [start, end]
+        return [entry for entry in self.entries()
+                if (start is None or entry[5] >= start) and (end is None or entry[4] <= end)]
+
+    def rows(self, start: int = None, end: int = None):
+        blocks = {}
+        for entry in self.blocks(start, end):
+            blocks.setdefault(entry[0], []).append(entry)
+        indexed = self.indexed
+        # next indexed chunk at or after `chunk`, and the newest epoch seen before it
+        position = 0
+        before = None
+        chunk = 0
+        while True:
+            if position < len(indexed) and indexed[position] == chunk:
+                first, last, tail = self.ranges[chunk]
+                if end is not None and first > end:
+                    return
+                position += 1
+                after = self.ranges[indexed[position]][0] if position < len(indexed) else None
+                if not overlaps(last, after, start, end):
+                    tail = None
+                if chunk in blocks or tail is not None:
+                    rows = self.indexed_rows(chunk, blocks.get(chunk, ()), tail)
+                else:
+                    rows = ()
+                before = last
+            elif position < len(indexed):
+                # a hole in the index, its rows come before the next indexed chunk's
+                after = self.ranges[indexed[position]][0]
+                if overlaps(before, after, start, end) and self.exists(self.path(chunk)):
+                    rows = self.scan(chunk)
+                else:
+                    rows = ()
+            else:
+                # written after the index's last line
+                if not overlaps(before, None, start, end) or not self.exists(self.path(chunk)):
+                    return
+                rows = self.scan(chunk)
+            for epoch, row in rows:
+                if before is None or epoch > before:
+                    before = epoch
+                if (start is None or epoch >= start) and (end is None or epoch <= end):
+                    yield row
+            chunk += 1
+
+    def indexed_rows(self, chunk: int, entries, tail: int = None):
+        # The indexed blocks, then from `tail` whatever was flushed after the last one without its index line
+        with self.open_file(self.path(chunk), "rb") as file:
+            for _, offset, length, _, _, _ in entries:
+                file.seek(offset)
+                block = file.read(length)
+                if self.binary:
+                    yield from self.block_records(chunk, offset, block)
+                else:
+                    yield from self.text_rows(block)
+            data = b""
+            if tail is not None:
+                file.seek(tail)
+                data = file.read()
+        if data:
+            yield from self.scan_data(chunk, data, tail)
+
+    def scan(self, chunk: int):
+        # Whole chunk, for one missing from the index
+        with self.open_file(self.path(chunk), "rb") as file:
+            data = file.read()
+        yield from self.scan_data(chunk, data)
+
+    def scan_data(self, chunk: int, data: bytes, offset: int = None):
+        # data is the chunk from `offset`, None for the whole chunk with its file header
+        if self.binary:
+            errors = []
+            for record in binlog.iter_records(data, errors, None if offset is None else 0):
+                yield record[0], record
+            for at, reason in errors:
+                self.corrupt.append((chunk, at + (offset or 0), reason))
+        else:
+            yield from self.text_rows(data)
+
+    def text_rows(self, data: bytes):
+        for line in data.split(b"\n"):
+            try:
+                line = line.decode()
+                yield row_epoch(line), line
+            except (UnicodeError, ValueError):
+                # header, blank, torn or damaged row
+                continue
+
+    def block_records(self, chunk: int, offset: int, block: bytes):
+        if len(block) < binlog.BLOCK_SIZE:
+            self.corrupt.append((chunk, offset, "truncated block"))
+            return
+        magic, count, length, crc = struct.unpack_from(binlog.BLOCK_FORMAT, block, 0)
+        payload = block[binlog.BLOCK_SIZE:]
+        if magic != binlog.BLOCK_MAGIC or length != len(payload) or length != count * binlog.RECORD_SIZE:
+            self.corrupt.append((chunk, offset, "bad block header"))
+            return
+        if binlog.checksum(payload) != crc:
+            self.corrupt.append((chunk, offset, "CRC mismatch"))
+            return
+        for i in range(count):
+            record = struct.unpack_from(binlog.RECORD_FORMAT, payload, i * binlog.RECORD_SIZE)
+            yield record[0], record
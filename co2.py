@@ -0,0 +1,132 @@
+# SCD30 management
+# An SCD30 measures continuously on its own interval, 2 s unless told otherwise, whatever the sampling interval is.
+# CO2Sensor keeps each sensor's settings in line with the sampling plan:
+#   measurement_interval  per_sample measurements per sampling interval (2 to 1800 s), so a fresh one is always
+#                         waiting when a sample starts, without the sensor measuring (and heating) every 2 s
+#   ambient_pressure      the DPS310's pressure, the sensor then compensates its own readings; rewritten only when
+#                         it moves by pressure_step hPa since every write restarts the measurement
+#   self_calibration      automatic self-calibration on or off, the sensor keeps it in its own memory
+# Settings are written right after a measurement has been read, a failed write is retried after the next one. A
+# shorter interval is written as soon as it is planned: under the old one the next measurement may be minutes away,
+# and every sample until then would find none waiting.
+# adafruit_scd30 reads CO2, temperature and humidity in one transaction (_read_data), but each of its properties
+# polls data_available first. read_frame does the one transaction and the triple is cached, so after the engine's
+# data-ready poll the CO2 and humidity channels cost a single read.
+# ===================================================================================================================
+
+MIN_INTERVAL = 2
+MAX_INTERVAL = 1800
+# ambient pressure the SCD30 accepts in mbar, 0 turns its compensation off
+MIN_PRESSURE = 700
+MAX_PRESSURE = 1400
+
+
+class CO2Sensor:
+    def __init__(self, sensor, sample_interval: float, per_sample: int = 2, self_calibration: bool = False,
+                 pressure_compensation: bool = True, pressure_step: float = 2.0):
+        self.sensor = sensor
+        self.per_sample = per_sample
+        self.pressure_compensation = pressure_compensation
+        self.pressure_step = pressure_step
+        # one-transaction read, the property reads where the library has none
+        self.read_frame = getattr(sensor, "_read_data", None)
+        # wanted settings and the ones the sensor has, None until written
+        self.interval = None
+        self.pressure = 0
+        self.self_calibration = self_calibration
+        self.written_interval = None
+        self.written_pressure = None
+        self.written_calibration = None
+        # the latest measurement
+        self.co2 = 0.0
+        self.temperature = 0.0
+        self.humidity = 0.0
+        # counters
+        self.reads = 0
+        self.setting_writes = 0
+        self.setting_errors = 0
+        self.plan(sample_interval)
+        self.configure()
+
+    def plan(self, sample_interval: float):
+        # Measurement interval for the sampling interval, a longer one is written after the next read
+        interval = int(sample_interval / self.per_sample)
+        self.interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+        if self.written_interval is not None and self.interval < self.written_interval:
+            self.configure()
+
+    def compensate(self, pressure: float):
+        # Latest DPS310 pressure in hPa, outside the sensor's range the compensation is turned off
+        if not self.pressure_compensation:
+            return
+        if not MIN_PRESSURE <= pressure <= MAX_PRESSURE:
+            pressure = 0
+        written = self.written_pressure
+        if not pressure or not written or abs(pressure - written) >= self.pressure_step:
+            self.pressure = int(pressure + 0.5)
+
+    @property
+    def pending(self) -> bool:
+        return (self.interval != self.written_interval or self.self_calibration != self.written_calibration
+                or (self.pressure_compensation and self.pressure != self.written_pressure))
+
+    def configure(self):
+        if not self.pending:
+            return
+        sensor = self.sensor
+        try:
+            if self.interval != self.written_interval:
+                sensor.measurement_interval = self.interval
+                self.written_interval = self.interval
+                self.setting_writes += 1
+            if self.self_calibration != self.written_calibration:
+                # the flag is stored in the sensor's flash, only written when it differs
+                if sensor.self_calibration_enabled != self.self_calibration:
+                    sensor.self_calibration_enabled = self.self_calibration
+                    self.setting_writes += 1
+                self.written_calibration = self.self_calibration
+            if self.pressure_compensation and self.pressure != self.written_pressure:
+                sensor.ambient_pressure = self.pressure
+                self.written_pressure = self.pressure
+                self.setting_writes += 1
+        except Exception as e:
+            print(f"Error configuring SCD30: {e}")
+            self.setting_errors += 1
+
+    def fetch(self) -> float:
+        # Reads the waiting measurement into the cached triple, returns the CO2
+        sensor = self.sensor
+        if self.read_frame is not None:
+            self.read_frame()
+            self.co2 = sensor._co2
+            self.temperature = sensor._temperature
+            self.humidity = sensor._relative_humidity
+        else:
+            self.co2 = sensor.CO2
+            self.temperature = sensor.temperature
+            self.humidity = sensor.relative_humidity
+        self.reads += 1
+        self.configure()
+        return self.co2
+
+    def ready(self) -> bool:
+        return self.sensor.data_available
+
+    # Source readers
+    def read_co2(self, out):
+        out[0] = self.fetch()
+
+    def read_co2_humidity(self, out):
+        out[0] = self.fetch()
+        out[1] = self.humidity
+
+    def stats(self) -> dict:
+        return {
+            "reads": self.reads,
+            "measurement_interval": self.written_interval,
+            "ambient_pressure": self.written_pressure,
+            "self_calibration": self.written_calibration,
+            "setting_writes": self.setting_writes,
+            "setting_errors": self.setting_errors,
+            "temperature": self.temperature,
+        }
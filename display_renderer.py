@@ -0,0 +1,119 @@
+# Dirty-tracking renderer for the SSD1306
+# Every label.text assignment rebuilds the label's glyph tilegrid, and every refresh pushes the whole frame over
+# the I2C bus the sensors share. The renderer keeps the last value shown per field, scaled to the field's decimals,
+# and only formats and assigns text for fields whose shown value changed. The display runs with auto_refresh off
+# and is refreshed explicitly at a capped frame rate.
+# BusTimer accounts the time the display and the sensors spend on the bus.
+# ===================================================================================================================
+
+import time
+from array import array
+
+SCALES = (1, 10, 100, 1000, 10000)
+
+
+class BusTimer:
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+
+    def add(self, name: str, seconds: float):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def shares(self) -> dict:
+        # Fraction of the accounted bus time per user
+        total = sum(self.totals.values())
+        return dict((name, spent / total if total else 0.0) for name, spent in self.totals.items())
+
+    def stats(self) -> dict:
+        return dict((name, {"total_s": self.totals[name], "count": self.counts[name],
+                            "share": share}) for name, share in self.shares().items())
+
+
+class DisplayRenderer:
+    def __init__(self, display, labels: list, fields: tuple, max_fps: float = 2, clock=None, bus_timer=None):
+        # fields is a tuple of (data key, decimals), one per label
+        if len(labels) != len(fields):
+            raise ValueError("Got {0} labels for {1} fields".format(len(labels), len(fields)))
+        self.display = display
+        self.labels = labels
+        self.fields = fields
+        self.min_interval = 1 / max_fps
+        self.clock = clock or time.monotonic
+        self.bus_timer = bus_timer
+        self.shown = [label.text for label in labels]
+        # value of each label as an int scaled by 10 ** decimals, compared before anything is formatted
+        self.shown_scaled = array("l", [-1 << 30] * len(fields))
+        self.dirty = False
+        self.last_refresh = -self.min_interval
+        display.auto_refresh = False
+        # counters
+        self.updates = 0
+        self.skipped = 0
+        self.refreshes = 0
+        self.deferred = 0
+        # display runs held back while a sample waited on its sensors
+        self.held = 0
+        self.render_time = 0.0
+        self.max_refresh = 0.0
+
+    def render(self, data: dict) -> int:
+        # Update the labels whose text changed, returns how many were touched
+        start = self.clock()
+        changed = 0
+        for i in range(len(self.fields)):
+            key, decimals = self.fields[i]
+            value = data[key]
+            if value - value == 0:
+                scale = SCALES[decimals]
+                scaled = int(value * scale + (0.5 if value >= 0 else -0.5))
+                if scaled == self.shown_scaled[i]:
+                    self.skipped += 1
+                    continue
+                self.shown_scaled[i] = scaled
+            else:
+                # NaN or infinite (x - x is NaN for both), there is nothing to scale, the text tells them apart
+                self.shown_scaled[i] = 1 << 30
+            # a new label text is the one string a changed field still costs
+            text = "{:.{}f}".format(value, decimals)
+            if text == self.shown[i]:
+                self.skipped += 1
+                continue
+            self.labels[i].text = text
+            self.shown[i] = text
+            changed += 1
+        if changed:
+            self.updates += changed
+            self.dirty = True
+        self.render_time += self.clock() - start
+        return changed
+
+    def refresh(self, force: bool = False) -> bool:
+        # Push the frame if something changed and the frame rate cap allows it
+        if not self.dirty:
+            return False
+        now = self.clock()
+        if not force and now - self.last_refresh < self.min_interval:
+            self.deferred += 1
+            return False
+        self.display.refresh()
+        end = self.clock()
+        if self.bus_timer is not None:
+            self.bus_timer.add("display", end - now)
+        self.max_refresh = max(self.max_refresh, end - now)
+        self.last_refresh = end
+        self.dirty = False
+        self.refreshes += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "label_updates": self.updates,
+            "label_skips": self.skipped,
+            "refreshes": self.refreshes,
+            "deferred_refreshes": self.deferred,
+            "held_runs": self.held,
+            "render_s": self.render_time,
+            "max_refresh_s": self.max_refresh,
+        }
@@ -0,0 +1,229 @@
+# Streaming signal processing for the CO2 and lux channels
+# A channel's readings run through a Pipeline of small stages, each taking one value and returning one value,
+# so stages compose freely and every one keeps a fixed amount of state (preallocated arrays and a few floats):
+# memory per channel doesn't depend on the sampling rate or uptime and a sample allocates nothing.
+#   GasCompensation  NDIR CO2 to reference pressure/temperature from the DPS310
+#   HampelFilter     rolling median, readings further than k scaled MADs from it are replaced by the median
+#   Ema / Kalman     smoothing, by time constant or by process/measurement noise
+#   TumblingWindow   passes values through and keeps mean/min/max of the last completed window
+# ChannelFilters feeds each channel only fresh readings and hands back its latest output otherwise.
+# ===================================================================================================================
+
+import math
+from array import array
+
+# 1.4826 * MAD estimates the standard deviation of normally distributed readings
+MAD_SCALE = 1.4826
+KELVIN = 273.15
+INF = float("inf")
+
+
+class GasCompensation:
+    # An NDIR sensor counts molecules in its cell, so at fixed mixing ratio the reading scales with gas density.
+    # The SCD30 compensates its own temperature but assumes 1013.25 hPa unless told the ambient pressure.
+    def __init__(self, reference_pressure: float = 1013.25, reference_temperature: float = 25.0,
+                 pressure: bool = True, temperature: bool = False):
+        self.reference_pressure = reference_pressure
+        self.reference_kelvin = reference_temperature + KELVIN
+        self.use_pressure = pressure
+        self.use_temperature = temperature
+        self.factor = 1.0
+
+    def update(self, temperature: float, pressure: float):
+        # Latest DPS310 readings (degrees C, hPa), applied to every value until the next update
+        factor = 1.0
+        if self.use_pressure and pressure > 0:
+            factor *= self.reference_pressure / pressure
+        if self.use_temperature:
+            factor *= (temperature + KELVIN) / self.reference_kelvin
+        self.factor = factor
+
+    def process(self, value: float) -> float:
+        return value * self.factor
+
+
+def sort_into(source, scratch, count: int):
+    # Insertion sort of source[:count] into scratch, fine for the handful of values in a filter window
+    for i in range(count):
+        value = source[i]
+        j = i - 1
+        while j >= 0 and scratch[j] > value:
+            scratch[j + 1] = scratch[j]
+            j -= 1
+        scratch[j + 1] = value
+
+
+class HampelFilter:
+    def __init__(self, size: int = 5, threshold: float = 3.0):
+        if size < 3 or size % 2 == 0:
+            raise ValueError("Hampel window must be odd and >= 3, got {0}".format(size))
+        self.size = size
+        self.threshold = threshold
+        self.values = array("f", [0.0] * size)
+        self.scratch = array("f", [0.0] * size)
+        self.head = 0
+        self.count = 0
+        self.replaced = 0
+
+    def median(self) -> float:
+        count = self.count
+        sort_into(self.values, self.scratch, count)
+        middle = count // 2
+        if count % 2:
+            return self.scratch[middle]
+        return (self.scratch[middle - 1] + self.scratch[middle]) / 2
+
+    def process(self, value: float) -> float:
+        # The window holds raw readings, so a replaced outlier doesn't shift later medians
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        if self.count < 3:
+            return value
+        median = self.median()
+        # deviations from the median, reusing the window's sort
+        values = self.values
+        scratch = self.scratch
+        for i in range(self.count):
+            scratch[i] = abs(values[i] - median)
+        sort_into(scratch, scratch, self.count)
+        mad = scratch[self.count // 2]
+        if abs(value - median) > self.threshold * MAD_SCALE * mad and mad > 0:
+            self.replaced += 1
+            return median
+        return value
+
+
+class Ema:
+    def __init__(self, time_constant: float = 60.0, clock=None):
+        # With a clock the weight follows the time between readings, otherwise time_constant counts readings
+        self.time_constant = time_constant
+        self.clock = clock
+        self.value = 0.0
+        self.last = None
+        self.started = False
+
+    def process(self, value: float) -> float:
+        if not self.started:
+            self.value = value
+            self.started = True
+            self.last = self.clock() if self.clock is not None else 0.0
+            return value
+        if self.clock is not None:
+            now = self.clock()
+            alpha = 1.0 - math.exp(-max(now - self.last, 0.0) / self.time_constant)
+            self.last = now
+        else:
+            alpha = 1.0 / (1.0 + self.time_constant)
+        self.value += alpha * (value - self.value)
+        return self.value
+
+
+class Kalman:
+    # Scalar random-walk Kalman filter: process_variance is how far the true value drifts between readings,
+    # measurement_variance the sensor's noise, both in the channel's units squared
+    def __init__(self, process_variance: float = 0.5, measurement_variance: float = 9.0):
+        self.q = process_variance
+        self.r = measurement_variance
+        self.value = 0.0
+        self.variance = INF
+        self.gain = 1.0
+
+    def process(self, measurement: float) -> float:
+        if self.variance == INF:
+            self.value = measurement
+            self.variance = self.r
+            return measurement
+        predicted = self.variance + self.q
+        self.gain = predicted / (predicted + self.r)
+        self.value += self.gain * (measurement - self.value)
+        self.variance = (1.0 - self.gain) * predicted
+        return self.value
+
+
+class TumblingWindow:
+    def __init__(self, length: float, clock):
+        # length in seconds of clock()
+        self.length = length
+        self.clock = clock
+        self.start = None
+        self.total = 0.0
+        self.count = 0
+        self.minimum = INF
+        self.maximum = -INF
+        # the last completed window
+        self.mean = 0.0
+        self.low = 0.0
+        self.high = 0.0
+        self.windows = 0
+
+    def process(self, value: float) -> float:
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        elif now - self.start >= self.length:
+            if self.count:
+                self.mean = self.total / self.count
+                self.low = self.minimum
+                self.high = self.maximum
+                self.windows += 1
+            self.start = now
+            self.total = 0.0
+            self.count = 0
+            self.minimum = INF
+            self.maximum = -INF
+        self.total += value
+        self.count += 1
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        return value
+
+
+class Pipeline:
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def process(self, value: float) -> float:
+        for stage in self.stages:
+            value = stage.process(value)
+        return value
+
+    def find(self, kind):
+        # First stage of a class, e.g. the TumblingWindow to report
+        for stage in self.stages:
+            if isinstance(stage, kind):
+                return stage
+        return None
+
+
+class ChannelFilters:
+    def __init__(self, pipelines: dict):
+        # record key -> Pipeline
+        self.pipelines = pipelines
+        self.keys = tuple(pipelines)
+        self.outputs = array("f", [0.0] * len(self.keys))
+        self.slots = dict((key, i) for i, key in enumerate(self.keys))
+
+    def apply(self, key: str, value: float, fresh: bool) -> float:
+        # Filters a fresh reading, a stale one gets the channel's previous output
+        slot = self.slots[key]
+        if fresh:
+            self.outputs[slot] = self.pipelines[key].process(value)
+        return self.outputs[slot]
+
+    def stats(self) -> dict:
+        stats = {}
+        for key in self.keys:
+            pipeline = self.pipelines[key]
+            entry = {}
+            hampel = pipeline.find(HampelFilter)
+            if hampel is not None:
+                entry["outliers"] = hampel.replaced
+            window = pipeline.find(TumblingWindow)
+            if window is not None and window.windows:
+                entry["window"] = (window.mean, window.low, window.high)
+            stats[key] = entry
+        return stats
@@ -0,0 +1,11 @@
+# Host-side ingestion gateway for a fleet of biofilm controllers
+# Devices publish to a broker on the local network instead of straight to io.adafruit.com. The gateway keeps
+# every reading in an append-only columnar store and forwards rate-limited window aggregates upstream.
+#   python -m gateway --store /data/biofilm --upstream-user USER --upstream-key KEY
+#   python -m gateway.loadgen --devices 500
+# ===================================================================================================================
+
+from gateway.broker import LocalBroker, Message, PahoBroker, topic_matches
+from gateway.forwarder import Forwarder
+from gateway.service import Gateway, LatencyHistogram, parse_created_at
+from gateway.store import ColumnStore, read_store
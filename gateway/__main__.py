@@ -0,0 +1,62 @@
+# Run the gateway against a real MQTT broker (needs paho-mqtt)
+#   python -m gateway --broker localhost --store /data/biofilm --upstream-user USER --upstream-key KEY
+# Without --upstream-user readings are only stored.
+# ===================================================================================================================
+
+import argparse
+import json
+import sys
+import time
+
+from gateway.broker import PahoBroker
+from gateway.forwarder import Forwarder
+from gateway.service import DEFAULT_BATCH_ROWS, Gateway
+from gateway.store import ColumnStore
+from throttle import TokenBucket
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m gateway", description="Ingest device MQTT into a local store")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--store", required=True, help="store directory, created if missing")
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument("--max-age", type=float, default=2.0, help="seconds a row may wait before a store write")
+    parser.add_argument("--fsync", action="store_true", help="fsync every batch")
+    parser.add_argument("--upstream-user", help="Adafruit IO user name to forward aggregates to")
+    parser.add_argument("--upstream-key", help="Adafruit IO key")
+    parser.add_argument("--window", type=float, default=300.0, help="aggregation window in seconds")
+    parser.add_argument("--upstream-rate", type=float, default=30, help="upstream data points per minute")
+    parser.add_argument("--extremes", action="store_true", help="forward per-window minimum and maximum too")
+    parser.add_argument("--stats-every", type=float, default=60.0, help="seconds between stats lines")
+    args = parser.parse_args(argv)
+
+    store = ColumnStore(args.store, fsync=args.fsync)
+    forwarder = None
+    if args.upstream_user:
+        upstream = PahoBroker("io.adafruit.com", 8883, args.upstream_user, args.upstream_key, tls=True)
+        forwarder = Forwarder(upstream.publish, window=args.window,
+                              bucket=TokenBucket(args.upstream_rate / 60.0, burst=args.upstream_rate),
+                              topic=args.upstream_user + "/groups/{device}", extremes=args.extremes)
+    gateway = Gateway(PahoBroker(args.broker, args.port), store, forwarder, batch_rows=args.batch_rows,
+                      max_age=args.max_age)
+    last_stats = time.monotonic()
+    try:
+        while True:
+            gateway.broker.loop(0.1)
+            gateway.poll()
+            if forwarder is not None:
+                upstream.loop(0)
+            if time.monotonic() - last_stats >= args.stats_every:
+                last_stats = time.monotonic()
+                print(json.dumps(gateway.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.flush()
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# MQTT brokers the gateway can sit on
+# LocalBroker is an in-process stand-in with MQTT topic matching, used by the load generator and for testing.
+# PahoBroker connects to a real broker (e.g. mosquitto next to the gateway) through paho-mqtt.
+# Subscribers get Message objects stamped with the time the broker accepted them, for end-to-end latency.
+# ===================================================================================================================
+
+import collections
+import threading
+import time
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    # MQTT filter matching with + (one level) and # (all remaining levels)
+    wanted = pattern.split("/")
+    levels = topic.split("/")
+    for i, part in enumerate(wanted):
+        if part == "#":
+            return True
+        if i >= len(levels) or (part != "+" and part != levels[i]):
+            return False
+    return len(wanted) == len(levels)
+
+
+class Message:
+    __slots__ = ("topic", "payload", "published")
+
+    def __init__(self, topic: str, payload, published: float):
+        self.topic = topic
+        self.payload = payload
+        # time.perf_counter() when the broker took the message
+        self.published = published
+
+
+class LocalBroker:
+    def __init__(self, capacity: int = 100000):
+        # QoS 0 semantics: a full queue drops new messages
+        self.capacity = capacity
+        self.subscriptions = []
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, pattern: str, callback):
+        self.subscriptions.append((pattern, callback))
+
+    def publish(self, topic: str, payload):
+        with self.condition:
+            if len(self.queue) >= self.capacity:
+                self.dropped += 1
+                return False
+            self.queue.append(Message(topic, payload, time.perf_counter()))
+            self.published += 1
+            self.condition.notify()
+        return True
+
+    @property
+    def pending(self) -> int:
+        return len(self.queue)
+
+    def loop(self, timeout: float = 0.0, max_messages: int = 10000) -> int:
+        # Deliver queued messages, waiting up to timeout for the first one; returns how many were delivered
+        with self.condition:
+            if not self.queue and timeout > 0:
+                self.condition.wait(timeout)
+            batch = []
+            while self.queue and len(batch) < max_messages:
+                batch.append(self.queue.popleft())
+        for message in batch:
+            for pattern, callback in self.subscriptions:
+                if topic_matches(pattern, message.topic):
+                    callback(message)
+        self.delivered += len(batch)
+        return len(batch)
+
+
+class PahoBroker:
+    def __init__(self, host: str = "localhost", port: int = 1883, username: str = None, password: str = None,
+                 client_id: str = "", tls: bool = False):
+        import paho.mqtt.client as mqtt
+
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        except AttributeError:
+            # paho-mqtt 1.x
+            self.client = mqtt.Client(client_id=client_id)
+        if username is not None:
+            self.client.username_pw_set(username, password)
+        if tls:
+            self.client.tls_set()
+        self.client.connect(host, port)
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, pattern: str, callback):
+        def on_message(client, userdata, message):
+            self.delivered += 1
+            callback(Message(message.topic, message.payload, time.perf_counter()))
+
+        self.client.message_callback_add(pattern, on_message)
+        self.client.subscribe(pattern)
+
+    def publish(self, topic: str, payload) -> bool:
+        self.published += 1
+        return self.client.publish(topic, payload).rc == 0
+
+    @property
+    def pending(self) -> int:
+        return 0
+
+    def loop(self, timeout: float = 0.0, max_messages: int = 10000) -> int:
+        delivered = self.delivered
+        self.client.loop(timeout)
+        return self.delivered - delivered
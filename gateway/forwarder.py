@@ -0,0 +1,120 @@
+# Downsampled forwarding to Adafruit IO (or any upstream broker)
+# Ingested rows are folded into per-device, per-feed window statistics with vectorized scatter updates. When a
+# window closes, every device that reported gets one group message of feed means. Upload tokens are spent
+# round-robin over devices, and a device that is still waiting when its next window closes has the older
+# aggregate replaced, so the backlog never grows beyond one message per device.
+# ===================================================================================================================
+
+import json
+import time
+
+import numpy as np
+
+from outbox import iso_timestamp
+
+
+class Forwarder:
+    def __init__(self, upstream, window: float = 60.0, bucket=None, topic: str = "gateway/groups/{device}",
+                 extremes: bool = False, clock=None, wall=None):
+        # upstream(topic, payload) publishes one message, bucket is an optional throttle.TokenBucket charged one
+        # token per feed value
+        self.upstream = upstream
+        self.window = window
+        self.bucket = bucket
+        self.topic = topic
+        # add <feed>-min and <feed>-max values next to the means
+        self.extremes = extremes
+        self.clock = clock or time.monotonic
+        self.wall = wall or time.time
+        self.sums = np.zeros((0, 0))
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self.minimums = np.zeros((0, 0))
+        self.maximums = np.zeros((0, 0))
+        self.window_start = self.clock()
+        # device id -> (topic, payload, tokens), oldest first
+        self.pending = {}
+        self.windows = 0
+        self.forwarded = 0
+        self.superseded = 0
+        self.errors = 0
+
+    def grow(self, devices: int, feeds: int):
+        rows, cols = self.sums.shape
+        if devices <= rows and feeds <= cols:
+            return
+        shape = (max(devices, rows, 2 * rows), max(feeds, cols))
+        for name, fill in (("sums", 0.0), ("counts", 0), ("minimums", np.inf), ("maximums", -np.inf)):
+            old = getattr(self, name)
+            new = np.full(shape, fill, dtype=old.dtype)
+            new[:rows, :cols] = old
+            setattr(self, name, new)
+
+    def add(self, device: np.ndarray, feed: np.ndarray, value: np.ndarray):
+        if not len(device):
+            return
+        self.grow(int(device.max()) + 1, int(feed.max()) + 1)
+        index = (device, feed)
+        value = value.astype(np.float64)
+        np.add.at(self.sums, index, value)
+        np.add.at(self.counts, index, 1)
+        np.minimum.at(self.minimums, index, value)
+        np.maximum.at(self.maximums, index, value)
+
+    def due(self) -> bool:
+        return self.clock() - self.window_start >= self.window
+
+    def close_window(self, device_names: list, feed_names: list) -> int:
+        # Queue one message per device that reported in this window, returns how many were queued
+        created_at = iso_timestamp(int(self.wall()))
+        reporting = np.nonzero(self.counts.any(axis=1))[0]
+        for device in reporting:
+            counts = self.counts[device]
+            feeds = {}
+            for feed in np.nonzero(counts)[0]:
+                name = feed_names[feed]
+                feeds[name] = round(float(self.sums[device, feed] / counts[feed]), 3)
+                if self.extremes:
+                    feeds[name + "-min"] = round(float(self.minimums[device, feed]), 3)
+                    feeds[name + "-max"] = round(float(self.maximums[device, feed]), 3)
+            device = int(device)
+            # a replaced aggregate keeps its device's place in the round-robin
+            if device in self.pending:
+                self.superseded += 1
+            payload = json.dumps({"feeds": feeds, "created_at": created_at})
+            self.pending[device] = (self.topic.format(device=device_names[device]), payload, len(feeds))
+        self.sums.fill(0.0)
+        self.counts.fill(0)
+        self.minimums.fill(np.inf)
+        self.maximums.fill(-np.inf)
+        self.window_start = self.clock()
+        self.windows += 1
+        return len(reporting)
+
+    def service(self) -> int:
+        # Publish queued aggregates while the budget allows, returns how many went out
+        sent = 0
+        while self.pending:
+            device = next(iter(self.pending))
+            topic, payload, tokens = self.pending[device]
+            if self.bucket is not None and not self.bucket.take(tokens):
+                break
+            del self.pending[device]
+            try:
+                self.upstream(topic, payload)
+            except Exception as e:
+                self.errors += 1
+                print("Forwarding {0} failed: {1}".format(topic, e))
+                continue
+            self.forwarded += 1
+            sent += 1
+        return sent
+
+    def stats(self) -> dict:
+        return {
+            "windows": self.windows,
+            "forwarded": self.forwarded,
+            "pending": len(self.pending),
+            "superseded": self.superseded,
+            "errors": self.errors,
+            "denied": self.bucket.denied if self.bucket is not None else 0,
+        }
@@ -0,0 +1,173 @@
+# Load generator for the gateway
+# Simulates many devices publishing CO2/Lux-start/Lux-end to a LocalBroker while the gateway ingests on a
+# worker thread, then reports messages/s, end-to-end latency (broker -> store) and memory use.
+#   python -m gateway.loadgen --devices 500 --rate 1 --duration 20
+#   python -m gateway.loadgen --devices 300 --rate 0 --messages 200000   (publish as fast as possible)
+# ===================================================================================================================
+
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from gateway.broker import LocalBroker
+from gateway.forwarder import Forwarder
+from gateway.service import DEFAULT_BATCH_ROWS, Gateway
+from gateway.store import ColumnStore
+from outbox import iso_timestamp
+from throttle import TokenBucket
+
+FEEDS = ("CO2", "Lux-start", "Lux-end")
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024.0 if sys.platform != "darwin" else peak / 1048576.0
+
+
+class Device:
+    def __init__(self, name: str, rng: random.Random):
+        self.name = name
+        self.rng = rng
+        self.co2 = rng.uniform(400.0, 600.0)
+        self.lux = rng.uniform(800.0, 1400.0)
+        self.attenuation = rng.uniform(0.4, 0.9)
+
+    def reading(self) -> tuple:
+        self.co2 += self.rng.gauss(0.0, 2.0)
+        lux_start = self.lux + self.rng.gauss(0.0, 5.0)
+        return round(self.co2, 2), round(lux_start, 2), round(lux_start * self.attenuation, 2)
+
+    def messages(self, mode: str) -> list:
+        # (topic, payload) pairs for one reading
+        values = self.reading()
+        if mode == "feeds":
+            return [("{0}/feeds/{1}".format(self.name, feed), str(value)) for feed, value in zip(FEEDS, values)]
+        payload = json.dumps({"feeds": dict((feed.lower(), value) for feed, value in zip(FEEDS, values)),
+                              "created_at": iso_timestamp(int(time.time()))})
+        return [("{0}/groups/biofilm".format(self.name), payload)]
+
+
+def run_load(devices: int = 300, rate: float = 1.0, duration: float = 10.0, messages: int = 0, mode: str = "group",
+             batch_rows: int = DEFAULT_BATCH_ROWS, max_age: float = 0.5, window: float = 5.0,
+             upstream_rate: float = 0.4, store_dir: str = None, seed: int = 0) -> dict:
+    # rate is readings per device per second, 0 publishes as fast as possible until `messages` readings are sent
+    rng = random.Random(seed)
+    fleet = [Device("device-{:04}".format(n), random.Random(rng.random())) for n in range(devices)]
+    keep_store = store_dir is not None
+    store_dir = store_dir or tempfile.mkdtemp(prefix="gateway-store-")
+    broker = LocalBroker(capacity=max(100000, 4 * batch_rows))
+    store = ColumnStore(store_dir)
+    upstream = []
+    # Adafruit IO's free tier allows 30 data points per minute
+    forwarder = Forwarder(lambda topic, payload: upstream.append(topic), window=window,
+                          bucket=TokenBucket(upstream_rate, burst=30))
+    gateway = Gateway(broker, store, forwarder, batch_rows=batch_rows, max_age=max_age)
+    stop = threading.Event()
+    worker = threading.Thread(target=gateway.run, kwargs={"stop": stop.is_set, "timeout": 0.01})
+    worker.start()
+
+    sent = 0
+    start = time.perf_counter()
+    try:
+        if rate > 0:
+            # devices are staggered over the period so the load is smooth
+            period = 1.0 / rate
+            releases = [start + period * n / devices for n in range(devices)]
+            end = start + duration
+            while True:
+                now = time.perf_counter()
+                if now >= end:
+                    break
+                earliest = end
+                for n in range(devices):
+                    if releases[n] <= now:
+                        for topic, payload in fleet[n].messages(mode):
+                            broker.publish(topic, payload)
+                        sent += 1
+                        releases[n] += period
+                    earliest = min(earliest, releases[n])
+                delay = earliest - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        else:
+            total = messages or 100000
+            while sent < total:
+                for topic, payload in fleet[sent % devices].messages(mode):
+                    broker.publish(topic, payload)
+                sent += 1
+        published_in = time.perf_counter() - start
+        # let the gateway drain what is queued
+        while broker.pending:
+            time.sleep(0.01)
+    finally:
+        stop.set()
+        worker.join()
+    wall = time.perf_counter() - start
+    stats = gateway.stats()
+    store.close()
+    if not keep_store:
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+    return {
+        "devices": devices,
+        "mode": mode,
+        "readings_sent": sent,
+        "messages_published": broker.published,
+        "messages_dropped": broker.dropped,
+        "publish_s": published_in,
+        "wall_s": wall,
+        "messages_per_s": broker.delivered / wall if wall else 0.0,
+        "rows_per_s": stats["store"]["rows"] / wall if wall else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "upstream_messages": len(upstream),
+        "store_dir": store_dir if keep_store else None,
+        "gateway": stats,
+    }
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m gateway.loadgen", description="Load test the MQTT gateway")
+    parser.add_argument("--devices", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=1.0, help="readings per device per second, 0 for flat out")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to publish for when --rate > 0")
+    parser.add_argument("--messages", type=int, default=100000, help="readings to send when --rate is 0")
+    parser.add_argument("--mode", choices=("group", "feeds"), default="group",
+                        help="one group message per reading or one message per feed")
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument("--max-age", type=float, default=0.5, help="seconds a row may wait before a store write")
+    parser.add_argument("--window", type=float, default=5.0, help="upstream aggregation window in seconds")
+    parser.add_argument("--store", help="keep the store in this directory instead of a temporary one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    report = run_load(args.devices, args.rate, args.duration, args.messages, args.mode, args.batch_rows,
+                      args.max_age, args.window, store_dir=args.store, seed=args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    latency = report["gateway"]["latency"]
+    print("Devices: {0}, readings sent: {1}, messages: {2} ({3} dropped)".format(
+        report["devices"], report["readings_sent"], report["messages_published"], report["messages_dropped"]))
+    print("Throughput: {0:.0f} messages/s, {1:.0f} rows/s over {2:.2f} s".format(
+        report["messages_per_s"], report["rows_per_s"], report["wall_s"]))
+    print("End-to-end latency: mean {0:.2f} ms, p50 {1:.2f} ms, p95 {2:.2f} ms, p99 {3:.2f} ms, max {4:.2f} ms".format(
+        latency["mean_ms"], latency["p50_ms"], latency["p95_ms"], latency["p99_ms"], latency["max_ms"]))
+    print("Peak RSS: {0:.1f} MB".format(report["peak_rss_mb"]))
+    print("Store: {0}".format(report["gateway"]["store"]))
+    print("Upstream: {0}".format(report["gateway"]["forwarder"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# Gateway service: local MQTT in, columnar store and downsampled upstream out
+# Devices publish Adafruit IO style topics to the local broker, either one value per feed on
+# <device>/feeds/<feed> or the Outbox's group message {"feeds": {...}, "created_at": ...} on <device>/groups/<group>.
+# The firmware gets there with MQTT_broker set to the broker's address and MQTT_topic_prefix to the device id, which
+# it uses as its MQTT username and so as the first topic level.
+# Rows are collected into preallocated NumPy batches that are written to the store once full or old enough,
+# and every committed batch feeds the forwarder's window statistics.
+# ===================================================================================================================
+
+import json
+import math
+import time
+
+import numpy as np
+
+DEFAULT_BATCH_ROWS = 8192
+
+
+def parse_created_at(text: str) -> float:
+    # Seconds since 1970 from outbox.iso_timestamp's "YYYY-MM-DDTHH:MM:SSZ"
+    year, month, day = int(text[0:4]), int(text[5:7]), int(text[8:10])
+    # days-from-civil, as binlog.rtc_epoch
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+    return days * 86400 + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+
+
+class LatencyHistogram:
+    # Log-spaced buckets from 1 us to 100 s, constant memory however many rows are recorded
+    def __init__(self, per_decade: int = 20, low: float = 1e-6, high: float = 100.0):
+        self.per_decade = per_decade
+        self.low = low
+        self.buckets = np.zeros(int(math.log10(high / low) * per_decade) + 2, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, latencies: np.ndarray):
+        if not len(latencies):
+            return
+        index = np.floor(np.log10(np.maximum(latencies, self.low) / self.low) * self.per_decade).astype(np.int64)
+        np.add.at(self.buckets, np.minimum(index, len(self.buckets) - 1), 1)
+        self.count += len(latencies)
+        self.total += float(latencies.sum())
+        self.maximum = max(self.maximum, float(latencies.max()))
+
+    def percentile(self, fraction: float) -> float:
+        # Upper edge of the bucket holding the percentile
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.buckets), fraction * self.count))
+        return min(self.maximum, self.low * 10 ** ((index + 1) / self.per_decade))
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "p50_ms": 1000 * self.percentile(0.50),
+            "p95_ms": 1000 * self.percentile(0.95),
+            "p99_ms": 1000 * self.percentile(0.99),
+            "max_ms": 1000 * self.maximum,
+        }
+
+
+class Gateway:
+    def __init__(self, broker, store, forwarder=None, batch_rows: int = DEFAULT_BATCH_ROWS, max_age: float = 1.0,
+                 clock=None, wall=None):
+        self.broker = broker
+        self.store = store
+        self.forwarder = forwarder
+        self.batch_rows = batch_rows
+        # longest a row waits in the batch before it's written
+        self.max_age = max_age
+        self.clock = clock or time.monotonic
+        self.wall = wall or time.time
+        self.times = np.zeros(batch_rows, dtype=np.float64)
+        self.devices = np.zeros(batch_rows, dtype=np.uint32)
+        self.feeds = np.zeros(batch_rows, dtype=np.uint16)
+        self.values = np.zeros(batch_rows, dtype=np.float32)
+        self.received = np.zeros(batch_rows, dtype=np.float64)
+        self.fill = 0
+        self.batch_started = 0.0
+        self.latency = LatencyHistogram()
+        self.messages = 0
+        self.rejected = 0
+        broker.subscribe("+/feeds/+", self.on_feed)
+        broker.subscribe("+/groups/+", self.on_group)
+
+    def on_feed(self, message):
+        try:
+            device, _, feed = message.topic.split("/")
+            value = float(message.payload)
+        except ValueError:
+            self.rejected += 1
+            return
+        self.messages += 1
+        self.add(device, feed.lower(), value, self.wall(), message.published)
+
+    def on_group(self, message):
+        try:
+            device = message.topic.split("/", 1)[0]
+            body = json.loads(message.payload)
+            feeds = body["feeds"]
+            created_at = body.get("created_at")
+            stamp = parse_created_at(created_at) if created_at else self.wall()
+            readings = [(feed.lower(), float(value)) for feed, value in feeds.items()]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.rejected += 1
+            return
+        self.messages += 1
+        for feed, value in readings:
+            self.add(device, feed, value, stamp, message.published)
+
+    def add(self, device: str, feed: str, value: float, stamp: float, published: float):
+        if self.fill == self.batch_rows:
+            self.flush()
+        i = self.fill
+        if i == 0:
+            self.batch_started = self.clock()
+        self.times[i] = stamp
+        self.devices[i] = self.store.devices.id(device)
+        self.feeds[i] = self.store.feeds.id(feed)
+        self.values[i] = value
+        self.received[i] = published
+        self.fill = i + 1
+
+    def flush(self) -> int:
+        rows = self.fill
+        if not rows:
+            return 0
+        self.store.append(self.times[:rows], self.devices[:rows], self.feeds[:rows], self.values[:rows])
+        # end-to-end: broker accepted the message -> its row is in the store
+        self.latency.add(time.perf_counter() - self.received[:rows])
+        if self.forwarder is not None:
+            self.forwarder.add(self.devices[:rows], self.feeds[:rows], self.values[:rows])
+        self.fill = 0
+        return rows
+
+    def poll(self):
+        # Housekeeping between broker loops: age-based flush, window close and upstream forwarding
+        if self.fill and self.clock() - self.batch_started >= self.max_age:
+            self.flush()
+        if self.forwarder is not None:
+            if self.forwarder.due():
+                self.forwarder.close_window(self.store.devices.names, self.store.feeds.names)
+            self.forwarder.service()
+
+    def run(self, stop=None, timeout: float = 0.05):
+        # Serve until stop() returns True, e.g. a threading.Event's is_set
+        try:
+            while stop is None or not stop():
+                self.broker.loop(timeout)
+                self.poll()
+        finally:
+            self.flush()
+
+    def stats(self) -> dict:
+        stats = {
+            "messages": self.messages,
+            "rejected": self.rejected,
+            "buffered_rows": self.fill,
+            "latency": self.latency.stats(),
+            "store": self.store.stats(),
+        }
+        if self.forwarder is not None:
+            stats["forwarder"] = self.forwarder.stats()
+        return stats
@@ -0,0 +1,168 @@
+# Append-only columnar store for ingested readings
+# Each column is a flat little-endian file inside a segment directory and batches are appended to all columns
+# at once. Device and feed names are dictionary-encoded in append-only text files. A crash mid-batch leaves
+# columns of different lengths; opening the store trims them back to the last complete row.
+#   store/devices.txt  store/feeds.txt  store/seg-000000/{time.f8,device.u4,feed.u2,value.f4}
+# ===================================================================================================================
+
+import os
+
+import numpy as np
+
+COLUMNS = (("time", "<f8"), ("device", "<u4"), ("feed", "<u2"), ("value", "<f4"))
+COLUMN_FILES = dict((name, "{0}.{1}".format(name, dtype[1:])) for name, dtype in COLUMNS)
+DEFAULT_SEGMENT_ROWS = 1 << 22
+
+
+class Dictionary:
+    # Names by id, persisted one per line before any row refers to them
+    def __init__(self, path: str):
+        self.path = path
+        self.names = []
+        self.ids = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    self.ids[line.rstrip("\n")] = len(self.names)
+                    self.names.append(line.rstrip("\n"))
+        self.file = open(path, "a")
+
+    def id(self, name: str) -> int:
+        found = self.ids.get(name)
+        if found is not None:
+            return found
+        found = len(self.names)
+        self.file.write(name + "\n")
+        self.file.flush()
+        self.ids[name] = found
+        self.names.append(name)
+        return found
+
+    def close(self):
+        self.file.close()
+
+
+def segment_rows(directory: str) -> int:
+    # Complete rows in a segment, the shortest column wins
+    rows = None
+    for name, dtype in COLUMNS:
+        path = os.path.join(directory, COLUMN_FILES[name])
+        count = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+        rows = count if rows is None else min(rows, count)
+    return rows
+
+
+def list_segments(root: str) -> list:
+    return sorted(os.path.join(root, name) for name in os.listdir(root) if name.startswith("seg-"))
+
+
+class ColumnStore:
+    def __init__(self, root: str, segment_rows: int = DEFAULT_SEGMENT_ROWS, fsync: bool = False):
+        self.root = root
+        self.segment_capacity = segment_rows
+        self.fsync = fsync
+        os.makedirs(root, exist_ok=True)
+        self.devices = Dictionary(os.path.join(root, "devices.txt"))
+        self.feeds = Dictionary(os.path.join(root, "feeds.txt"))
+        self.files = None
+        self.segment = None
+        self.segment_rows = 0
+        self.rows = 0
+        self.batches = 0
+        self.bytes_written = 0
+        segments = list_segments(root)
+        if segments:
+            self.open_segment(segments[-1])
+        else:
+            self.open_segment(os.path.join(root, "seg-000000"))
+
+    def open_segment(self, directory: str):
+        self.close_segment()
+        os.makedirs(directory, exist_ok=True)
+        rows = segment_rows(directory)
+        self.files = {}
+        for name, dtype in COLUMNS:
+            path = os.path.join(directory, COLUMN_FILES[name])
+            file = open(path, "ab")
+            # drop the tail of a batch that didn't reach every column
+            file.truncate(rows * np.dtype(dtype).itemsize)
+            self.files[name] = file
+        self.segment = directory
+        self.segment_rows = rows
+
+    def next_segment(self):
+        number = int(os.path.basename(self.segment)[4:]) + 1
+        self.open_segment(os.path.join(self.root, "seg-{:06}".format(number)))
+
+    def append(self, time: np.ndarray, device: np.ndarray, feed: np.ndarray, value: np.ndarray) -> int:
+        columns = {"time": time, "device": device, "feed": feed, "value": value}
+        total = len(time)
+        start = 0
+        while start < total:
+            if self.segment_rows >= self.segment_capacity:
+                self.next_segment()
+            stop = min(total, start + self.segment_capacity - self.segment_rows)
+            for name, dtype in COLUMNS:
+                data = np.ascontiguousarray(columns[name][start:stop], dtype=dtype)
+                self.files[name].write(data.data)
+                self.bytes_written += data.nbytes
+            self.segment_rows += stop - start
+            start = stop
+        self.flush()
+        self.rows += total
+        self.batches += 1
+        return total
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+
+    def close_segment(self):
+        if self.files:
+            for file in self.files.values():
+                file.close()
+        self.files = None
+
+    def close(self):
+        self.close_segment()
+        self.devices.close()
+        self.feeds.close()
+
+    def stats(self) -> dict:
+        return {"rows": self.rows, "batches": self.batches, "bytes_written": self.bytes_written,
+                "devices": len(self.devices.names), "feeds": len(self.feeds.names), "segment": self.segment}
+
+
+def read_store(root: str, device: str = None, feed: str = None, start: float = None, end: float = None) -> dict:
+    # Columns of every complete row, optionally for one device/feed and a [start, end) time range.
+    # Adds "device_names" and "feed_names" to decode the id columns.
+    with open(os.path.join(root, "devices.txt")) as file:
+        device_names = file.read().splitlines()
+    with open(os.path.join(root, "feeds.txt")) as file:
+        feed_names = file.read().splitlines()
+    parts = dict((name, []) for name, _ in COLUMNS)
+    for directory in list_segments(root):
+        rows = segment_rows(directory)
+        for name, dtype in COLUMNS:
+            parts[name].append(np.fromfile(os.path.join(directory, COLUMN_FILES[name]), dtype=dtype, count=rows))
+    columns = dict((name, np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype))
+                   for name, dtype in COLUMNS)
+    keep = np.ones(len(columns["time"]), dtype=bool)
+    for column, name, names in (("device", device, device_names), ("feed", feed, feed_names)):
+        if name is None:
+            continue
+        if name in names:
+            keep &= columns[column] == names.index(name)
+        else:
+            keep[:] = False
+    if start is not None:
+        keep &= columns["time"] >= start
+    if end is not None:
+        keep &= columns["time"] < end
+    if not keep.all():
+        columns = dict((name, column[keep]) for name, column in columns.items())
+    columns["device_names"] = device_names
+    columns["feed_names"] = feed_names
+    return columns
@@ -0,0 +1,84 @@
+# Circular delay line for the ambient CO2 reading
+# The system chamber sees ambient air only after it has travelled through the reactor, so the biofilm CO2 is
+# system CO2 minus the ambient CO2 from `depth` readings earlier. Storage is a preallocated array('f') so a push
+# never shifts or allocates, and the window mean/variance are updated in O(1) with a sliding Welford update.
+# ===================================================================================================================
+
+from array import array
+
+
+class CO2LagBuffer:
+    def __init__(self, depth: int = 15):
+        if depth < 0:
+            raise ValueError("Lag depth must be >= 0, got {0}".format(depth))
+        self.depth = depth
+        # depth + 1 slots, the oldest slot is the reading from exactly `depth` samples ago
+        self.size = depth + 1
+        self._values = array("f", [0.0] * self.size)
+        self.clear()
+
+    def clear(self):
+        self._head = 0
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    @property
+    def full(self) -> bool:
+        return self.count == self.size
+
+    @property
+    def variance(self) -> float:
+        if self.count < 2:
+            return 0.0
+        return max(self._m2 / (self.count - 1), 0.0)
+
+    @property
+    def lagged(self) -> float:
+        # Oldest reading in the window, the current one until the window has filled
+        if self.count == 0:
+            return 0.0
+        if self.full:
+            return self._values[self._head]
+        return self._values[self._head - 1]
+
+    def push(self, value: float) -> float:
+        # Store a reading and return the ambient value it should be compared against
+        values = self._values
+        head = self._head
+        if self.full:
+            old = values[head]
+            values[head] = value
+            # array('f') rounds to float32, update the statistics with the stored value
+            value = values[head]
+            old_mean = self.mean
+            self.mean = old_mean + (value - old) / self.size
+            self._m2 += (value - old) * (value - self.mean + old - old_mean)
+        else:
+            values[head] = value
+            value = values[head]
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (value - self.mean)
+        head += 1
+        if head == self.size:
+            head = 0
+        self._head = head
+        if self.full:
+            return values[head]
+        return value
+
+    def restore(self, values):
+        # Refills the window from values() oldest first, e.g. after a warm restart
+        self.clear()
+        for value in values[-self.size:]:
+            self.push(value)
+
+    def values(self) -> list:
+        # Readings oldest first, for checkpoints and debugging
+        if self.full:
+            start = self._head
+        else:
+            start = 0
+        return [self._values[(start + i) % self.size] for i in range(self.count)]
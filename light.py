@@ -0,0 +1,187 @@
+# LED-synchronised lux measurement for the VEML7700s
+# The sensor integrates continuously, so after every LED change its conversion is restarted (shutdown bit off and
+# on) and exactly one integration period, plus the oscillator's tolerance, passes before the counts are read.
+# Each sample reads a dark frame with the LED off and a lit frame with it on; the LED is lit for that one
+# integration only and lux is (lit - dark) counts times the setting's resolution, so stray room light and the
+# sensor's offset cancel.
+# Gain and integration time are auto-ranged over a ladder of settings ordered by sensitivity, keeping for each
+# sensitivity the shortest integration: the next sample uses the least sensitive (and so shortest) setting that
+# still gives min_counts from the last lit frame, and a saturated frame is repeated at once less sensitively.
+# The meter is a state machine driven by the acquisition engine's trigger/ready/read calls, so the integration
+# waits never block the other sensors or scheduler tasks.
+# ===================================================================================================================
+
+import time
+
+# lux per count at gain 2 and 800 ms, as adafruit_veml7700's resolution()
+RESOLUTION_AT_MAX = 0.0042
+GAINS = (("ALS_GAIN_1_8", 0.125), ("ALS_GAIN_1_4", 0.25), ("ALS_GAIN_1", 1.0), ("ALS_GAIN_2", 2.0))
+INTEGRATION_TIMES = (("ALS_25MS", 0.025), ("ALS_50MS", 0.05), ("ALS_100MS", 0.1), ("ALS_200MS", 0.2),
+                     ("ALS_400MS", 0.4), ("ALS_800MS", 0.8))
+# the VEML7700's internal oscillator may run this much slow
+OSCILLATOR_TOLERANCE = 1.1
+
+IDLE = 0
+DARK = 1
+LIT = 2
+DONE = 3
+
+
+def build_ladder(sensor) -> tuple:
+    # (gain code, integration code, integration seconds, lux per count) by increasing sensitivity
+    best = {}
+    for gain_name, gain in GAINS:
+        for time_name, seconds in INTEGRATION_TIMES:
+            sensitivity = gain * seconds
+            if sensitivity not in best or seconds < best[sensitivity][2]:
+                resolution = RESOLUTION_AT_MAX * (0.8 / seconds) * (2.0 / gain)
+                best[sensitivity] = (getattr(sensor, gain_name), getattr(sensor, time_name), seconds, resolution)
+    return tuple(best[sensitivity] for sensitivity in sorted(best))
+
+
+class LightMeter:
+    def __init__(self, sensor, led, clock=None, auto_range: bool = True, gain: str = "ALS_GAIN_1_8",
+                 integration_time: str = "ALS_100MS", min_counts: int = 1000, saturation: int = 60000,
+                 dark_every: int = 1, settle: float = 0.003):
+        # gain/integration_time name the fixed setting, also the starting sensitivity when auto-ranging.
+        # A dark frame is taken every dark_every samples at the same setting; settle is the extra wait after a
+        # restart before the sensor integrates.
+        self.sensor = sensor
+        self.led = led
+        self.clock = clock or time.monotonic
+        self.auto_range = auto_range
+        self.min_counts = min_counts
+        self.saturation = saturation
+        self.dark_every = dark_every
+        self.settle = settle
+        # integration waits are stretched by this, 0 for a simulated sensor that converts instantly
+        self.tolerance = OSCILLATOR_TOLERANCE
+        gain_value = dict(GAINS)[gain]
+        seconds = dict(INTEGRATION_TIMES)[integration_time]
+        fixed = (getattr(sensor, gain), getattr(sensor, integration_time), seconds,
+                 RESOLUTION_AT_MAX * (0.8 / seconds) * (2.0 / gain_value))
+        if auto_range:
+            self.ladder = build_ladder(sensor)
+            # start on the rung with the fixed setting's sensitivity
+            self.rung = min(range(len(self.ladder)), key=lambda i: max(
+                self.ladder[i][3] / fixed[3], fixed[3] / self.ladder[i][3]))
+        else:
+            self.ladder = (fixed,)
+            self.rung = 0
+        self.configured = None
+        self.state = IDLE
+        self.deadline = 0.0
+        self.dark = 0
+        self.dark_rung = -1
+        self.dark_age = 0
+        self.counts = 0
+        self.lux = 0.0
+        # counters
+        self.samples = 0
+        self.saturated = 0
+        self.range_changes = 0
+        self.led_on_time = 0.0
+        self.lit_at = 0.0
+        self.configure(self.rung)
+
+    def configure(self, rung: int):
+        if rung != self.configured:
+            gain, integration_time, _, _ = self.ladder[rung]
+            self.sensor.light_gain = gain
+            self.sensor.light_integration_time = integration_time
+            if self.configured is not None:
+                self.range_changes += 1
+            self.configured = rung
+        self.rung = rung
+
+    def restart(self):
+        # A fresh conversion starts when the sensor leaves shutdown
+        self.sensor.light_shutdown = True
+        self.sensor.light_shutdown = False
+        self.deadline = self.clock() + self.settle + self.ladder[self.rung][2] * self.tolerance
+
+    def set_led(self, value: bool):
+        if value and not self.led.value:
+            self.lit_at = self.clock()
+        elif not value and self.led.value:
+            self.led_on_time += self.clock() - self.lit_at
+        self.led.value = value
+
+    def trigger(self):
+        self.configure(self.rung)
+        if self.dark_rung != self.rung or self.dark_age >= self.dark_every:
+            self.set_led(False)
+            self.state = DARK
+        else:
+            self.set_led(True)
+            self.state = LIT
+        self.restart()
+
+    def ready(self) -> bool:
+        # Reads each frame once its integration is over, carrying on to the next one as long as that's due too
+        if self.state == DONE:
+            return True
+        while True:
+            if self.state == IDLE or self.clock() < self.deadline:
+                return False
+            try:
+                counts = self.sensor.light
+            except Exception:
+                self.cancel()
+                raise
+            if self.state == DARK:
+                self.dark = counts
+                self.dark_rung = self.rung
+                self.dark_age = 0
+                self.set_led(True)
+                self.state = LIT
+                self.restart()
+                continue
+            self.set_led(False)
+            if counts >= self.saturation and self.rung > 0:
+                # the frame is clipped, repeat it (and its dark frame) two rungs less sensitive
+                self.saturated += 1
+                self.configure(max(0, self.rung - 2))
+                self.trigger()
+                continue
+            break
+        self.counts = counts
+        resolution = self.ladder[self.rung][3]
+        self.lux = max(0, counts - self.dark) * resolution
+        self.dark_age += 1
+        self.samples += 1
+        if self.auto_range:
+            self.rung = self.choose_rung(counts * resolution)
+        self.state = DONE
+        return True
+
+    def choose_rung(self, lux: float) -> int:
+        # Least sensitive setting that still gives min_counts. Neighbouring rungs differ by 2-4x, so that rung
+        # stays far below saturation unless the light is too bright for even the first one.
+        ladder = self.ladder
+        for i in range(len(ladder)):
+            if lux / ladder[i][3] >= self.min_counts:
+                return i
+        return len(ladder) - 1
+
+    def read(self, out):
+        out[0] = self.lux
+        self.state = IDLE
+
+    def cancel(self):
+        # Called when the sample gives up on the meter, the LED must not stay lit
+        self.set_led(False)
+        self.state = IDLE
+
+    def stats(self) -> dict:
+        _, _, seconds, resolution = self.ladder[self.rung]
+        return {
+            "samples": self.samples,
+            "integration_ms": 1000 * seconds,
+            "lux_per_count": resolution,
+            "last_counts": self.counts,
+            "dark_counts": self.dark,
+            "saturated": self.saturated,
+            "range_changes": self.range_changes,
+            "led_on_s": self.led_on_time,
+        }
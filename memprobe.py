@@ -0,0 +1,77 @@
+# Per-cycle heap probe for chasing allocation regressions
+# gc.mem_alloc() (CircuitPython/MicroPython) before and after a cycle gives the bytes it allocated, and an explicit
+# gc.collect() right after is timed as the pause that garbage costs. A cycle during which the collector ran by
+# itself shows up as a negative delta and is counted instead. CPython has no mem_alloc, there tracemalloc's traced
+# size is used while it is tracing, otherwise only the pause is measured.
+# ===================================================================================================================
+
+import gc
+import time
+
+
+def mem_alloc():
+    if hasattr(gc, "mem_alloc"):
+        return gc.mem_alloc()
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return None
+
+
+def ticks_ms() -> float:
+    # monotonic() is a 30 bit float on the device and loses sub-millisecond resolution after a few hours
+    if hasattr(time, "monotonic_ns"):
+        return time.monotonic_ns() / 1000000
+    return time.monotonic() * 1000
+
+
+class MemoryProbe:
+    def __init__(self):
+        self.before = None
+        self.cycles = 0
+        self.measured = 0
+        self.auto_collections = 0
+        self.last_alloc = 0
+        self.total_alloc = 0
+        self.max_alloc = 0
+        self.last_pause_ms = 0.0
+        self.total_pause_ms = 0.0
+        self.max_pause_ms = 0.0
+
+    def start(self):
+        self.before = mem_alloc()
+
+    def stop(self):
+        after = mem_alloc()
+        self.cycles += 1
+        if self.before is not None and after is not None:
+            delta = after - self.before
+            if delta < 0:
+                self.auto_collections += 1
+            else:
+                self.measured += 1
+                self.last_alloc = delta
+                self.total_alloc += delta
+                self.max_alloc = max(self.max_alloc, delta)
+        start = ticks_ms()
+        gc.collect()
+        pause = ticks_ms() - start
+        self.last_pause_ms = pause
+        self.total_pause_ms += pause
+        self.max_pause_ms = max(self.max_pause_ms, pause)
+
+    def summary(self) -> str:
+        return "Memory: {0} bytes allocated, GC {1:.2f} ms".format(self.last_alloc, self.last_pause_ms)
+
+    def stats(self) -> dict:
+        return {
+            "cycles": self.cycles,
+            "mean_alloc_bytes": self.total_alloc / self.measured if self.measured else 0.0,
+            "max_alloc_bytes": self.max_alloc,
+            "auto_collections": self.auto_collections,
+            "mean_gc_ms": self.total_pause_ms / self.cycles if self.cycles else 0.0,
+            "max_gc_ms": self.max_pause_ms,
+        }
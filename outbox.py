@@ -0,0 +1,188 @@
+# Outbox for Adafruit IO uploads
+# Readings are queued and published as one group message carrying every feed, instead of one round-trip per feed.
+# A failed publish or reconnect schedules the next attempt with exponential backoff and jitter, so the MQTT task
+# makes at most one reconnect attempt per backoff window and sampling is never held up by a dead link.
+# When the queue is full the oldest reading is spilled to a file on the SD card and read back once it drains;
+# every message carries created_at so readings published late or out of order still land at the right time.
+# ===================================================================================================================
+
+import json
+import random
+import time
+
+
+def iso_timestamp(epoch: int) -> str:
+    # ISO 8601 UTC for Adafruit IO's created_at, from seconds since 1970
+    days, seconds = divmod(epoch, 86400)
+    # civil-from-days, the inverse of binlog.rtc_epoch
+    days += 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    year = yoe + era * 400 + (1 if month <= 2 else 0)
+    return "{:04}-{:02}-{:02}T{:02}:{:02}:{:02}Z".format(
+        year, month, day, seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Outbox:
+    def __init__(self, io, feeds: tuple, group: str = "biofilm", capacity: int = 32, batch: int = 4,
+                 wifi=None, spill_path: str = None, open_file=open, base_delay: float = 2, max_delay: float = 300,
+                 reset_after: int = 3, bucket=None, clock=None, rng=None, on_publish=None):
+        self.io = io
+        # feed keys inside the group, in the order of the values passed to put()
+        self.feeds = feeds
+        self.group = group
+        self.capacity = capacity
+        self.batch = batch
+        self.wifi = wifi
+        self.spill_path = spill_path
+        self.open_file = open_file
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # consecutive failures before the WiFi module itself is reset
+        self.reset_after = reset_after
+        # optional throttle.TokenBucket, each message costs one token per feed
+        self.bucket = bucket
+        # on_publish(epoch) after every reading that reached Adafruit IO, see backfill.Backfill
+        self.on_publish = on_publish
+        self.clock = clock or time.monotonic
+        self.rng = rng or random
+        self.queue = []
+        # io may be None until the network is up (startup.NetworkLink sets it), readings queue meanwhile
+        self.connected = io is not None
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.spill_pending = 0
+        self.spill_offset = 0
+        # counters
+        self.published = 0
+        self.publish_errors = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.max_age = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue) + self.spill_pending
+
+    def put(self, values: tuple, epoch: int = 0):
+        if len(self.queue) >= self.capacity:
+            oldest = self.queue.pop(0)
+            if not self.spill(oldest):
+                self.dropped += 1
+        self.queue.append((epoch, self.clock(), values))
+
+    def payload(self, epoch: int, values: tuple) -> str:
+        message = {"feeds": dict(zip(self.feeds, values))}
+        if epoch:
+            message["created_at"] = iso_timestamp(epoch)
+        return json.dumps(message)
+
+    def service(self) -> int:
+        # Publish up to `batch` readings if the backoff window has passed, returns how many were sent
+        if not self.queue and self.spill_pending:
+            self.refill()
+        if not self.queue or self.io is None or self.clock() < self.next_attempt:
+            return 0
+        if not self.connected and not self.reconnect():
+            return 0
+        sent = 0
+        while self.queue and sent < self.batch:
+            epoch, enqueued, values = self.queue[0]
+            if self.bucket is not None and not self.bucket.take(len(values)):
+                break
+            start = self.clock()
+            try:
+                self.io.publish(self.group, self.payload(epoch, values), is_group=True)
+            except Exception as e:
+                self.fail(e)
+                break
+            end = self.clock()
+            self.queue.pop(0)
+            sent += 1
+            self.published += 1
+            self.total_latency += end - start
+            self.max_latency = max(self.max_latency, end - start)
+            self.max_age = max(self.max_age, end - enqueued)
+            if self.on_publish is not None:
+                self.on_publish(epoch)
+        if sent:
+            self.failures = 0
+        return sent
+
+    def reconnect(self) -> bool:
+        try:
+            if self.wifi is not None and self.failures >= self.reset_after:
+                self.wifi.reset()
+            self.io.reconnect()
+        except Exception as e:
+            self.fail(e)
+            return False
+        self.connected = True
+        return True
+
+    def fail(self, error: Exception):
+        self.publish_errors += 1
+        self.failures += 1
+        self.connected = False
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        # "equal jitter": somewhere between half and the whole backoff so devices don't retry in lockstep
+        delay = delay / 2 + self.rng.random() * delay / 2
+        self.next_attempt = self.clock() + delay
+        print(f"Adafruit IO publish failed ({error}), retrying in {delay:.1f} s")
+
+    def spill(self, entry: tuple) -> bool:
+        if self.spill_path is None:
+            return False
+        epoch, enqueued, values = entry
+        try:
+            with self.open_file(self.spill_path, "a") as file:
+                file.write(",".join([str(epoch)] + [repr(value) for value in values]) + "\n")
+        except Exception as e:
+            print(f"Error spilling reading to sd card: {e}")
+            return False
+        self.spilled += 1
+        self.spill_pending += 1
+        return True
+
+    def refill(self):
+        # Move spilled readings back into the queue, oldest first
+        try:
+            with self.open_file(self.spill_path, "r") as file:
+                file.seek(self.spill_offset)
+                while len(self.queue) < self.capacity // 2 and self.spill_pending:
+                    line = file.readline()
+                    if not line:
+                        self.spill_pending = 0
+                        break
+                    fields = line.strip().split(",")
+                    self.queue.append((int(fields[0]), self.clock(), tuple(float(v) for v in fields[1:])))
+                    self.spill_pending -= 1
+                self.spill_offset = file.tell()
+            if not self.spill_pending:
+                # Everything has been read back, start the spill file over
+                with self.open_file(self.spill_path, "w"):
+                    pass
+                self.spill_offset = 0
+        except Exception as e:
+            print(f"Error reading spilled readings: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "published": self.published,
+            "publish_errors": self.publish_errors,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "mean_publish_ms": 1000 * self.total_latency / self.published if self.published else 0.0,
+            "max_publish_ms": 1000 * self.max_latency,
+            "max_age_s": self.max_age,
+            "connected": self.connected,
+            "retry_in_s": max(0.0, self.next_attempt - self.clock()),
+        }
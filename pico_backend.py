@@ -0,0 +1,231 @@
+# Hardware backend for the biofilm cell factory
+# Builds the real Pico peripherals (SCD30, VEML7700, DPS310, DS3231, SD card, SSD1306, ESP8266)
+# Hardware libraries are imported inside each role so this module can be imported off-device
+# ===================================================================================================================
+
+import time
+
+# Pin assignments, resolved lazily because "board" only exists on CircuitPython
+I2C_SDA_PIN = "GP5"
+I2C_SCL_PIN = "GP4"
+I2C_SDA_PIN_2 = "GP27"
+I2C_SCL_PIN_2 = "GP26"
+# LEDs by index, one pair per chamber, Refactored_OOP_code.LED_pins replaces it
+LED_PINS = ("GP2", "GP7")
+WIFI_RX_PIN = "GP17"
+WIFI_TX_PIN = "GP16"
+OLED_RESET_PIN = "GP20"
+SD_CS_PIN = "GP15"
+SD_SCK_PIN = "GP10"
+SD_MOSI_PIN = "GP11"
+SD_MISO_PIN = "GP12"
+SD_MOUNT_POINT = "/sd"
+Display_width = 128
+Display_height = 64
+Display_border = 0
+
+
+def pin(name: str):
+    import board
+    return getattr(board, name)
+
+
+class PicoDisplay:
+    # SSD1306 role: owns the display group and hands out text labels and plot bitmaps
+    def __init__(self, i2c):
+        import displayio
+        import adafruit_displayio_ssd1306
+
+        displayio.release_displays()
+        display_bus = displayio.I2CDisplay(i2c, device_address=0x3C, reset=pin(OLED_RESET_PIN))
+        self.display = adafruit_displayio_ssd1306.SSD1306(
+            display_bus, width=Display_width, height=Display_height)
+        self.width = Display_width
+        self.height = Display_height
+        self.splash = displayio.Group()
+        self.display.show(self.splash)
+        self.setup_background()
+
+    def setup_background(self):
+        import displayio
+
+        colour_bitmap = displayio.Bitmap(Display_width, Display_height, 1)
+        colour_palette = displayio.Palette(1)
+        colour_palette[0] = 0xFFFFFF # White=0xFFFFFF
+        bg_sprite = displayio.TileGrid(colour_bitmap, pixel_shader=colour_palette, x=0, y=0)
+        self.splash.append(bg_sprite)
+
+        inner_bitmap = displayio.Bitmap(Display_width - Display_border * 2, Display_height - Display_border * 2, 1)
+        inner_palette = displayio.Palette(1)
+        inner_palette[0] = 0x000000 #Black=0x000000
+        inner_sprite = displayio.TileGrid(inner_bitmap, pixel_shader=inner_palette, x=Display_border, y=Display_border)
+        self.splash.append(inner_sprite)
+
+    def create_label(self, text: str, x: int, y: int):
+        import terminalio
+        from adafruit_display_text import label
+
+        lbl = label.Label(terminalio.FONT, text=text, color=0xFFFFFF, x=x, y=y)
+        self.splash.append(lbl)
+        return lbl
+
+    def create_bitmap(self, width: int, height: int, x: int, y: int) -> tuple:
+        # 1-bit bitmap drawn at (x, y), returns it and its tilegrid
+        import displayio
+
+        bitmap = displayio.Bitmap(width, height, 2)
+        palette = displayio.Palette(2)
+        palette[0] = 0x000000
+        palette[1] = 0xFFFFFF
+        grid = displayio.TileGrid(bitmap, pixel_shader=palette, x=x, y=y)
+        self.splash.append(grid)
+        return bitmap, grid
+
+    @property
+    def auto_refresh(self) -> bool:
+        return self.display.auto_refresh
+
+    @auto_refresh.setter
+    def auto_refresh(self, value: bool):
+        self.display.auto_refresh = value
+
+    def refresh(self) -> bool:
+        # the caller paces refreshes itself, so push the frame now rather than at displayio's target rate
+        return self.display.refresh(target_frames_per_second=None)
+
+
+class PicoBackend:
+    # Default backend used on the device, every role talks to the real hardware
+    def __init__(self, led_pins: tuple = LED_PINS):
+        self.led_pins = led_pins
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def setup_i2c(self) -> tuple:
+        import busio
+
+        i2c = busio.I2C(pin(I2C_SDA_PIN), pin(I2C_SCL_PIN))
+        i2c2 = busio.I2C(pin(I2C_SDA_PIN_2), pin(I2C_SCL_PIN_2))
+        return i2c, i2c2
+
+    def scd30(self, i2c):
+        import adafruit_scd30
+        return adafruit_scd30.SCD30(i2c)
+
+    def veml7700(self, i2c):
+        import adafruit_veml7700
+        return adafruit_veml7700.VEML7700(i2c)
+
+    def mux(self, i2c):
+        # TCA9548A, indexing it gives a bus for one channel
+        import adafruit_tca9548a
+        return adafruit_tca9548a.TCA9548A(i2c)
+
+    def dps310(self, i2c):
+        from adafruit_dps310 import DPS310
+        return DPS310(i2c)
+
+    def ds3231(self, i2c):
+        from adafruit_ds3231 import DS3231
+        return DS3231(i2c)
+
+    def led(self, index: int):
+        if not 0 <= index < len(self.led_pins):
+            raise ValueError("LED {0} has no pin, LED_pins lists {1}".format(index, len(self.led_pins)))
+        import digitalio
+
+        led = digitalio.DigitalInOut(pin(self.led_pins[index]))
+        led.direction = digitalio.Direction.OUTPUT
+        return led
+
+    def mount_sd(self) -> str:
+        import busio
+        import sdcardio
+        import storage
+
+        spi = busio.SPI(pin(SD_SCK_PIN), MOSI=pin(SD_MOSI_PIN), MISO=pin(SD_MISO_PIN))
+        sd = sdcardio.SDCard(spi, pin(SD_CS_PIN))
+        vfs = storage.VfsFat(sd)
+        storage.mount(vfs, SD_MOUNT_POINT)
+        return SD_MOUNT_POINT
+
+    def open(self, path: str, mode: str = "r"):
+        return open(path, mode)
+
+    def sync(self):
+        import os
+        os.sync()
+
+    def listdir(self, path: str) -> list:
+        import os
+        return os.listdir(path)
+
+    def watchdog(self, timeout: float):
+        # Armed hardware watchdog, resets the board unless fed every `timeout` seconds (8.3 s at most on the RP2040)
+        import microcontroller
+        from watchdog import WatchDogMode
+
+        watchdog = microcontroller.watchdog
+        watchdog.timeout = timeout
+        watchdog.mode = WatchDogMode.RESET
+        watchdog.feed()
+        return watchdog
+
+    def reset_reason(self) -> str:
+        # "watchdog", "power_on", "software", ... from microcontroller.ResetReason
+        import microcontroller
+        return str(microcontroller.cpu.reset_reason).split(".")[-1].lower()
+
+    def restart(self):
+        # Soft reload of code.py: the board stays powered and the ESP keeps its WiFi association
+        import supervisor
+        supervisor.reload()
+
+    def nvm(self):
+        import microcontroller
+        return microcontroller.nvm
+
+    def display(self, i2c) -> PicoDisplay:
+        return PicoDisplay(i2c)
+
+    def wifi(self) -> tuple:
+        import busio
+        from adafruit_espatcontrol import adafruit_espatcontrol
+        from adafruit_espatcontrol import adafruit_espatcontrol_wifimanager
+        from secrets import secrets
+
+        uart = busio.UART(pin(WIFI_TX_PIN), pin(WIFI_RX_PIN), receiver_buffer_size=2048)
+        esp = adafruit_espatcontrol.ESP_ATcontrol(uart, 115200, debug=False)
+        wifi = adafruit_espatcontrol_wifimanager.ESPAT_WiFiManager(esp, secrets)
+        return esp, wifi
+
+    def adafruit_io(self, esp, broker: str = "io.adafruit.com", port: int = None, prefix: str = None,
+                    timeout: float = None):
+        # IO_MQTT publishes on <username>/groups/<group>, so the MQTT username is the topic prefix: the AIO username
+        # for Adafruit IO, or the device's own id for a gateway. secrets["mqtt_password"], if set, replaces the AIO
+        # key for a broker that isn't Adafruit IO. timeout bounds connect(): one attempt, a 1 s socket timeout and
+        # `timeout` seconds for the broker's CONNACK, rather than MiniMQTT's retries with backoff.
+        import adafruit_espatcontrol.adafruit_espatcontrol_socket as socket
+        import adafruit_minimqtt.adafruit_minimqtt as MQTT
+        from adafruit_io.adafruit_io import IO_MQTT
+        from secrets import secrets
+
+        MQTT.set_socket(socket, esp)
+        password = secrets["aio_key"]
+        if broker != "io.adafruit.com":
+            password = secrets.get("mqtt_password", password)
+        options = {}
+        if port is not None:
+            options["port"] = port
+        if timeout is not None:
+            options["socket_timeout"] = 1
+            options["recv_timeout"] = max(timeout - 1, 2)
+            options["connect_retries"] = 1
+        mqtt_client = MQTT.MQTT(
+            broker = broker,
+            username = prefix or secrets["aio_username"],
+            password = password,
+            **options
+        )
+        return IO_MQTT(mqtt_client)
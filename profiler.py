@@ -0,0 +1,128 @@
+# Per-stage latency profile of the sampling cycle
+# Every stage keeps a fixed-size histogram of its run times (log-spaced buckets, four per doubling from 10 us to
+# about 20 s) plus min, mean, max and an error count, so recording a run is a couple of clock reads and an
+# increment and memory doesn't grow with uptime. p95 is the upper edge of the bucket holding it, within 19 %.
+# Figures are cumulative since boot and go out on the serial console, as rows of a <log>-profile.csv summary on
+# the SD card and, when a feed is configured, as a compact JSON diagnostics message.
+# ===================================================================================================================
+
+import math
+from array import array
+
+from memprobe import ticks_ms
+
+LOW_MS = 0.01
+PER_DOUBLING = 4
+BUCKETS = 84
+INF = float("inf")
+# bucket of t ms is int(log(t / LOW_MS) * SCALE)
+SCALE = PER_DOUBLING / math.log(2)
+SUMMARY_HEADER = "time,stage,runs,errors,min_ms,mean_ms,max_ms,p95_ms\n"
+
+
+class StageHistogram:
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = array("L", [0] * BUCKETS)
+        self.reset()
+
+    def reset(self):
+        for i in range(BUCKETS):
+            self.counts[i] = 0
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.min_ms = INF
+        self.max_ms = 0.0
+
+    def add(self, ms: float):
+        if ms > LOW_MS:
+            index = int(math.log(ms / LOW_MS) * SCALE)
+            if index >= BUCKETS:
+                index = BUCKETS - 1
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms < self.min_ms:
+            self.min_ms = ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for i in range(BUCKETS):
+            seen += self.counts[i]
+            if seen >= target:
+                return min(self.max_ms, LOW_MS * 2 ** ((i + 1) / PER_DOUBLING))
+        return self.max_ms
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "min_ms": self.min_ms if self.count else 0.0,
+            "mean_ms": self.mean_ms,
+            "max_ms": self.max_ms,
+            "p95_ms": self.percentile(0.95),
+        }
+
+
+class Profiler:
+    def __init__(self, clock=None):
+        # clock() in milliseconds
+        self.clock = clock or ticks_ms
+        self.stages = {}
+
+    def stage(self, name: str) -> StageHistogram:
+        # The stage's histogram, created on first use. Chambers of one controller share their stages.
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageHistogram(name)
+        return stage
+
+    def begin(self) -> float:
+        return self.clock()
+
+    def end(self, stage: StageHistogram, started: float):
+        stage.add(self.clock() - started)
+
+    def reset(self):
+        for stage in self.stages.values():
+            stage.reset()
+
+    def report(self) -> str:
+        lines = ["{:<24}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+            "stage", "runs", "errors", "min ms", "mean ms", "max ms", "p95 ms")]
+        for stage in self.stages.values():
+            stats = stage.stats()
+            lines.append("{:<24}{:>8}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+                stage.name, stats["count"], stats["errors"], stats["min_ms"], stats["mean_ms"], stats["max_ms"],
+                stats["p95_ms"]))
+        return "\n".join(lines)
+
+    def summary_rows(self, timestamp: str, header: bool = False) -> str:
+        # CSV rows for the SD summary, one per stage
+        rows = [SUMMARY_HEADER] if header else []
+        for stage in self.stages.values():
+            stats = stage.stats()
+            rows.append("{0},{1},{2},{3},{4:.3f},{5:.3f},{6:.3f},{7:.3f}\n".format(
+                timestamp, stage.name, stats["count"], stats["errors"], stats["min_ms"], stats["mean_ms"],
+                stats["max_ms"], stats["p95_ms"]))
+        return "".join(rows)
+
+    def diagnostics(self) -> dict:
+        # Short keys keep the MQTT message within Adafruit IO's 1 KB value limit: stage -> [runs, errors, mean, p95]
+        return dict((stage.name, [stage.count, stage.errors, round(stage.mean_ms, 2),
+                                  round(stage.percentile(0.95), 2)]) for stage in self.stages.values())
+
+    def stats(self) -> dict:
+        return dict((stage.name, stage.stats()) for stage in self.stages.values())
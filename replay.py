@@ -0,0 +1,423 @@
+# Deterministic replay of recorded runs through Biofilm_Measure
+# The readings of a write_sd log are fed back through the full pipeline on a virtual clock: the recorded elapsed
+# time drives backend.monotonic, the recorded timestamps the RTC, and the sensors return the logged values (raising
+# where the row's error counts went up, so failures replay too). The display, SD and MQTT tasks run at their
+# scheduled virtual times between samples and nothing waits on real time, so weeks of data replay in seconds.
+# The new SD log and every Adafruit IO message are written to --out and can be diffed against golden files:
+#   python replay.py run.csv --out /tmp/replay --update-golden golden/run     record the expected outputs
+#   python replay.py run.csv --out /tmp/replay --golden golden/run            exits 1 on any difference
+# Logs can be .csv (either write_sd dialect), .bin or a chunked run's .idx. The log holds the raw readings, which
+# go through the filters on replay as they did on the device, and lux is requantized to the light meter's counts.
+# The recording sets when samples are taken, Adaptive_sampling doesn't.
+# ===================================================================================================================
+
+import argparse
+import contextlib
+import difflib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+import binlog
+from chunklog import INDEX_EXTENSION, ChunkReader
+from sim_backend import SimBackend, SimDPS310, SimDS3231, SimIO, SimSCD30, SimulatedFault, SimVEML7700
+import Refactored_OOP_code
+from Refactored_OOP_code import Biofilm_Measure
+
+GOLDEN_FILES = ("log.csv", "published.jsonl")
+ERROR_PAIR = re.compile(r"'(\w+)':\s*(\d+)")
+# error key -> (sensor role, side) whose read fails when the key's count goes up, humidity goes with Humidity_sensor
+FAILURES = {
+    "lux_start": ("veml7700", 0), "lux_end": ("veml7700", 1), "ambient_co2": ("scd30", 0),
+    "system_co2": ("scd30", 1), "temp": ("dps310", 0), "pressure": ("dps310", 0),
+}
+
+
+class Row:
+    __slots__ = ("epoch", "elapsed", "values", "failed")
+
+    def __init__(self, epoch: int, elapsed: float, values: tuple, failed: tuple = ()):
+        self.epoch = epoch
+        self.elapsed = elapsed
+        # the eight channels in binlog.CHANNELS order
+        self.values = values
+        # error keys whose count went up with this row
+        self.failed = failed
+
+    def get(self, channel: str) -> float:
+        return self.values[binlog.CHANNELS.index(channel)]
+
+
+def parse_text_row(line: str, errors: dict):
+    # "YYYY-MM-DD, HH:MM:SS,elapsed,<8 channels>,{error dict}", ", " separated in Code_with_MQTT.py's logs.
+    # errors holds the previous row's counts and is updated in place.
+    parts = line.split(",", 11)
+    if len(parts) < 11 or not parts[0][:1].isdigit():
+        return None
+    date = parts[0].strip()
+    clock = parts[1].strip()
+    try:
+        epoch = binlog.civil_epoch(int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                                   int(clock[0:2]), int(clock[3:5]), int(clock[6:8]))
+        numbers = [float(part) for part in parts[2:11]]
+    except ValueError:
+        return None
+    failed = []
+    if len(parts) > 11:
+        for key, count in ERROR_PAIR.findall(parts[11]):
+            count = int(count)
+            if count > errors.get(key, 0):
+                failed.append(key)
+            errors[key] = count
+    return Row(epoch, numbers[0], tuple(numbers[1:]), tuple(failed))
+
+
+def record_row(record: tuple) -> Row:
+    # binlog record: epoch, elapsed, 8 channels, error increments, flags
+    increments = record[10:10 + len(binlog.ERROR_KEYS)]
+    failed = tuple(key for key, count in zip(binlog.ERROR_KEYS, increments) if count)
+    return Row(record[0], record[1], tuple(record[2:10]), failed)
+
+
+def read_rows(path: str):
+    # Rows of a recorded log in file order
+    errors = {}
+    if path.endswith(INDEX_EXTENSION):
+        reader = ChunkReader(path)
+        for row in reader.rows():
+            row = parse_text_row(row, errors) if isinstance(row, str) else record_row(row)
+            if row is not None:
+                yield row
+    elif path.endswith(".bin"):
+        with open(path, "rb") as file:
+            data = file.read()
+        for record in binlog.iter_records(data):
+            yield record_row(record)
+    else:
+        with open(path, "r", errors="replace") as file:
+            for line in file:
+                row = parse_text_row(line, errors)
+                if row is not None:
+                    yield row
+
+
+class VirtualClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class ReplaySCD30(SimSCD30):
+    # every recorded row is a new measurement, whatever measurement interval the sensor was given
+    _row = None
+
+    @property
+    def data_available(self) -> bool:
+        self._access()
+        return self._row is not self._backend.row
+
+    def _read_data(self):
+        self._row = self._backend.row
+        super()._read_data()
+
+    def _reading(self) -> float:
+        row = self._backend.row
+        self._backend.check(row, "scd30", self.system)
+        return row.get("system_co2" if self.system else "ambient_co2")
+
+    def _humidity(self) -> float:
+        return self._backend.row.get("humidity")
+
+
+class ReplayVEML7700(SimVEML7700):
+    @property
+    def lux(self) -> float:
+        # the recorded lux with the LED on, a dark sensor otherwise
+        self._access()
+        row = self._backend.row
+        self._backend.check(row, "veml7700", self.index % 2)
+        led = self._backend.leds.get(self.index)
+        if led is None or not led.value:
+            return 0.0
+        return row.get("lux_end" if self.index % 2 else "lux_start")
+
+
+class ReplayDPS310(SimDPS310):
+    @property
+    def temperature(self) -> float:
+        self._access()
+        self._backend.check(self._backend.row, "dps310", 0)
+        return self._backend.row.get("temperature")
+
+    @property
+    def pressure(self) -> float:
+        self._access()
+        return self._backend.row.get("pressure")
+
+
+class ReplayRTC(SimDS3231):
+    @property
+    def datetime(self) -> time.struct_time:
+        self._access()
+        return time.gmtime(int(self._backend.epoch_offset + self._backend.monotonic()))
+
+
+class ReplayIO(SimIO):
+    def publish(self, feed_key: str, data, metadata=None, shared_user=None, is_group=False):
+        super().publish(feed_key, data, metadata, shared_user, is_group)
+        self._backend.published.append(json.dumps([feed_key, data]))
+
+
+class ReplayBackend(SimBackend):
+    # SimBackend whose sensors return the current recorded row, on a virtual clock
+    def __init__(self, clock: VirtualClock, sd_root: str, epoch_offset: float):
+        super().__init__(sd_root=sd_root, clock=clock)
+        self.start = 0.0
+        # RTC epoch at monotonic 0
+        self.epoch_offset = epoch_offset
+        self.row = None
+        self.published = []
+        # the humidity fails with the SCD30 it's read from
+        self.failures = dict(FAILURES, humidity=("scd30", int(Refactored_OOP_code.Humidity_sensor == "system")))
+
+    def check(self, row: Row, role: str, side: int):
+        # Raise like the sensor did when the row's error counts went up
+        for key in row.failed:
+            if self.failures.get(key) == (role, side):
+                raise SimulatedFault("Recorded {0} failure".format(key))
+
+    def scd30(self, i2c) -> ReplaySCD30:
+        return ReplaySCD30(self, i2c.index)
+
+    def veml7700(self, i2c) -> ReplayVEML7700:
+        return ReplayVEML7700(self, i2c.index)
+
+    def dps310(self, i2c) -> ReplayDPS310:
+        return ReplayDPS310(self)
+
+    def ds3231(self, i2c) -> ReplayRTC:
+        return ReplayRTC(self)
+
+    def adafruit_io(self, esp, broker: str = "io.adafruit.com", port: int = None, prefix: str = None,
+                    timeout: float = None) -> ReplayIO:
+        return ReplayIO(self)
+
+
+def drive(coroutine):
+    # Runs a task's coroutine to completion, it never suspends once the acquisition sleeps on the virtual clock
+    if coroutine is None or not hasattr(coroutine, "send"):
+        return
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        return
+    coroutine.close()
+    raise RuntimeError("Task suspended during replay")
+
+
+class Replay:
+    def __init__(self, path: str, out: str, quiet: bool = True):
+        self.path = path
+        self.out = out
+        self.quiet = quiet
+        # the monitor's console output while quiet, closed once the replay has run
+        self.devnull = open(os.devnull, "w") if quiet else None
+        self.rows = read_rows(path)
+        try:
+            first = next(self.rows)
+        except StopIteration:
+            raise ValueError("{0} has no readable rows".format(path))
+        self.first = first
+        self.clock = VirtualClock()
+        sd_root = os.path.join(out, "sd")
+        if os.path.isdir(sd_root):
+            shutil.rmtree(sd_root)
+        os.makedirs(sd_root)
+        self.backend = ReplayBackend(self.clock, sd_root, first.epoch - first.elapsed)
+        with self.output():
+            self.monitor = Biofilm_Measure(self.backend)
+            self.monitor.setup_scheduler()
+        self.monitor.acquisition.sleep = self.clock.sleep
+        # every task but sampling runs on its own period, the recording sets when samples are taken. The watchdog
+        # isn't, the replay runs the tasks itself and nothing can block it
+        self.tasks = [[0.0, task] for task in self.monitor.scheduler.tasks
+                      if task is not self.monitor.sample_period and task.name != "watchdog"]
+        self.samples = 0
+        self.skipped = 0
+        self.last_elapsed = first.elapsed
+
+    def output(self):
+        if self.devnull is not None:
+            return contextlib.redirect_stdout(self.devnull)
+        return contextlib.nullcontext()
+
+    def close(self):
+        if self.devnull is not None:
+            self.devnull.close()
+            self.devnull = None
+
+    def run_tasks(self, until: float):
+        # Releases of the periodic tasks up to `until`, in time order
+        while True:
+            entry = min(self.tasks, key=lambda entry: entry[0])
+            release, task = entry
+            if release > until:
+                return
+            self.clock.now = max(self.clock.now, release)
+            if task.enabled:
+                try:
+                    drive(task.action())
+                except Exception as e:
+                    task.errors += 1
+                    print("Task {0} failed: {1}".format(task.name, e))
+                task.runs += 1
+            entry[0] = release + task.period
+            if entry[0] < self.clock.now:
+                entry[0] = self.clock.now + task.period
+
+    def sample(self, row: Row):
+        if row.elapsed < self.clock.now:
+            # elapsed went back, e.g. two boots appended to one file
+            self.skipped += 1
+            return
+        self.run_tasks(row.elapsed)
+        self.clock.now = row.elapsed
+        self.backend.row = row
+        drive(self.monitor.sample_task())
+        self.samples += 1
+        self.last_elapsed = row.elapsed
+
+    def run(self) -> dict:
+        start = time.perf_counter()
+        try:
+            with self.output():
+                self.sample(self.first)
+                for row in self.rows:
+                    self.sample(row)
+                # let the last readings go out before the log is closed
+                self.run_tasks(self.clock.now + Refactored_OOP_code.SD_flush_interval)
+                self.monitor.close_sd()
+                if self.monitor.backfill is not None:
+                    self.monitor.backfill.save(force=True)
+        finally:
+            self.close()
+        wall = time.perf_counter() - start
+        simulated_h = (self.last_elapsed - self.first.elapsed) / 3600.0
+        self.write_outputs()
+        return {
+            "recording": self.path,
+            "samples": self.samples,
+            "skipped_rows": self.skipped,
+            "simulated_h": simulated_h,
+            "wall_s": wall,
+            "simulated_h_per_s": simulated_h / wall if wall > 0 else 0.0,
+            "published": len(self.backend.published),
+            "errors": dict(self.monitor.error_dict),
+            "out": self.out,
+        }
+
+    def log_lines(self) -> list:
+        # The new SD log as text lines, binlog records as their repr
+        logger = self.monitor.sd_logger
+        if logger.chunks is not None:
+            rows = ChunkReader(logger.chunks.base).rows()
+        else:
+            with open(logger.path, "rb") as file:
+                data = file.read()
+            if logger.path.endswith(".bin"):
+                rows = binlog.iter_records(data)
+            else:
+                rows = data.decode().splitlines()
+        return [row if isinstance(row, str) else repr(row) for row in rows]
+
+    def write_outputs(self):
+        with open(os.path.join(self.out, "log.csv"), "w") as file:
+            file.writelines(line + "\n" for line in self.log_lines())
+        with open(os.path.join(self.out, "published.jsonl"), "w") as file:
+            file.writelines(line + "\n" for line in self.backend.published)
+
+
+def compare_golden(out: str, golden: str, context: int = 3, limit: int = 40) -> dict:
+    # name -> unified diff lines for every output that differs from its golden file
+    differences = {}
+    for name in GOLDEN_FILES:
+        expected_path = os.path.join(golden, name)
+        if not os.path.exists(expected_path):
+            differences[name] = ["missing golden file {0}".format(expected_path)]
+            continue
+        with open(expected_path) as file:
+            expected = file.readlines()
+        with open(os.path.join(out, name)) as file:
+            actual = file.readlines()
+        if expected != actual:
+            diff = list(difflib.unified_diff(expected, actual, "golden/" + name, "replay/" + name, n=context))
+            differences[name] = diff[:limit]
+    return differences
+
+
+def update_golden(out: str, golden: str):
+    os.makedirs(golden, exist_ok=True)
+    for name in GOLDEN_FILES:
+        shutil.copyfile(os.path.join(out, name), os.path.join(golden, name))
+
+
+def print_report(report: dict):
+    print("Replayed {0} samples, {1:.2f} simulated h in {2:.2f} s -> {3:.1f} simulated h/s".format(
+        report["samples"], report["simulated_h"], report["wall_s"], report["simulated_h_per_s"]))
+    if report["skipped_rows"]:
+        print("Skipped {0} rows whose elapsed time went back".format(report["skipped_rows"]))
+    print("Adafruit IO messages: {0}".format(report["published"]))
+    print("Errors: {0}".format(report["errors"]))
+    print("Outputs: {0}".format(report["out"]))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded log through Biofilm_Measure on a virtual clock")
+    parser.add_argument("recording", help="write_sd log: .csv, .bin or a chunked run's .idx")
+    parser.add_argument("--out", required=True, help="directory for the replay's SD card and outputs")
+    parser.add_argument("--golden", help="directory of golden outputs to diff against")
+    parser.add_argument("--update-golden", metavar="DIR", help="store this replay's outputs as golden files")
+    parser.add_argument("--log-format", choices=("csv", "binary"), default=Refactored_OOP_code.SD_log_format)
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's console output")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    Refactored_OOP_code.SD_log_format = args.log_format
+    os.makedirs(args.out, exist_ok=True)
+    try:
+        replay = Replay(args.recording, args.out, quiet=not args.verbose)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    report = replay.run()
+    status = 0
+    if args.update_golden:
+        update_golden(args.out, args.update_golden)
+    if args.golden:
+        differences = compare_golden(args.out, args.golden)
+        report["golden"] = "match" if not differences else sorted(differences)
+        if differences:
+            status = 1
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+        if args.golden:
+            if status:
+                for name, diff in sorted(differences.items()):
+                    sys.stdout.writelines(line if line.endswith("\n") else line + "\n" for line in diff)
+                print("Outputs differ from the golden files in {0}".format(args.golden))
+            else:
+                print("Outputs match the golden files in {0}".format(args.golden))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
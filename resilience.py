@@ -0,0 +1,197 @@
+# Watchdog supervision and warm restarts
+# The scheduler rides out task exceptions, but not a call that never returns: a wedged I2C bus or an ESP AT command
+# waiting forever blocks the event loop and the board sits there until someone power cycles it. Supervisor arms the
+# hardware watchdog (microcontroller.watchdog in RESET mode) and feeds it from its own scheduler task, but only while
+# every task keeps to its deadline: one running or awaiting for longer than stall_factor times its deadline, or no
+# longer released within its period plus that, is handed to on_stall, which checkpoints and reloads the code. A
+# blocked event loop feeds nothing and the watchdog resets the board after `timeout` seconds.
+# A restart would lose the ambient CO2 lag window, the error counters, the log run and the open rollup buckets, so
+# they are checkpointed periodically and on the way into a restart. CheckpointStore keeps the latest one as JSON in
+# two alternating slots, files on the SD card or halves of microcontroller.nvm, each with a sequence number and a
+# CRC, so a write torn by the reset leaves the previous checkpoint readable. The NVM is the RP2040's flash and every
+# write erases a sector, only use it with a long interval. The publish high-water mark is kept by Backfill.
+# ===================================================================================================================
+
+import json
+import struct
+import time
+
+from binlog import checksum
+
+MAGIC = b"BFCK"
+# layout of the state, a checkpoint of another version is ignored
+VERSION = 1
+# magic, sequence, payload length, payload CRC32
+SLOT_FORMAT = "<4sIII"
+SLOT_HEADER = struct.calcsize(SLOT_FORMAT)
+
+
+class FileSlots:
+    # Two files on the SD card, <path>.0 and <path>.1
+    def __init__(self, open_file, path: str):
+        self.open_file = open_file
+        self.paths = (path + ".0", path + ".1")
+
+    def read(self, slot: int) -> bytes:
+        with self.open_file(self.paths[slot], "rb") as file:
+            return file.read()
+
+    def write(self, slot: int, data: bytes):
+        with self.open_file(self.paths[slot], "wb") as file:
+            file.write(data)
+
+
+class NvmSlots:
+    # Two halves of microcontroller.nvm from `offset`, 2 kB each on a Pico
+    def __init__(self, nvm, offset: int = 0, size: int = None):
+        self.nvm = nvm
+        self.offset = offset
+        self.slot_size = (len(nvm) - offset if size is None else size) // 2
+
+    def read(self, slot: int) -> bytes:
+        start = self.offset + slot * self.slot_size
+        return bytes(self.nvm[start:start + self.slot_size])
+
+    def write(self, slot: int, data: bytes):
+        if len(data) > self.slot_size:
+            raise ValueError("Checkpoint of {0} bytes doesn't fit a {1} byte NVM slot".format(
+                len(data), self.slot_size))
+        start = self.offset + slot * self.slot_size
+        self.nvm[start:start + len(data)] = data
+
+
+class CheckpointStore:
+    def __init__(self, slots):
+        self.slots = slots
+        # sequence of the newest checkpoint, the next one goes to the other slot
+        self.sequence = 0
+        # counters
+        self.saves = 0
+        self.save_errors = 0
+        self.size = 0
+
+    def load(self) -> dict:
+        # The newest intact checkpoint, None if neither slot holds one
+        newest = None
+        for slot in (0, 1):
+            try:
+                data = self.slots.read(slot)
+            except OSError:
+                continue
+            if len(data) < SLOT_HEADER:
+                continue
+            magic, sequence, length, crc = struct.unpack_from(SLOT_FORMAT, data, 0)
+            payload = data[SLOT_HEADER:SLOT_HEADER + length]
+            if magic != MAGIC or len(payload) != length or checksum(payload) != crc:
+                continue
+            if newest is None or sequence > newest[0]:
+                newest = (sequence, payload)
+        if newest is None:
+            return None
+        self.sequence = newest[0]
+        try:
+            checkpoint = json.loads(newest[1].decode())
+        except ValueError as e:
+            print(f"Checkpoint unreadable ({e}), starting cold")
+            return None
+        if checkpoint.get("version") != VERSION:
+            print("Checkpoint of another version, starting cold")
+            return None
+        return checkpoint["state"]
+
+    def save(self, state: dict) -> bool:
+        payload = json.dumps({"version": VERSION, "state": state}).encode()
+        sequence = self.sequence + 1
+        data = struct.pack(SLOT_FORMAT, MAGIC, sequence, len(payload), checksum(payload)) + payload
+        try:
+            self.slots.write(sequence % 2, data)
+        except Exception as e:
+            print(f"Error saving checkpoint: {e}")
+            self.save_errors += 1
+            return False
+        self.sequence = sequence
+        self.saves += 1
+        self.size = len(data)
+        return True
+
+    def stats(self) -> dict:
+        return {"sequence": self.sequence, "saves": self.saves, "save_errors": self.save_errors, "bytes": self.size}
+
+
+class Supervisor:
+    def __init__(self, watchdog=None, stall_factor: float = 4, clock=None):
+        # watchdog is the armed hardware watchdog, None checks the tasks without one
+        self.watchdog = watchdog
+        self.stall_factor = stall_factor
+        self.clock = clock or time.monotonic
+        self.scheduler = None
+        # on_stall(reason) is called once, the watchdog isn't fed after a stall
+        self.on_stall = None
+        self.stalled = None
+        self.last_feed = self.clock()
+        # counters
+        self.feeds = 0
+        self.max_gap = 0.0
+
+    def watch(self, scheduler):
+        self.scheduler = scheduler
+
+    def disarm(self) -> bool:
+        # Stops the hardware watchdog, e.g. after it has reset the board several times in a row
+        if self.watchdog is None:
+            return True
+        try:
+            self.watchdog.deinit()
+        except Exception as e:
+            print(f"Watchdog can't be stopped: {e}")
+            return False
+        self.watchdog = None
+        return True
+
+    def feed(self):
+        # Also called between bring-up and network steps, which block the event loop
+        if self.stalled is not None:
+            return
+        now = self.clock()
+        self.max_gap = max(self.max_gap, now - self.last_feed)
+        self.last_feed = now
+        if self.watchdog is not None:
+            self.watchdog.feed()
+        self.feeds += 1
+
+    def check(self) -> str:
+        # The first task past its stall limit, None while every task keeps to its deadline
+        if self.scheduler is None:
+            return None
+        now = self.clock()
+        for task in self.scheduler.tasks:
+            if not task.enabled:
+                continue
+            limit = self.stall_factor * task.deadline
+            if task.started_at is not None:
+                if now - task.started_at > limit:
+                    return "{0} running for {1:.0f} s".format(task.name, now - task.started_at)
+            elif now - task.finished_at > task.period + limit:
+                return "{0} not released for {1:.0f} s".format(task.name, now - task.finished_at)
+        return None
+
+    def service(self):
+        # The supervision task, feeds the watchdog while every task is healthy
+        if self.stalled is not None:
+            return
+        reason = self.check()
+        if reason is None:
+            self.feed()
+            return
+        self.stalled = reason
+        print(f"Watchdog: {reason}")
+        if self.on_stall is not None:
+            self.on_stall(reason)
+
+    def stats(self) -> dict:
+        return {
+            "armed": self.watchdog is not None,
+            "feeds": self.feeds,
+            "max_gap_s": self.max_gap,
+            "stalled": self.stalled,
+        }
@@ -0,0 +1,202 @@
+# Incremental rollups of the logged channels
+# Every logged sample is folded into a bucket per level (1 minute, 1 hour and 1 day of RTC time by default) that
+# keeps count, min, mean and max per channel; failed readings are left out. When a sample falls into the next
+# bucket the finished one becomes a fixed-size record, and records go to the level's side file next to the log,
+#   <run>-rollup-60.bin, <run>-rollup-3600.bin, <run>-rollup-86400.bin
+# a few at a time, like the SD logger's rows. A month of 1 h records is some 100 kB and of 1 day records 4 kB, so
+# long-range plots read these (analysis.read_rollup) rather than the run. A bucket still open at shutdown is
+# written as it is, one lost to a crash is rebuilt on the host from the finer level; like the logger's rows, the
+# finest level's records still in RAM are lost with it (at most max_age worth). A torn record is padded out to
+# full size so the ones after it stay aligned, the host keeps the rewritten copy that follows it.
+# The running mean stays accurate in float32 over a day of samples, where a sum wouldn't, and a sample allocates
+# nothing.
+# ===================================================================================================================
+
+import struct
+import time
+from array import array
+
+MAGIC = b"BFRU"
+VERSION = 1
+# magic, version, channel count, reserved, bucket seconds
+HEADER_FORMAT = "<4sBBHI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+LEVELS = (60, 3600, 86400)
+
+
+def record_format(channels: int) -> str:
+    # bucket start (RTC epoch), then counts, minimums, means and maximums of every channel
+    return "<I{0}I{0}f{0}f{0}f".format(channels)
+
+
+def rollup_path(base: str, period: int) -> str:
+    return "{0}-rollup-{1}.bin".format(base, period)
+
+
+class Level:
+    def __init__(self, period: int, channels: int, capacity: int):
+        self.period = period
+        # bucket being filled, -1 before the first sample
+        self.start = -1
+        self.samples = 0
+        self.counts = array("L", [0] * channels)
+        self.minimums = array("f", [0.0] * channels)
+        self.means = array("f", [0.0] * channels)
+        self.maximums = array("f", [0.0] * channels)
+        # finished records waiting to be written
+        self.buffer = bytearray(capacity * struct.calcsize(record_format(channels)))
+        self.length = 0
+        self.oldest = 0.0
+
+
+class Rollup:
+    def __init__(self, open_file, base: str, channels: int = 8, periods: tuple = LEVELS, capacity: int = 8,
+                 max_age: float = 120, clock=None):
+        # base is the run's path without extension. Records are written once `capacity` are pending for a level
+        # or the oldest is max_age seconds old.
+        self.open_file = open_file
+        self.base = base
+        self.channels = channels
+        self.format = record_format(channels)
+        self.record_size = struct.calcsize(self.format)
+        self.max_age = max_age
+        self.clock = clock or time.monotonic
+        self.levels = tuple(Level(period, channels, capacity) for period in periods)
+        self.paths = tuple(rollup_path(base, period) for period in periods)
+        # counters
+        self.records = 0
+        self.records_lost = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def add(self, epoch: int, values, failed=None):
+        # One logged sample; failed[i] set leaves channel i out
+        channels = self.channels
+        for level in self.levels:
+            start = epoch - epoch % level.period
+            if start != level.start:
+                if level.samples:
+                    self.finish(level)
+                level.start = start
+                level.samples = 0
+                for i in range(channels):
+                    level.counts[i] = 0
+            level.samples += 1
+            counts = level.counts
+            minimums = level.minimums
+            means = level.means
+            maximums = level.maximums
+            for i in range(channels):
+                if failed is not None and failed[i]:
+                    continue
+                value = values[i]
+                count = counts[i] + 1
+                counts[i] = count
+                if count == 1:
+                    minimums[i] = maximums[i] = means[i] = value
+                    continue
+                if value < minimums[i]:
+                    minimums[i] = value
+                if value > maximums[i]:
+                    maximums[i] = value
+                means[i] += (value - means[i]) / count
+
+    def finish(self, level: Level):
+        # Queue the level's bucket as a record
+        if level.length + self.record_size > len(level.buffer):
+            self.flush_level(level)
+            if level.length + self.record_size > len(level.buffer):
+                # the card keeps failing, the newest record goes
+                self.records_lost += 1
+                level.samples = 0
+                return
+        if not level.length:
+            level.oldest = self.clock()
+        buffer = level.buffer
+        channels = self.channels
+        offset = level.length
+        struct.pack_into("<I", buffer, offset, level.start)
+        offset += 4
+        for values, code in ((level.counts, "<I"), (level.minimums, "<f"), (level.means, "<f"),
+                             (level.maximums, "<f")):
+            for i in range(channels):
+                struct.pack_into(code, buffer, offset, values[i])
+                offset += 4
+        level.length = offset
+        level.samples = 0
+        self.records += 1
+
+    def poll(self) -> bool:
+        # Time-based flush, called periodically by the SD task
+        flushed = True
+        now = self.clock()
+        for level in self.levels:
+            if level.length and now - level.oldest >= self.max_age:
+                flushed = self.flush_level(level) and flushed
+        return flushed
+
+    def flush(self) -> bool:
+        flushed = True
+        for level in self.levels:
+            flushed = self.flush_level(level) and flushed
+        return flushed
+
+    def flush_level(self, level: Level) -> bool:
+        if not level.length:
+            return True
+        path = self.paths[self.levels.index(level)]
+        try:
+            with self.open_file(path, "ab") as file:
+                size = file.tell()
+                if size == 0:
+                    file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.channels, 0, level.period))
+                elif (size - HEADER_SIZE) % self.record_size:
+                    # an earlier write was torn, pad it to a whole record, its retry comes next
+                    file.write(bytes(self.record_size - (size - HEADER_SIZE) % self.record_size))
+                file.write(memoryview(level.buffer)[:level.length])
+        except Exception as e:
+            # the records stay pending and are retried on the next flush
+            print(f"Error writing rollup {path}: {e}")
+            self.flush_errors += 1
+            return False
+        level.length = 0
+        self.flushes += 1
+        return True
+
+    def close(self) -> bool:
+        # Shutdown: the open buckets are written as they are
+        for level in self.levels:
+            if level.samples:
+                self.finish(level)
+        return self.flush()
+
+    def state(self) -> list:
+        # The open buckets, [period, start, samples, counts, minimums, means, maximums] per level, for a checkpoint
+        return [[level.period, level.start, level.samples, list(level.counts), list(level.minimums),
+                 list(level.means), list(level.maximums)] for level in self.levels]
+
+    def restore(self, state: list, epoch: int) -> int:
+        # Reopens the checkpointed buckets still current at `epoch` (RTC), returns how many
+        restored = 0
+        for period, start, samples, counts, minimums, means, maximums in state:
+            for level in self.levels:
+                if level.period != period or start != epoch - epoch % period or len(counts) != self.channels:
+                    continue
+                level.start = start
+                level.samples = samples
+                for i in range(self.channels):
+                    level.counts[i] = counts[i]
+                    level.minimums[i] = minimums[i]
+                    level.means[i] = means[i]
+                    level.maximums[i] = maximums[i]
+                restored += 1
+        return restored
+
+    def stats(self) -> dict:
+        return {
+            "records": self.records,
+            "pending": sum(level.length for level in self.levels) // self.record_size,
+            "records_lost": self.records_lost,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
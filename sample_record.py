@@ -0,0 +1,163 @@
+# Reusable sample record and in-place text formatting
+# One SampleRecord is filled in place every cycle instead of building a new dict, and the SD row, the serial
+# printout and the display numbers are written as ASCII digits straight into preallocated bytearrays, so a
+# steady-state cycle leaves no strings behind for the garbage collector. Numbers go through integer arithmetic,
+# which stays on small ints on the RP2040 for every value the sensors can report.
+# ===================================================================================================================
+
+import sys
+from array import array
+
+CHANNELS = ("lux_start", "lux_end", "ambient_co2", "system_co2", "biofilm_co2", "temperature", "humidity", "pressure")
+CHANNEL_INDEX = dict((name, i) for i, name in enumerate(CHANNELS))
+# Sample channels each channel is computed from, its value failed if any of theirs did
+CHANNEL_SOURCES = dict((name, ("ambient_co2", "system_co2") if name == "biofilm_co2" else (name,))
+                       for name in CHANNELS)
+# Longest CSV row write_row can produce, reserved in the SD buffer before formatting
+ROW_MAX = 320
+SCALES = (1, 10, 100, 1000, 10000)
+INF = float("inf")
+
+
+class SampleRecord:
+    __slots__ = ("values",)
+
+    def __init__(self):
+        self.values = array("f", [0.0] * len(CHANNELS))
+
+    def __getitem__(self, name: str) -> float:
+        return self.values[CHANNEL_INDEX[name]]
+
+    def __setitem__(self, name: str, value: float):
+        self.values[CHANNEL_INDEX[name]] = value
+
+    def as_dict(self) -> dict:
+        # for debugging and host tools, allocates
+        return dict((name, self.values[i]) for i, name in enumerate(CHANNELS))
+
+
+def put_bytes(buffer, pos: int, data) -> int:
+    end = pos + len(data)
+    buffer[pos:end] = data
+    return end
+
+
+def put_int(buffer, pos: int, value: int, width: int = 1) -> int:
+    # Decimal digits of a non-negative int, zero padded to width
+    digits = 1
+    limit = 10
+    while value >= limit:
+        digits += 1
+        limit *= 10
+    if digits < width:
+        digits = width
+    end = pos + digits
+    i = end - 1
+    while i >= pos:
+        buffer[i] = 48 + value % 10
+        value //= 10
+        i -= 1
+    return end
+
+
+def put_fixed(buffer, pos: int, value: float, decimals: int) -> int:
+    # "{:.<decimals>f}".format(value) for finite values up to the last digit: the product value * 10 ** decimals is
+    # rounded half up, format rounds the exact binary value half to even, so a value on or next to a half can come
+    # out one higher (0.125 gives "0.13" for "0.12", 2.675 "2.68" for "2.67")
+    if value != value:
+        return put_bytes(buffer, pos, b"nan")
+    if value < 0:
+        buffer[pos] = 45
+        pos += 1
+        value = -value
+    if value == INF:
+        return put_bytes(buffer, pos, b"inf")
+    scale = SCALES[decimals]
+    scaled = int(value * scale + 0.5)
+    pos = put_int(buffer, pos, scaled // scale)
+    if decimals:
+        buffer[pos] = 46
+        pos = put_int(buffer, pos + 1, scaled % scale, decimals)
+    return pos
+
+
+def put_date_time(buffer, pos: int, t, separator: bytes = b", ") -> int:
+    # "YYYY-MM-DD, HH:MM:SS" from a struct_time
+    pos = put_int(buffer, pos, t.tm_year, 4)
+    buffer[pos] = 45
+    pos = put_int(buffer, pos + 1, t.tm_mon, 2)
+    buffer[pos] = 45
+    pos = put_int(buffer, pos + 1, t.tm_mday, 2)
+    pos = put_bytes(buffer, pos, separator)
+    pos = put_int(buffer, pos, t.tm_hour, 2)
+    buffer[pos] = 58
+    pos = put_int(buffer, pos + 1, t.tm_min, 2)
+    buffer[pos] = 58
+    return put_int(buffer, pos + 1, t.tm_sec, 2)
+
+
+class RowFormatter:
+    # write_sd's text row in the layout of the f-string with str(error_dict) it replaced, numbers may differ from
+    # that in the last digit (see put_fixed):
+    # "YYYY-MM-DD, HH:MM:SS,elapsed,<8 channels>,{'lux_start': 0, ...}\n"
+    def __init__(self, error_keys: tuple):
+        self.error_keys = tuple(error_keys)
+        self.error_prefixes = tuple(("{'" if i == 0 else ", '").encode() + key.encode() + b"': "
+                                    for i, key in enumerate(self.error_keys))
+
+    def write_row(self, buffer, pos: int, t, elapsed_time: float, record: SampleRecord, errors: dict) -> int:
+        pos = put_date_time(buffer, pos, t)
+        buffer[pos] = 44
+        pos = put_fixed(buffer, pos + 1, elapsed_time, 2)
+        values = record.values
+        for i in range(len(values)):
+            buffer[pos] = 44
+            pos = put_fixed(buffer, pos + 1, values[i], 2)
+        buffer[pos] = 44
+        pos += 1
+        keys = self.error_keys
+        prefixes = self.error_prefixes
+        for i in range(len(keys)):
+            pos = put_bytes(buffer, pos, prefixes[i])
+            pos = put_int(buffer, pos, errors[keys[i]])
+        return put_bytes(buffer, pos, b"}\n" if keys else b"{}\n")
+
+
+class ConsoleReport:
+    # print_data's serial printout formatted into one reusable buffer
+    LINES = (
+        (b"Lux start: ", "lux_start"), (b"Lux end: ", "lux_end"), (b"Ambient CO2: ", "ambient_co2"),
+        (b"System CO2: ", "system_co2"), (b"Biofilm CO2: ", "biofilm_co2"), (b"Temperature: ", "temperature"),
+        (b"Humidity: ", "humidity"), (b"Pressure: ", "pressure"),
+    )
+
+    def __init__(self, size: int = 320):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.slots = tuple(CHANNEL_INDEX[name] for _, name in self.LINES)
+
+    def format(self, t, record: SampleRecord, header: bytes = b"") -> int:
+        buffer = self.buffer
+        pos = put_bytes(buffer, 0, header)
+        pos = put_bytes(buffer, pos, b"Time stamp: ")
+        pos = put_date_time(buffer, pos, t)
+        buffer[pos] = 10
+        pos += 1
+        values = record.values
+        for i in range(len(self.LINES)):
+            pos = put_bytes(buffer, pos, self.LINES[i][0])
+            pos = put_fixed(buffer, pos, values[self.slots[i]], 2)
+            buffer[pos] = 10
+            pos += 1
+        return pos
+
+    def write(self, length: int):
+        stream = getattr(sys.stdout, "buffer", None)
+        if stream is not None:
+            # text already printed may still sit in the text layer's buffer
+            sys.stdout.flush()
+            stream.write(self.view[:length])
+            stream.flush()
+        else:
+            # no binary stdout on this port, costs one string
+            sys.stdout.write(str(self.buffer[:length], "ascii"))
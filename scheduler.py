@@ -0,0 +1,196 @@
+# Cooperative scheduler for the biofilm cell factory
+# Each job runs as its own asyncio task with a period and a deadline and sleeps until its next release time,
+# so a slow publish no longer delays sampling and the CPU idles between deadlines instead of spinning.
+# Only asyncio.run/create_task/gather/sleep are used, which CircuitPython's asyncio library provides.
+# ===================================================================================================================
+
+import time
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+
+class PeriodicTask:
+    def __init__(self, name: str, period: float, action, deadline: float = None, clock=None):
+        self.name = name
+        # period may be changed while running, the next release picks it up
+        self.period = period
+        # deadline is the longest a single run may take, defaults to the period
+        self.deadline = deadline if deadline is not None else period
+        self.action = action
+        self.clock = clock or time.monotonic
+        self.enabled = True
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_runtime = 0.0
+        self.max_lateness = 0.0
+        self.last_error = None
+        # start of the run in progress (None between runs) and end of the last one, watched by the supervisor
+        self.started_at = None
+        self.finished_at = self.clock()
+
+    async def run(self, scheduler):
+        clock = self.clock
+        next_release = clock()
+        self.finished_at = next_release
+        while scheduler.running:
+            delay = next_release - clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if not scheduler.running:
+                    break
+            start = clock()
+            self.started_at = start
+            self.max_lateness = max(self.max_lateness, start - next_release)
+            if self.enabled:
+                try:
+                    result = self.action()
+                    # async actions hand back a coroutine that still has to be driven
+                    if result is not None and hasattr(result, "send"):
+                        await result
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = e
+                    print("Task {0} failed: {1}".format(self.name, e))
+                    if scheduler.on_error is not None:
+                        scheduler.on_error(self, e)
+                self.runs += 1
+            end = clock()
+            self.started_at = None
+            self.finished_at = end
+            runtime = end - start
+            self.max_runtime = max(self.max_runtime, runtime)
+            if runtime > self.deadline:
+                self.overruns += 1
+            next_release += self.period
+            if next_release < end:
+                # Don't burst to catch up on missed releases, restart the period from now
+                self.skipped += int((end - next_release) // self.period) + 1
+                next_release = end + self.period
+            await asyncio.sleep(0)
+
+    def summary(self) -> str:
+        return "{0}: runs={1} errors={2} overruns={3} skipped={4} max_runtime={5:.3f}s max_late={6:.3f}s".format(
+            self.name, self.runs, self.errors, self.overruns, self.skipped, self.max_runtime, self.max_lateness)
+
+
+class Scheduler:
+    def __init__(self, clock=None):
+        self.clock = clock or time.monotonic
+        self.tasks = []
+        self.running = False
+        # on_error(task, exception) is called after any task raises
+        self.on_error = None
+
+    def add(self, name: str, period: float, action, deadline: float = None) -> PeriodicTask:
+        task = PeriodicTask(name, period, action, deadline, self.clock)
+        self.tasks.append(task)
+        return task
+
+    def get(self, name: str) -> PeriodicTask:
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        raise KeyError(name)
+
+    async def run(self):
+        self.running = True
+        await asyncio.gather(*[asyncio.create_task(task.run(self)) for task in self.tasks])
+
+    def start(self):
+        asyncio.run(self.run())
+
+    def stop(self):
+        # Tasks finish their current run and exit at their next release
+        self.running = False
+
+    def report(self) -> str:
+        return "\n".join(task.summary() for task in self.tasks)
+
+
+class RotationSlot:
+    def __init__(self, name: str, period: float, action, priority: int, release: float):
+        self.name = name
+        self.period = period
+        self.action = action
+        self.priority = priority
+        self.release = release
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        self.total_runtime = 0.0
+        self.max_runtime = 0.0
+        self.max_lateness = 0.0
+
+    def summary(self) -> str:
+        mean = self.total_runtime / self.runs if self.runs else 0.0
+        return "{0}: runs={1} errors={2} skipped={3} mean_runtime={4:.3f}s max_runtime={5:.3f}s max_late={6:.3f}s".format(
+            self.name, self.runs, self.errors, self.skipped, mean, self.max_runtime, self.max_lateness)
+
+
+class Rotation:
+    # Runs several jobs of the same kind, e.g. one sample per chamber, from a single scheduler task so they never
+    # overlap on the shared bus. Every step runs all due jobs, highest priority first and the earliest release
+    # among equals, and jobs keep their phase so staggered chambers stay staggered.
+    def __init__(self, clock=None):
+        self.clock = clock or time.monotonic
+        self.slots = []
+        # on_error(slot, exception) is called after a job raises
+        self.on_error = None
+
+    def add(self, name: str, period: float, action, priority: int = 0, phase: float = 0.0) -> RotationSlot:
+        slot = RotationSlot(name, period, action, priority, self.clock() + phase)
+        self.slots.append(slot)
+        return slot
+
+    def stagger(self):
+        # Spread the releases evenly over the period so the jobs don't all fall due together
+        count = len(self.slots)
+        now = self.clock()
+        for i in range(count):
+            slot = self.slots[i]
+            slot.release = now + i * slot.period / count
+
+    def next_due(self):
+        now = self.clock()
+        best = None
+        for slot in self.slots:
+            if slot.release > now:
+                continue
+            if best is None or slot.priority > best.priority or (
+                    slot.priority == best.priority and slot.release < best.release):
+                best = slot
+        return best
+
+    async def step(self):
+        while True:
+            slot = self.next_due()
+            if slot is None:
+                return
+            start = self.clock()
+            slot.max_lateness = max(slot.max_lateness, start - slot.release)
+            try:
+                result = slot.action()
+                if result is not None and hasattr(result, "send"):
+                    await result
+            except Exception as e:
+                slot.errors += 1
+                print("Rotation job {0} failed: {1}".format(slot.name, e))
+                if self.on_error is not None:
+                    self.on_error(slot, e)
+            end = self.clock()
+            runtime = end - start
+            slot.runs += 1
+            slot.total_runtime += runtime
+            slot.max_runtime = max(slot.max_runtime, runtime)
+            slot.release += slot.period
+            while slot.release <= end:
+                slot.release += slot.period
+                slot.skipped += 1
+
+    def report(self) -> str:
+        return "\n".join(slot.summary() for slot in self.slots)
@@ -0,0 +1,168 @@
+# Buffered SD card logger
+# Keeps the log file open and collects rows in a preallocated bytearray, writing them out in one go when the row
+# count or byte budget is reached or the oldest pending row gets too old. Every open/close on FAT over SPI rewrites
+# directory and FAT sectors, so batching cuts both cycle time and card wear.
+# With a chunklog.ChunkWriter the log is split into chunk files and every flushed block is indexed by time.
+# ===================================================================================================================
+
+import time
+
+
+class SDLogger:
+    def __init__(self, open_file, path: str, max_rows: int = 10, max_bytes: int = 2048, max_age: float = 120,
+                 clock=None, sync=None, chunks=None):
+        self.open_file = open_file
+        # with `chunks` the path is chosen by the ChunkWriter before each flush
+        self.path = path
+        self.chunks = chunks
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.clock = clock or time.monotonic
+        # called after each flush so the FAT and directory entry are on the card, os.sync on the device
+        self.sync = sync
+        self.buffer = bytearray(max_bytes)
+        self.file = None
+        self.length = 0
+        self.rows = 0
+        self.oldest = 0.0
+        # RTC epochs of the first and last pending row, for the chunk index
+        self.first_epoch = 0
+        self.last_epoch = 0
+        # counters
+        self.bytes_written = 0
+        self.rows_written = 0
+        self.rows_lost = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def rows_at_risk(self) -> int:
+        # Rows that would be lost if the device crashed right now
+        return self.rows
+
+    @property
+    def mean_flush_latency(self) -> float:
+        return self.total_flush_latency / self.flushes if self.flushes else 0.0
+
+    def open(self):
+        if self.file is None:
+            self.file = self.open_file(self.path, "ab")
+
+    def append(self, row, epoch: int = 0) -> bool:
+        # Queue one row, returns False if it had to be dropped
+        if isinstance(row, str):
+            row = row.encode()
+        size = len(row)
+        if not self.reserve(size):
+            return False
+        self.buffer[self.length:self.length + size] = row
+        self.commit(size, epoch)
+        return True
+
+    def reserve(self, size: int) -> bool:
+        # Make sure `size` bytes fit after self.length, flushing or dropping pending rows if needed
+        if self.length + size > self.max_bytes:
+            self.flush()
+            if self.length + size > self.max_bytes:
+                if self.length:
+                    # The card is still failing, make room by dropping what is pending
+                    self.rows_lost += self.rows
+                    self.length = 0
+                    self.rows = 0
+                if size > self.max_bytes:
+                    self.rows_lost += 1
+                    return False
+        return True
+
+    def commit(self, size: int, epoch: int = 0):
+        # Account for a row of `size` bytes already placed at self.length, stamped with its RTC epoch
+        if self.rows == 0:
+            self.oldest = self.clock()
+            self.first_epoch = epoch
+        self.last_epoch = epoch
+        self.length += size
+        self.rows += 1
+        if self.rows >= self.max_rows:
+            self.flush()
+
+    def due(self) -> bool:
+        return self.rows > 0 and self.clock() - self.oldest >= self.max_age
+
+    def poll(self) -> bool:
+        # Time-based flush, called periodically by the SD task
+        if self.due():
+            return self.flush()
+        return False
+
+    def flush(self) -> bool:
+        if not self.length:
+            return True
+        start = self.clock()
+        try:
+            if self.chunks is not None:
+                self.chunks.select(self)
+            self.open()
+            offset = self.file.tell() if self.chunks is not None else 0
+            self.write_block(memoryview(self.buffer)[:self.length])
+            self.file.flush()
+            if self.chunks is not None:
+                self.chunks.record(self, offset, self.file.tell() - offset)
+            if self.sync is not None:
+                self.sync()
+        except Exception as e:
+            # Pending rows stay in the buffer and are retried on the next flush with a freshly opened file
+            print(f"Error writing to sd card: {e}")
+            self.flush_errors += 1
+            self.close_file()
+            return False
+        latency = self.clock() - start
+        self.bytes_written += self.length
+        self.rows_written += self.rows
+        self.flushes += 1
+        self.last_flush_latency = latency
+        self.total_flush_latency += latency
+        if latency > self.max_flush_latency:
+            self.max_flush_latency = latency
+        self.length = 0
+        self.rows = 0
+        return True
+
+    def write_block(self, block: memoryview):
+        self.file.write(block)
+
+    def close_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+
+    def close(self) -> bool:
+        # Forced flush for shutdown and error paths
+        flushed = self.flush()
+        self.close_file()
+        if self.chunks is not None:
+            self.chunks.close()
+        if not flushed:
+            self.rows_lost += self.rows
+            self.length = 0
+            self.rows = 0
+        return flushed
+
+    def stats(self) -> dict:
+        return {
+            "bytes_written": self.bytes_written,
+            "rows_written": self.rows_written,
+            "rows_at_risk": self.rows_at_risk,
+            "rows_lost": self.rows_lost,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": 1000 * self.last_flush_latency,
+            "mean_flush_ms": 1000 * self.mean_flush_latency,
+            "max_flush_ms": 1000 * self.max_flush_latency,
+        }
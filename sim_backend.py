@@ -0,0 +1,525 @@
+# Simulated backend for the biofilm cell factory
+# Deterministic stand-ins for every hardware role so the acquisition loop can run on CPython
+# Each role has a configurable per-access latency (seconds) and fault probability, e.g.
+#   SimBackend(seed=1, latency={"sd": 0.004}, faults={"scd30": 0.01})
+# Sensors on odd-numbered buses are on the system side, and a VEML7700 sees the LED with its bus's number.
+# Channel c of a TCA9548A on bus b behaves like bus 8b + c, which matches chambers.mux_chambers.
+# ===================================================================================================================
+
+import calendar
+import math
+import os
+import random
+import tempfile
+import time
+
+ROLES = ("scd30", "veml7700", "dps310", "ds3231", "sd", "ssd1306", "mqtt")
+# Start of simulated RTC time, 2024-01-01 00:00:00 UTC
+RTC_EPOCH = 1704067200
+
+
+class SimulatedFault(OSError):
+    pass
+
+
+class SimulatedReload(BaseException):
+    # Raised by SimBackend.restart where supervisor.reload() would restart code.py, like its ReloadException it
+    # isn't caught by the tasks' `except Exception`
+    pass
+
+
+class SimI2C:
+    def __init__(self, index: int):
+        self.index = index
+
+
+class SimMux:
+    def __init__(self, i2c: SimI2C):
+        self.channels = [SimI2C(8 * i2c.index + channel) for channel in range(8)]
+
+    def __getitem__(self, channel: int) -> SimI2C:
+        return self.channels[channel]
+
+
+class SimRole:
+    def __init__(self, backend, role: str):
+        self._backend = backend
+        self._role = role
+
+    def _access(self):
+        self._backend.access(self._role)
+
+
+class SimSCD30(SimRole):
+    def __init__(self, backend, index: int):
+        super().__init__(backend, "scd30")
+        self.system = index % 2 == 1
+        # chambers further down the fleet grow faster so their logs can be told apart
+        self.production = 80.0 * (1.0 + 0.25 * (index // 2))
+        self.measurement_interval = 2
+        self.ambient_pressure = 0
+        self.altitude = 0
+        self.self_calibration_enabled = False
+        self._rng = backend.rng("scd30-%d" % index)
+        self._last_read = -1e9
+        self._co2 = self._temperature = self._relative_humidity = 0.0
+
+    @property
+    def data_available(self) -> bool:
+        self._access()
+        return self._backend.monotonic() - self._last_read >= self.measurement_interval
+
+    def _reading(self) -> float:
+        t = self._backend.elapsed()
+        ambient = 420.0 + 15.0 * math.sin(t / 600.0)
+        if self.system:
+            # The system chamber sees the ambient air after the transit time plus the biofilm's production
+            ambient = 420.0 + 15.0 * math.sin((t - 450.0) / 600.0)
+            ambient += self.production * (1.0 - math.exp(-t / 3600.0))
+        return ambient + self._rng.gauss(0.0, 2.0)
+
+    def _humidity(self) -> float:
+        return (85.0 if self.system else 45.0) + self._rng.gauss(0.0, 0.5)
+
+    def _read_data(self):
+        # One measurement read fills all three values, like adafruit_scd30
+        self._access()
+        self._last_read = self._backend.monotonic()
+        self._co2 = self._reading()
+        self._temperature = 25.0 + self._rng.gauss(0.0, 0.05)
+        self._relative_humidity = self._humidity()
+
+    # as in adafruit_scd30 each property polls data_available and reads a new measurement if there is one
+    @property
+    def CO2(self) -> float:
+        if self.data_available:
+            self._read_data()
+        return self._co2
+
+    @property
+    def temperature(self) -> float:
+        if self.data_available:
+            self._read_data()
+        return self._temperature
+
+    @property
+    def relative_humidity(self) -> float:
+        if self.data_available:
+            self._read_data()
+        return self._relative_humidity
+
+
+class SimVEML7700(SimRole):
+    ALS_GAIN_1 = 0x0
+    ALS_GAIN_2 = 0x1
+    ALS_GAIN_1_8 = 0x2
+    ALS_GAIN_1_4 = 0x3
+    ALS_25MS = 0xC
+    ALS_50MS = 0x8
+    ALS_100MS = 0x0
+    ALS_200MS = 0x1
+    ALS_400MS = 0x2
+    ALS_800MS = 0x3
+    GAINS = {ALS_GAIN_1: 1.0, ALS_GAIN_2: 2.0, ALS_GAIN_1_8: 0.125, ALS_GAIN_1_4: 0.25}
+    INTEGRATION_MS = {ALS_25MS: 25, ALS_50MS: 50, ALS_100MS: 100, ALS_200MS: 200, ALS_400MS: 400, ALS_800MS: 800}
+
+    def __init__(self, backend, index: int):
+        super().__init__(backend, "veml7700")
+        self.index = index
+        self.light_gain = self.ALS_GAIN_1
+        self.light_integration_time = self.ALS_100MS
+        self.light_shutdown = False
+        self._rng = backend.rng("veml7700-%d" % index)
+
+    @property
+    def lux(self) -> float:
+        self._access()
+        dark = 3.0 + self._rng.gauss(0.0, 0.2)
+        led = self._backend.leds.get(self.index)
+        if led is None or not led.value:
+            return dark
+        # Light reaching the end sensor is attenuated by the biofilm as it grows
+        incident = 1200.0 + self._rng.gauss(0.0, 5.0)
+        if self.index % 2 == 1:
+            incident *= 0.4 + 0.5 * math.exp(-self._backend.elapsed() / 7200.0)
+        return dark + incident
+
+    @property
+    def light(self) -> int:
+        # Raw counts at the configured gain and integration time, clipped like the 16-bit register
+        resolution = (0.0042 * (800 / self.INTEGRATION_MS[self.light_integration_time])
+                      * (2.0 / self.GAINS[self.light_gain]))
+        return min(65535, int(self.lux / resolution))
+
+
+class SimDPS310(SimRole):
+    def __init__(self, backend):
+        super().__init__(backend, "dps310")
+        self._rng = backend.rng("dps310")
+
+    @property
+    def temperature_ready(self) -> bool:
+        self._access()
+        return True
+
+    @property
+    def pressure_ready(self) -> bool:
+        self._access()
+        return True
+
+    @property
+    def temperature(self) -> float:
+        self._access()
+        return 24.0 + 0.5 * math.sin(self._backend.elapsed() / 1800.0) + self._rng.gauss(0.0, 0.02)
+
+    @property
+    def pressure(self) -> float:
+        self._access()
+        return 1013.25 + self._rng.gauss(0.0, 0.1)
+
+
+class SimDS3231(SimRole):
+    def __init__(self, backend):
+        super().__init__(backend, "ds3231")
+        self.lost_power = False
+        self._offset = RTC_EPOCH
+
+    @property
+    def datetime(self) -> time.struct_time:
+        self._access()
+        return time.gmtime(int(self._offset + self._backend.elapsed()))
+
+    @datetime.setter
+    def datetime(self, value: time.struct_time):
+        self._access()
+        self._offset = calendar.timegm(value) - self._backend.elapsed()
+
+
+class SimLED:
+    def __init__(self):
+        self.value = False
+
+
+class SimFile:
+    # File on the host filesystem that charges SD latency and faults on every operation
+    def __init__(self, backend, path: str, mode: str):
+        self._backend = backend
+        self._backend.access("sd")
+        self._file = open(path, mode)
+
+    def write(self, data) -> int:
+        self._backend.access("sd")
+        return self._file.write(data)
+
+    def read(self, size: int = -1):
+        self._backend.access("sd")
+        return self._file.read(size)
+
+    def readline(self):
+        self._backend.access("sd")
+        return self._file.readline()
+
+    def readinto(self, buffer) -> int:
+        self._backend.access("sd")
+        return self._file.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self):
+        self._backend.access("sd")
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._backend.access("sd")
+            self._file.close()
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class SimLabel:
+    def __init__(self, display, text: str, x: int, y: int):
+        self._display = display
+        self._text = text
+        self.x = x
+        self.y = y
+        self.hidden = False
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @text.setter
+    def text(self, value: str):
+        self._display.access()
+        self._text = value
+
+
+class SimBitmap:
+    # displayio.Bitmap stand-in, one byte per pixel in rows
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height)
+
+    def __getitem__(self, index) -> int:
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        return self.pixels[index]
+
+    def __setitem__(self, index, value: int):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        self.pixels[index] = value
+
+    def fill(self, value: int):
+        for i in range(len(self.pixels)):
+            self.pixels[i] = value
+
+    def blit(self, x: int, y: int, source, *, x1: int = 0, y1: int = 0, x2: int = None, y2: int = None):
+        # CircuitPython 8 Bitmap.blit. The sparkline's whole-bitmap shift by a column moves the buffer in place and
+        # mends the last column, so the simulation allocates no more than the device; the rest go pixel by pixel.
+        x2 = source.width if x2 is None else x2
+        y2 = source.height if y2 is None else y2
+        width = self.width
+        pixels = self.pixels
+        if source is self and (x, y, x1, y1, x2, y2) == (0, 0, 1, 0, width, self.height):
+            del pixels[0]
+            pixels.append(pixels[-1])
+            for row in range(self.height - 1):
+                end = row * width + width - 1
+                pixels[end] = pixels[end - 1]
+            return
+        forward = source is not self or (y, x) <= (y1, x1)
+        rows = range(y2 - y1) if forward else range(y2 - y1 - 1, -1, -1)
+        columns = range(x2 - x1) if forward else range(x2 - x1 - 1, -1, -1)
+        for row in rows:
+            for column in columns:
+                pixels[(y + row) * width + x + column] = source.pixels[(y1 + row) * source.width + x1 + column]
+
+
+class SimTileGrid:
+    def __init__(self, bitmap: SimBitmap, x: int, y: int):
+        self.bitmap = bitmap
+        self.x = x
+        self.y = y
+        self.hidden = False
+
+
+class SimWatchdog:
+    # microcontroller.watchdog stand-in, `expired` tells whether the board would have been reset
+    def __init__(self, backend, timeout: float):
+        self._backend = backend
+        self.timeout = timeout
+        self.last_feed = backend.monotonic()
+        self.feeds = 0
+        self.armed = True
+
+    def feed(self):
+        self.last_feed = self._backend.monotonic()
+        self.feeds += 1
+
+    def deinit(self):
+        self.armed = False
+
+    @property
+    def expired(self) -> bool:
+        return self.armed and self._backend.monotonic() - self.last_feed > self.timeout
+
+
+class SimDisplay:
+    def __init__(self, backend):
+        self._backend = backend
+        self.width = 128
+        self.height = 64
+        self.labels = []
+        self.grids = []
+        self.auto_refresh = True
+        self.refreshes = 0
+
+    def access(self):
+        self._backend.access("ssd1306")
+
+    def create_label(self, text: str, x: int, y: int) -> SimLabel:
+        lbl = SimLabel(self, text, x, y)
+        self.labels.append(lbl)
+        return lbl
+
+    def create_bitmap(self, width: int, height: int, x: int, y: int) -> tuple:
+        bitmap = SimBitmap(width, height)
+        grid = SimTileGrid(bitmap, x, y)
+        self.grids.append(grid)
+        return bitmap, grid
+
+    def refresh(self) -> bool:
+        self.access()
+        self.refreshes += 1
+        return True
+
+
+class SimWiFi(SimRole):
+    def __init__(self, backend):
+        super().__init__(backend, "mqtt")
+        self.resets = 0
+
+    def connect(self, timeout: int = 15, retries: int = 3):
+        self._access()
+
+    def reset(self):
+        self.resets += 1
+        self._access()
+
+
+class SimIO(SimRole):
+    # Adafruit IO MQTT client stand-in, keeps the last value per feed
+    def __init__(self, backend):
+        super().__init__(backend, "mqtt")
+        self.connected = False
+        self.feeds = {}
+        self.published = 0
+        self.subscriptions = []
+
+    @property
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def connect(self):
+        self._access()
+        self.connected = True
+
+    def reconnect(self):
+        self.connected = False
+        self.connect()
+
+    def subscribe(self, feed_key: str):
+        self._access()
+        self.subscriptions.append(feed_key)
+
+    def publish(self, feed_key: str, data, metadata=None, shared_user=None, is_group=False):
+        self._access()
+        self.feeds[feed_key] = data
+        self.published += 1
+
+    def loop(self, timeout: float = 0):
+        self._access()
+
+
+class SimBackend:
+    # Drop-in replacement for pico_backend.PicoBackend
+    def __init__(self, seed: int = 0, latency: dict = None, faults: dict = None,
+                 sd_root: str = None, clock=None):
+        for role in list(latency or {}) + list(faults or {}):
+            if role not in ROLES:
+                raise ValueError("Unknown role {0}, expected one of {1}".format(role, ROLES))
+        self.seed = seed
+        self.latency = dict(latency or {})
+        self.faults = dict(faults or {})
+        self.sd_root = sd_root
+        self.clock = clock or time.monotonic
+        self.start = self.clock()
+        self.leds = {}
+        self.calls = dict.fromkeys(ROLES, 0)
+        self.fault_counts = dict.fromkeys(ROLES, 0)
+        # why the simulated board last started and how often it was restarted
+        self.last_reset = "power_on"
+        self.restarts = 0
+        self._nvm = bytearray(4096)
+        self._fault_rngs = dict((role, self.rng("fault-" + role)) for role in ROLES)
+
+    def rng(self, name: str) -> random.Random:
+        # Stable per-stream seed, str hashes are salted per process so they can't be used here
+        return random.Random(self.seed * 1000003 + sum(ord(c) * (i + 1) for i, c in enumerate(name)))
+
+    def access(self, role: str):
+        self.calls[role] += 1
+        delay = self.latency.get(role, 0)
+        if delay:
+            time.sleep(delay)
+        probability = self.faults.get(role, 0)
+        if probability and self._fault_rngs[role].random() < probability:
+            self.fault_counts[role] += 1
+            raise SimulatedFault("Simulated {0} fault".format(role))
+
+    def monotonic(self) -> float:
+        return self.clock()
+
+    def elapsed(self) -> float:
+        return self.clock() - self.start
+
+    def setup_i2c(self) -> tuple:
+        return SimI2C(0), SimI2C(1)
+
+    def scd30(self, i2c) -> SimSCD30:
+        return SimSCD30(self, i2c.index)
+
+    def veml7700(self, i2c) -> SimVEML7700:
+        return SimVEML7700(self, i2c.index)
+
+    def mux(self, i2c) -> SimMux:
+        return SimMux(i2c)
+
+    def dps310(self, i2c) -> SimDPS310:
+        return SimDPS310(self)
+
+    def ds3231(self, i2c) -> SimDS3231:
+        return SimDS3231(self)
+
+    def led(self, index: int) -> SimLED:
+        led = SimLED()
+        self.leds[index] = led
+        return led
+
+    def mount_sd(self) -> str:
+        if self.sd_root is None:
+            self.sd_root = tempfile.mkdtemp(prefix="biofilm-sd-")
+        os.makedirs(self.sd_root, exist_ok=True)
+        return self.sd_root
+
+    def open(self, path: str, mode: str = "r") -> SimFile:
+        return SimFile(self, path, mode)
+
+    def sync(self):
+        self.access("sd")
+
+    def listdir(self, path: str) -> list:
+        self.access("sd")
+        return os.listdir(path)
+
+    def watchdog(self, timeout: float) -> SimWatchdog:
+        return SimWatchdog(self, timeout)
+
+    def reset_reason(self) -> str:
+        return self.last_reset
+
+    def restart(self):
+        self.last_reset = "software"
+        self.restarts += 1
+        raise SimulatedReload()
+
+    def nvm(self) -> bytearray:
+        # kept by the backend, so a monitor built again on it after a restart sees what was written
+        return self._nvm
+
+    def display(self, i2c) -> SimDisplay:
+        return SimDisplay(self)
+
+    def wifi(self) -> tuple:
+        return None, SimWiFi(self)
+
+    def adafruit_io(self, esp, broker: str = "io.adafruit.com", port: int = None, prefix: str = None,
+                    timeout: float = None) -> SimIO:
+        io = SimIO(self)
+        io.broker = broker
+        io.prefix = prefix
+        return io
@@ -0,0 +1,260 @@
+# Sparkline history view for the SSD1306
+# History keeps a channel's last readings in a fixed ring buffer, one per sample. Sparkline plots them into a
+# preallocated 1-bit bitmap, one column per reading: a new reading shifts the columns one to the left with a blit
+# and draws only the rightmost column, a line from the previous reading's row to the new one. The whole plot is
+# redrawn from the history only when a reading leaves the vertical range, or the readings have used less than half
+# of it for a whole plot width.
+# HistoryView turns the display between pages (the number labels, the plots) by hiding one set of elements and
+# showing the other, nothing is rebuilt. Columns are drawn by the display task within a time budget, what doesn't
+# fit is drawn on its next run, and the drawing time is counted like the renderer's refresh time. Once set up a
+# new reading allocates nothing; a caption's text is only rebuilt when its plot's range changes.
+# ===================================================================================================================
+
+import time
+from array import array
+
+try:
+    import bitmaptools
+except ImportError:
+    # CPython and boards without it, Bitmap.blit and pixel writes do the same
+    bitmaptools = None
+
+# CircuitPython 9 moved Bitmap.blit to bitmaptools.blit
+BLIT = getattr(bitmaptools, "blit", None)
+FILL_REGION = getattr(bitmaptools, "fill_region", None)
+
+
+def shift_left(bitmap, width: int, height: int):
+    # Every column moves one to the left, the rightmost keeps its pixels until it is drawn over
+    if BLIT is not None:
+        BLIT(bitmap, bitmap, 0, 0, x1=1, y1=0, x2=width, y2=height)
+    else:
+        bitmap.blit(0, 0, bitmap, x1=1, y1=0, x2=width, y2=height)
+
+
+def fill_column(bitmap, width: int, x: int, top: int, bottom: int, value: int):
+    # Rows top to bottom (exclusive) of column x
+    if FILL_REGION is not None:
+        FILL_REGION(bitmap, x, top, x + 1, bottom, value)
+    else:
+        for y in range(top, bottom):
+            bitmap[y * width + x] = value
+
+
+class History:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.values = array("f", [0.0] * capacity)
+        # slot written next, and how many slots hold a reading
+        self.head = 0
+        self.count = 0
+
+    def push(self, value: float):
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def get(self, i: int) -> float:
+        # i-th reading held, oldest first
+        return self.values[(self.head - self.count + i) % self.capacity]
+
+    def latest(self) -> float:
+        return self.values[(self.head - 1) % self.capacity]
+
+    def bounds(self) -> tuple:
+        low = high = self.get(0)
+        for i in range(1, self.count):
+            value = self.get(i)
+            if value < low:
+                low = value
+            elif value > high:
+                high = value
+        return low, high
+
+
+class Sparkline:
+    def __init__(self, bitmap, grid, key: str, sources: tuple, caption=None, name: str = "", decimals: int = 0,
+                 min_span: float = 1.0, margin: float = 0.25):
+        # key is the plotted data field and sources the sample channels it is computed from, a failed one holds the
+        # previous reading. grid is the bitmap's tilegrid and caption a label showing name and range, both are
+        # hidden with the plot's page. The range spans at least min_span plus margin of it above and below.
+        self.bitmap = bitmap
+        self.grid = grid
+        self.key = key
+        self.sources = sources
+        self.caption = caption
+        self.name = name
+        self.decimals = decimals
+        self.min_span = min_span
+        self.margin = margin
+        self.width = bitmap.width
+        self.height = bitmap.height
+        self.history = History(self.width)
+        self.low = 0.0
+        self.high = 0.0
+        # readings not drawn yet, and the history column a redraw draws next (-1 when there is none)
+        self.pending = 0
+        self.redraw_next = -1
+        self.last_row = -1
+        # readings since the range was last set
+        self.since_scale = 0
+        # counters
+        self.columns = 0
+        self.redraws = 0
+
+    @property
+    def busy(self) -> bool:
+        return self.pending > 0 or self.redraw_next >= 0
+
+    def push(self, value: float, failed: bool = False):
+        history = self.history
+        if failed:
+            if not history.count:
+                return
+            value = history.latest()
+        history.push(value)
+        self.since_scale += 1
+        if history.count == 1 or value < self.low or value > self.high:
+            self.rescale(*history.bounds())
+            return
+        if self.since_scale >= self.width:
+            self.since_scale = 0
+            low, high = history.bounds()
+            if 2 * max(high - low, self.min_span) < self.high - self.low:
+                self.rescale(low, high)
+                return
+        if self.redraw_next >= 0:
+            # the columns moved under the redraw, it starts over
+            self.redraw_next = 0
+        else:
+            self.pending += 1
+
+    def rescale(self, low: float, high: float):
+        # New range around the readings held, the plot is redrawn from the history
+        half = max(high - low, self.min_span) * (0.5 + self.margin)
+        middle = (low + high) / 2
+        self.low = middle - half
+        self.high = middle + half
+        self.since_scale = 0
+        self.pending = 0
+        self.redraw_next = 0
+        self.redraws += 1
+        if self.caption is not None:
+            self.caption.text = "{0} {1:.{3}f} to {2:.{3}f}".format(self.name, self.low, self.high, self.decimals)
+
+    def row(self, value: float) -> int:
+        row = int((self.high - value) * (self.height - 1) / (self.high - self.low) + 0.5)
+        return min(max(row, 0), self.height - 1)
+
+    def draw(self, x: int, value: float):
+        # Column x cleared, then a line from the previous reading's row to this one
+        row = self.row(value)
+        previous = self.last_row if self.last_row >= 0 else row
+        fill_column(self.bitmap, self.width, x, 0, self.height, 0)
+        fill_column(self.bitmap, self.width, x, min(row, previous), max(row, previous) + 1, 1)
+        self.last_row = row
+        self.columns += 1
+
+    def step(self) -> bool:
+        # Draws one column of pending work, False when there is none
+        history = self.history
+        if self.redraw_next >= 0:
+            i = self.redraw_next
+            if i == 0:
+                self.bitmap.fill(0)
+                self.last_row = -1
+            self.draw(self.width - history.count + i, history.get(i))
+            i += 1
+            self.redraw_next = i if i < history.count else -1
+            return True
+        if self.pending:
+            shift_left(self.bitmap, self.width, self.height)
+            self.draw(self.width - 1, history.get(history.count - self.pending))
+            self.pending -= 1
+            return True
+        return False
+
+    def stats(self) -> dict:
+        return {"columns": self.columns, "redraws": self.redraws, "low": self.low, "high": self.high}
+
+
+class HistoryView:
+    def __init__(self, renderer, plots: tuple, pages: tuple, page_seconds: float = 10, budget: float = 0.02,
+                 clock=None):
+        # pages holds the elements (labels, plot tilegrids, captions) shown on each page, the first is shown first.
+        # budget is the longest one update spends drawing columns.
+        self.renderer = renderer
+        self.plots = plots
+        self.pages = pages
+        self.page_seconds = page_seconds
+        self.budget = budget
+        self.clock = clock or time.monotonic
+        self.page = 0
+        self.page_started = 0.0
+        # counters
+        self.page_turns = 0
+        self.draw_time = 0.0
+        self.max_draw = 0.0
+        self.deferred = 0
+        self.show(0)
+
+    def show(self, page: int):
+        for i in range(len(self.pages)):
+            for element in self.pages[i]:
+                element.hidden = i != page
+        self.page = page
+        self.page_started = self.clock()
+        self.renderer.dirty = True
+
+    def push(self, data, sample):
+        # One sample's readings, sample is the acquisition's SampleSet they were processed from
+        for plot in self.plots:
+            failed = False
+            for name in plot.sources:
+                if sample.failed(name):
+                    failed = True
+            plot.push(data[plot.key], failed)
+
+    def update(self) -> bool:
+        # Turns the page when it is due and draws pending columns until the budget is spent, True if the frame
+        # changed
+        now = self.clock()
+        turned = False
+        if len(self.pages) > 1 and now - self.page_started >= self.page_seconds:
+            self.show((self.page + 1) % len(self.pages))
+            self.page_turns += 1
+            turned = True
+        deadline = now + self.budget
+        drew = False
+        working = True
+        while working and self.clock() < deadline:
+            working = False
+            for plot in self.plots:
+                if plot.step():
+                    working = True
+                    drew = True
+        if not drew:
+            return turned
+        spent = self.clock() - now
+        self.draw_time += spent
+        self.max_draw = max(self.max_draw, spent)
+        for plot in self.plots:
+            if plot.busy:
+                self.deferred += 1
+                break
+        # columns drawn behind another page only change what it shows later
+        if not self.plots[0].grid.hidden:
+            self.renderer.dirty = True
+            return True
+        return turned
+
+    def stats(self) -> dict:
+        return {
+            "page": self.page,
+            "page_turns": self.page_turns,
+            "draw_s": self.draw_time,
+            "max_draw_s": self.max_draw,
+            "deferred_draws": self.deferred,
+            "plots": dict((plot.key, plot.stats()) for plot in self.plots),
+        }
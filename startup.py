@@ -0,0 +1,211 @@
+# Fault-tolerant startup for the biofilm cell factory
+# Local peripherals are brought up one at a time and a part that doesn't answer is replaced by an Unavailable
+# placeholder instead of aborting the constructor; any later use of it raises PeripheralUnavailable, so the code
+# around it takes the error path it already has for a failing sensor or SD card. WiFi and Adafruit IO are not
+# touched at boot: NetworkLink brings them up one step per call from the MQTT task once sampling is running,
+# backing off between failed attempts, and readings queue in the outbox (spilling to SD) until it's up.
+# ===================================================================================================================
+
+import random
+import time
+
+
+class PeripheralUnavailable(OSError):
+    pass
+
+
+class Unavailable:
+    # Placeholder for a peripheral that failed to start. Reading any attribute raises, `fail` can be handed out
+    # where a callable is expected, e.g. as an open() for a card that didn't mount.
+    def __init__(self, name: str, error: Exception = None):
+        self.name = name
+        self.error = error
+
+    def __getattr__(self, attribute: str):
+        raise PeripheralUnavailable(f"{self.name} unavailable")
+
+    def __getitem__(self, key):
+        raise PeripheralUnavailable(f"{self.name} unavailable")
+
+    def fail(self, *args, **kwargs):
+        raise PeripheralUnavailable(f"{self.name} unavailable")
+
+
+def available(peripheral) -> bool:
+    return not isinstance(peripheral, Unavailable)
+
+
+class SystemRTC:
+    # Stands in for a DS3231 that didn't answer, the board's own clock keeps the timestamps going
+    lost_power = False
+
+    @property
+    def datetime(self) -> time.struct_time:
+        return time.localtime()
+
+
+class StartupReport:
+    def __init__(self, clock=None):
+        self.clock = clock or time.monotonic
+        self.started = self.clock()
+        # name -> (seconds, error or None), in bring-up order
+        self.peripherals = {}
+        self.first_sample_at = None
+        # called before each bring-up, the supervisor's watchdog feed
+        self.feed = None
+        # time network steps held up the event loop after bring-up, in total and the longest step
+        self.blocked = 0.0
+        self.max_block = 0.0
+
+    def bring_up(self, name: str, factory, fallback=None):
+        # factory() or, when it raises, fallback (an Unavailable by default)
+        if self.feed is not None:
+            self.feed()
+        start = self.clock()
+        try:
+            peripheral = factory()
+            error = None
+        except Exception as e:
+            print(f"{name} unavailable: {e}")
+            peripheral = fallback if fallback is not None else Unavailable(name, e)
+            error = e
+        self.peripherals[name] = (self.clock() - start, error)
+        return peripheral
+
+    def mark(self, name: str, seconds: float, error: Exception = None):
+        self.peripherals[name] = (seconds, error)
+
+    def block(self, seconds: float):
+        # A step that ran inside the event loop, nothing else ran meanwhile
+        self.blocked += seconds
+        self.max_block = max(self.max_block, seconds)
+
+    def first_sample(self) -> bool:
+        # Records the first sample, True the first time only
+        if self.first_sample_at is not None:
+            return False
+        self.first_sample_at = self.clock()
+        print(f"First sample {self.first_sample_at - self.started:.2f} s after startup")
+        return True
+
+    @property
+    def time_to_first_sample(self) -> float:
+        if self.first_sample_at is None:
+            return None
+        return self.first_sample_at - self.started
+
+    @property
+    def unavailable(self) -> list:
+        return [name for name, (_, error) in self.peripherals.items() if error is not None]
+
+    def stats(self) -> dict:
+        return {
+            "time_to_first_sample_s": self.time_to_first_sample,
+            "bring_up_ms": dict((name, 1000 * seconds) for name, (seconds, _) in self.peripherals.items()),
+            "unavailable": self.unavailable,
+            "network_blocked_s": self.blocked,
+            "max_network_block_s": self.max_block,
+        }
+
+
+class NetworkLink:
+    # WiFi and Adafruit IO, brought up lazily one step per service() call
+    STEPS = ("wifi", "adafruit_io", "subscribe")
+
+    def __init__(self, backend, feeds: tuple = (), report: StartupReport = None, base_delay: float = 2,
+                 max_delay: float = 300, step_timeout: int = 5, io_options: dict = None, clock=None, rng=None):
+        # step_timeout bounds the WiFi join and the broker connect (one attempt each): a step runs inside the event
+        # loop and holds up sampling, SD and display while it blocks, and must fit within the watchdog's timeout.
+        # io_options are backend.adafruit_io's broker, port and topic prefix.
+        self.backend = backend
+        # feeds subscribed to once connected
+        self.feeds = feeds
+        self.report = report
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.step_timeout = step_timeout
+        self.io_options = io_options or {}
+        self.clock = clock or time.monotonic
+        self.rng = rng or random
+        # called before each step, the supervisor's watchdog feed
+        self.feed = None
+        self.esp = None
+        self.wifi = None
+        self.io = None
+        self.step = 0
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.outboxes = []
+        self.up_at = None
+
+    @property
+    def up(self) -> bool:
+        return self.step == len(self.STEPS)
+
+    def attach(self, outbox):
+        # The outbox holds its readings until the link is up, then publishes through it
+        self.outboxes.append(outbox)
+        if self.up:
+            self.connect_outbox(outbox)
+
+    def connect_outbox(self, outbox):
+        outbox.io = self.io
+        outbox.wifi = self.wifi
+        outbox.connected = True
+        outbox.next_attempt = 0.0
+
+    def service(self) -> bool:
+        # Runs at most one bring-up step if the backoff window has passed, returns whether the link is up
+        if self.up:
+            return True
+        if self.clock() < self.next_attempt:
+            return False
+        name = self.STEPS[self.step]
+        if self.feed is not None:
+            self.feed()
+        start = self.clock()
+        try:
+            if name == "wifi":
+                if self.wifi is None:
+                    self.esp, self.wifi = self.backend.wifi()
+                self.wifi.connect(timeout=self.step_timeout, retries=1)
+                print("WiFi connected")
+            elif name == "adafruit_io":
+                if self.io is None:
+                    self.io = self.backend.adafruit_io(self.esp, timeout=self.step_timeout, **self.io_options)
+                self.io.connect()
+            else:
+                for feed_id in self.feeds:
+                    self.io.subscribe(feed_id)
+        except Exception as e:
+            self.fail(name, e)
+            if self.report is not None:
+                self.report.mark(name, self.clock() - start, e)
+                self.report.block(self.clock() - start)
+            return False
+        if self.report is not None:
+            self.report.mark(name, self.clock() - start)
+            self.report.block(self.clock() - start)
+        self.step += 1
+        self.failures = 0
+        if self.up:
+            self.up_at = self.clock()
+            for outbox in self.outboxes:
+                self.connect_outbox(outbox)
+        return self.up
+
+    def fail(self, step: str, error: Exception):
+        self.failures += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        # equal jitter, as the outbox's retries
+        delay = delay / 2 + self.rng.random() * delay / 2
+        self.next_attempt = self.clock() + delay
+        print(f"Network {step} failed ({error}), retrying in {delay:.1f} s")
+
+    def stats(self) -> dict:
+        return {
+            "up": self.up,
+            "step": self.STEPS[self.step] if not self.up else None,
+            "failures": self.failures,
+            "retry_in_s": max(0.0, self.next_attempt - self.clock()),
+        }
@@ -0,0 +1,131 @@
+# Rate-aware upload throttling for Adafruit IO
+# Adafruit IO counts every feed value as one data point against a per-minute budget (30/min on the free tier).
+# A token bucket refilled at the budget gates what the outbox may publish, and the governor downsamples fast
+# sampling into one mean (optionally min/max) per window, the window being sized so one message per window
+# fits the budget. The SD card still gets every raw sample.
+# ===================================================================================================================
+
+import time
+from array import array
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, clock=None):
+        # rate in tokens per second, burst is the bucket size
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock or time.monotonic
+        self.tokens = burst
+        self.updated = self.clock()
+        self.denied = 0
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def available(self) -> float:
+        self.refill()
+        return self.tokens
+
+    def take(self, tokens: float = 1) -> bool:
+        self.refill()
+        if self.tokens < tokens:
+            self.denied += 1
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class WindowAggregator:
+    # Running mean/min/max of a fixed number of channels, preallocated so adding a sample doesn't allocate
+    def __init__(self, channels: int):
+        self.channels = channels
+        self.sums = array("f", [0.0] * channels)
+        self.minimums = array("f", [0.0] * channels)
+        self.maximums = array("f", [0.0] * channels)
+        self.count = 0
+
+    def add(self, values: tuple):
+        if self.count == 0:
+            for i in range(self.channels):
+                value = values[i]
+                self.sums[i] = value
+                self.minimums[i] = value
+                self.maximums[i] = value
+        else:
+            for i in range(self.channels):
+                value = values[i]
+                self.sums[i] += value
+                if value < self.minimums[i]:
+                    self.minimums[i] = value
+                if value > self.maximums[i]:
+                    self.maximums[i] = value
+        self.count += 1
+
+    def means(self) -> tuple:
+        return tuple(total / self.count for total in self.sums)
+
+    def reset(self):
+        self.count = 0
+
+
+class PublishGovernor:
+    def __init__(self, outbox, bucket: TokenBucket, channels: int, extremes: bool = False, clock=None):
+        self.outbox = outbox
+        self.bucket = bucket
+        self.channels = channels
+        # publish min and max feeds alongside the means
+        self.extremes = extremes
+        self.clock = clock or time.monotonic
+        # fraction of the bucket's rate this governor may use when several share one account
+        self.share = 1.0
+        self.aggregator = WindowAggregator(channels)
+        self.window_start = self.clock()
+        self.last_epoch = 0
+        self.windows = 0
+        self.samples = 0
+
+    @property
+    def window(self) -> float:
+        # Shortest window whose single message fits the sustained budget
+        return len(self.outbox.feeds) / (self.bucket.rate * self.share)
+
+    @staticmethod
+    def feed_keys(feeds: tuple, extremes: bool) -> tuple:
+        if not extremes:
+            return tuple(feeds)
+        return tuple(feeds) + tuple(feed + "-min" for feed in feeds) + tuple(feed + "-max" for feed in feeds)
+
+    def offer(self, values: tuple, epoch: int = 0) -> bool:
+        # Add a raw sample, returns True when a window closed and its aggregate was queued
+        self.aggregator.add(values)
+        self.last_epoch = epoch
+        self.samples += 1
+        if self.clock() - self.window_start < self.window:
+            return False
+        return self.close_window()
+
+    def close_window(self) -> bool:
+        aggregator = self.aggregator
+        if not aggregator.count:
+            return False
+        values = aggregator.means()
+        if self.extremes:
+            values += tuple(aggregator.minimums) + tuple(aggregator.maximums)
+        self.outbox.put(values, self.last_epoch)
+        aggregator.reset()
+        self.window_start = self.clock()
+        self.windows += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "window_s": self.window,
+            "windows": self.windows,
+            "samples": self.samples,
+            "pending_samples": self.aggregator.count,
+            "tokens": self.bucket.available,
+            "denied": self.bucket.denied,
+        }